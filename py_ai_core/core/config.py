@@ -1,5 +1,7 @@
 # --- START OF FILE py_ai_core/core/config.py (Final Encoding-Safe Version) ---
 
+from typing import Any, Dict, List, Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -15,8 +17,143 @@ class Settings(BaseSettings):
     DATABASE_PORT: int
     DATABASE_NAME: str
 
+    # --- 数据库连接池 ---
+    DB_ECHO: bool = False  # 是否打印所有 SQL 语句，仅建议在开发时开启
+    DB_POOL_SIZE: int = 10  # 常驻连接数
+    DB_MAX_OVERFLOW: int = 20  # 高峰期允许额外创建的连接数
+    DB_POOL_TIMEOUT_SECONDS: float = 30.0  # 等待空闲连接的最长时间
+    DB_POOL_RECYCLE_SECONDS: int = 1800  # 连接最长存活时间，避免被服务端或中间件断开
+    DB_POOL_PRE_PING: bool = True  # 取出连接前先探活
+    DB_STATEMENT_CACHE_SIZE: int = 100  # 每个连接的预编译语句缓存，经 pgbouncer 事务模式时设为 0
+
     # --- 会话管理 ---
-    MAX_HISTORY_MESSAGES: int = 10
+    MAX_HISTORY_MESSAGES: int = 10  # 已弃用: 历史窗口改为按 token 预算截取，保留仅为兼容旧的 .env
+    HISTORY_TOKEN_BUDGET: int = 4000  # 历史窗口默认的 token 预算
+    HISTORY_TOKEN_BUDGETS: Dict[str, int] = {}  # 按模型名单独配置的预算 (JSON)，优先于默认值
+    HISTORY_FETCH_LIMIT: int = 200  # 构建窗口时最多读取/缓存的最近消息条数
+    # "sliding": 窗口起点逐条滑动，尽量装满预算；
+    # "aligned": 起点只落在按序号对齐的块边界上，多轮之间提示词前缀保持不变，便于命中上游的提示词缓存
+    HISTORY_WINDOW_MODE: Literal["sliding", "aligned"] = "sliding"
+    HISTORY_BLOCK_SIZE: int = 10  # aligned 模式下块的消息条数
+
+    # --- 滚动摘要 ---
+    SUMMARY_ENABLED: bool = False  # 是否把窗口装不下的较早消息压缩进会话摘要（会产生额外的模型调用）
+    SUMMARY_TRIGGER_TOKENS: int = 1000  # 窗口外尚未摘要的消息累计超过该 token 数时才触发
+    SUMMARY_MAX_TOKENS: int = 500  # 摘要的最大长度
+    SUMMARY_MODEL_NAME: Optional[str] = None  # 生成摘要使用的模型，默认与 MODEL_NAME 相同
+    SESSION_CACHE_TTL_SECONDS: int = 300  # 会话在缓存中无写入后的存活时间
+
+    # --- 历史写入 ---
+    # "sync": 请求内同步提交；"write_behind": 交给后台写入器批量提交，见 history_writer.py
+    HISTORY_WRITE_MODE: Literal["sync", "write_behind"] = "sync"
+    HISTORY_WRITER_BATCH_SIZE: int = 200  # 每批最多合并的对话轮数
+    HISTORY_WRITER_FLUSH_INTERVAL_MS: int = 50  # 攒批的最长等待时间
+    HISTORY_WRITER_MAX_PENDING: int = 10000  # 队列上限，满了之后写入方会等待
+    HISTORY_WRITER_MAX_RETRIES: int = 3
+    HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS: float = 30.0  # 关闭时写完队列、读取前等待会话落库的最长时间
+    HISTORY_WRITER_SYNCHRONOUS_COMMIT: bool = True  # False 时以 synchronous_commit=off 提交
+
+    # --- 多提供方路由 (见 services/provider_pool.py) ---
+    # JSON 列表，每项可含 name / base_url / api_key / model / weight；为空时只使用上面的单个端点
+    LLM_PROVIDERS: List[Dict[str, Any]] = []
+    LLM_ROUTING_POLICY: Literal["lowest_latency", "weighted", "fallback"] = "lowest_latency"  # 见 provider_pool.py 的说明
+    LLM_EWMA_ALPHA: float = 0.2  # 延迟 EWMA 的平滑系数
+    LLM_BREAKER_FAILURE_THRESHOLD: int = 5  # 连续失败多少次后熔断
+    LLM_BREAKER_RESET_SECONDS: float = 30.0  # 熔断多久后放行试探请求
+    LLM_HEDGING_ENABLED: bool = False  # 超过 p95 延迟时向另一个提供方发送对冲请求
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 1.0  # 对冲前的最短等待时间，样本不足时也使用该值
+
+    # --- 上游 HTTP 连接池 (所有提供方共用，见 core/http_client.py) ---
+    LLM_HTTP2: bool = True  # 开启 HTTP/2 多路复用
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = 60.0  # 空闲连接保留时长
+    LLM_CONNECT_TIMEOUT_SECONDS: float = 5.0  # 建立连接（含 TLS 握手）的超时
+    LLM_READ_TIMEOUT_SECONDS: float = 60.0  # 两次收到数据之间的最长间隔
+    LLM_POOL_TIMEOUT_SECONDS: float = 10.0  # 等待连接池空闲连接的超时
+    LLM_TOTAL_TIMEOUT_SECONDS: float = 120.0  # 单次非流式调用的总超时，0 表示不限制
+    LLM_HTTP_WARMUP: bool = True  # 启动时预热到各提供方的连接
+
+    # --- 上游并发限制与重试 (见 services/concurrency_limiter.py) ---
+    LLM_CONCURRENCY_INITIAL: int = 16  # 每个提供方初始的在途请求上限，之后按 AIMD 自适应调整
+    LLM_CONCURRENCY_MIN: int = 1
+    LLM_CONCURRENCY_MAX: int = 128
+    LLM_QUEUE_MAX: int = 256  # 每个提供方的等待队列长度，满了之后直接返回 503
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 10.0  # 排队超过该时长返回 503
+    LLM_OVERLOAD_RETRY_AFTER_SECONDS: int = 5  # 返回 503 时建议客户端等待的秒数
+    LLM_MAX_RETRIES: int = 2  # 所有提供方都暂时失败时的整体重试次数
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 0.5
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 20.0
+
+    # 同时进行中的相同大模型请求只向上游发送一次，结果由所有调用方共享
+    LLM_SINGLE_FLIGHT_ENABLED: bool = True
+
+    # --- 大模型响应缓存 ---
+    RESPONSE_CACHE_ENABLED: bool = False  # 相同的请求直接返回缓存的响应
+    RESPONSE_CACHE_TTL_SECONDS: int = 3600
+    RESPONSE_CACHE_SEMANTIC_ENABLED: bool = False  # 单轮提问按向量相似度复用响应
+    RESPONSE_CACHE_SEMANTIC_THRESHOLD: float = 0.95  # 余弦相似度阈值
+    # 向量化请求同样经提供方池路由，所有提供方都需要支持该模型
+    RESPONSE_CACHE_EMBEDDING_MODEL: str = "text-embedding-v3"
+    RESPONSE_CACHE_INDEX_SIZE: int = 1000  # 进程内向量索引最多保留的问题数
+
+    # --- token 用量统计 (见 services/usage_service.py) ---
+    USAGE_ACCOUNTING_ENABLED: bool = True  # 是否把每个会话的用量汇总写入 llm_usage_rollups 表
+    USAGE_ROLLUP_BUCKET: Literal["minute", "hour", "day"] = "hour"  # 汇总的时间粒度
+
+    # --- 共享状态后端 (会话缓存、健康检查缓存、限流计数) ---
+    STATE_BACKEND: Literal["memory", "redis"] = "memory"  # 进程内存或 Redis
+    REDIS_URL: str = "redis://localhost:6379/0"
+    STATE_KEY_PREFIX: str = "py_ai_core:"  # Redis 中所有键的前缀
+    STATE_MEMORY_MAXSIZE: int = 10000  # 进程内后端最多保留的键数
+
+    # --- 工具调用循环 ---
+    MAX_TOOL_ROUNDS: int = 5  # 单个请求内最多进行的工具调用轮数
+    TOOL_MAX_CONCURRENCY: int = 8  # 全局共享的工具并发执行上限
+    AGENT_TOKEN_BUDGET: int = 0  # 单个请求的 token 预算，0 表示不限制
+    AGENT_TIME_BUDGET_SECONDS: float = 60.0  # 单个请求的时间预算，0 表示不限制
+    TOOL_DEFAULT_TIMEOUT_SECONDS: float = 30.0  # 未声明 timeout 的工具单次调用的时间上限，0 表示不限制
+    TOOL_PURE_CACHE_TTL_SECONDS: float = 3600.0  # 纯函数工具结果的默认缓存时长
+
+    # --- 工具筛选 (见 tools/selection.py) ---
+    TOOL_SELECTION_MODE: Literal["off", "shadow", "on"] = "off"  # shadow: 只统计召回率；on: 只提供筛选出的工具
+    TOOL_SELECTION_TOP_K: int = 8  # 按问题检索出的工具数
+    TOOL_SELECTION_PINNED: List[str] = []  # 总是提供给模型的工具名
+
+    # --- calculate 工具的表达式引擎 (见 tools/expression.py) ---
+    CALC_MAX_EXPRESSION_LENGTH: int = 1000  # 表达式的最大字符数
+    CALC_MAX_EXPONENT: float = 10000  # 乘方指数的绝对值上限
+    CALC_MAX_RESULT_BITS: int = 4096  # 整数结果的最大二进制位数（约 1233 位十进制）
+    CALC_MAX_VECTOR_ROWS: int = 10000  # 向量模式下一次最多代入的取值组数
+    CALC_CACHE_SIZE: int = 1024  # 编译结果缓存的表达式个数
+
+    # --- 工具沙箱 (cpu_bound / untrusted 工具，见 tools/sandbox.py) ---
+    TOOL_SANDBOX_ENABLED: bool = True  # 关闭时这些工具也直接在事件循环里执行
+    TOOL_SANDBOX_WORKERS: int = 2  # 工作进程数，即同时执行的沙箱调用数
+    TOOL_SANDBOX_CPU_SECONDS: float = 2.0  # 单次调用的 CPU 时间上限，0 表示不限制（需要 resource 模块）
+    TOOL_SANDBOX_WALL_SECONDS: float = 5.0  # 单次调用的墙钟时间上限
+    TOOL_SANDBOX_MEMORY_MB: int = 512  # 每个工作进程的地址空间上限，0 表示不限制（需要 resource 模块）
+    TOOL_SANDBOX_MAX_CALLS_PER_WORKER: int = 100  # 工作进程执行这么多次后回收
+
+    # --- 批量聊天 (见 mcp/batch.py) ---
+    BATCH_MAX_ITEMS: int = 10000  # 单个批次最多的条目数
+    BATCH_DEFAULT_CONCURRENCY: int = 4  # 未指定时单个批次同时执行的条目数
+    BATCH_MAX_CONCURRENCY: int = 32
+    BATCH_RESULT_TTL_SECONDS: int = 86400  # 指定 batch_id 时已完成结果的保留时长，用于断点续跑
+
+    # --- 异步聊天任务队列 (见 mcp/jobs.py) ---
+    # 每个进程处理 chat_jobs 的 worker 数。默认 0: API 进程只接收任务，
+    # 由单独的 `python -m py_ai_core.mcp.jobs` 进程执行，长任务不占用 API 进程的事件循环
+    JOB_WORKERS: int = 0
+    JOB_POLL_INTERVAL_SECONDS: float = 1.0  # 队列为空时的轮询间隔
+    JOB_HEARTBEAT_SECONDS: float = 10.0  # 运行中任务的心跳间隔，同时用于发现取消请求
+    JOB_LEASE_SECONDS: float = 60.0  # 超过该时长没有心跳的运行中任务视为 worker 已崩溃，重新入队
+    JOB_MAX_ATTEMPTS: int = 3  # 每个任务最多执行的次数
+    JOB_CALLBACK_TIMEOUT_SECONDS: float = 10.0
+    JOB_CALLBACK_MAX_RETRIES: int = 3
+    # 允许回调的主机名。为空时允许任何解析到公网地址的主机；
+    # 非空时只允许列表中的主机（可用于放行内网的回调服务）
+    JOB_CALLBACK_ALLOWED_HOSTS: List[str] = []
     
     # --- 日志系统的高级配置 ---
     LOG_PAYLOADS: bool = False 
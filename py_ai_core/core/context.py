@@ -5,4 +5,27 @@ from contextvars import ContextVar
 # 'request_id'是变量名，default=None是当变量未设置时的默认值
 request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
 
+# 当前请求累计的大模型 token 用量。请求入口放入一个可变字典，
+# LLMService 在每次上游调用后向其中累加，调用方据此做预算控制。
+llm_usage_var: ContextVar[dict | None] = ContextVar("llm_usage", default=None)
+
+
+# 当前请求是否跳过大模型响应缓存（例如客户端要求重新生成回答）
+llm_cache_bypass_var: ContextVar[bool] = ContextVar("llm_cache_bypass", default=False)
+
+
+def new_llm_usage() -> dict:
+    """创建一个空的 token 用量记录。"""
+    return {
+        "llm_calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_tokens": 0,  # prompt_tokens 中命中上游提示词缓存的部分
+        "total_tokens": 0,
+        # 与进行中的相同请求合并、没有单独调用上游的次数。这些调用的用量只计入
+        # total_tokens（用于预算控制），不计入 llm_calls 与各项 token 数，避免重复计费
+        "coalesced_calls": 0,
+    }
+
+
 # --- END OF FILE py_ai_core/core/context.py ---
@@ -1,16 +1,73 @@
 # py_ai_core/core/database.py
 
+import time
+
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import settings
 
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    在默认连接池的基础上统计“等待连接”的情况。
+    当池中已无空闲连接、且溢出连接也已用满时，新的取连接请求只能排队等待，
+    这正是池子偏小（或连接被长时间占用）的信号。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waiting = 0
+        self.total_waits = 0
+        self.total_wait_ms = 0.0
+        self.total_timeouts = 0
+
+    def connect(self):
+        # 统计放在公开的 connect() 上而不是 _do_get(): QueuePool._do_get 在竞争时会递归调用自身，
+        # 覆盖它会把同一次等待重复计数。
+        # 是否需要等待与 QueuePool 自己的判断一致: 队列里没有空闲连接且溢出连接已用满。
+        # 从这里到真正阻塞在队列上之间没有 I/O，不会切换到其他协程，判断结果不会过时。
+        must_wait = (
+            self._max_overflow > -1
+            and self._overflow >= self._max_overflow
+            and self._pool.empty()
+        )
+        if not must_wait:
+            return super().connect()
+
+        self.waiting += 1
+        self.total_waits += 1
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            self.total_timeouts += 1
+            raise
+        finally:
+            self.waiting -= 1
+            self.total_wait_ms += (time.perf_counter() - start) * 1000
+
+
 # 1. 创建一个异步的数据库引擎 (Engine)
 #    - an Engine is the starting point for any SQLAlchemy application.
 #    - It’s the “home base” for the actual database and its DBAPI.
-#    - echo=True 会打印出所有执行的 SQL 语句，在开发时非常有用，生产环境可以关闭。
+#    - 连接池与语句缓存的参数都来自配置，便于根据 worker 数量调整。
+#    - 默认不打印 SQL（DB_ECHO），避免每条语句都写入控制台和日志文件。
 engine = create_async_engine(
     settings.ASYNC_DATABASE_URL,
-    echo=True,  # 方便调试，可以看到生成的 SQL
+    echo=settings.DB_ECHO,
+    poolclass=InstrumentedQueuePool,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={
+        # SQLAlchemy 自身的预编译语句缓存，以及 asyncpg 内部的语句缓存
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    },
 )
 
 # 2. 创建一个异步的会话工厂 (Session Factory)
@@ -43,3 +100,20 @@ async def get_db() -> AsyncSession:
             yield session
         finally:
             await session.close()
+
+
+def get_pool_stats() -> dict:
+    """返回连接池的实时状态，用于根据 worker 数量评估池子大小。"""
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        # 池子尚未填满时 SQLAlchemy 返回负数，这里只关心真正的溢出连接数
+        "overflow": max(pool.overflow(), 0),
+        "waiting": pool.waiting,
+        "total_waits": pool.total_waits,
+        "total_wait_ms": round(pool.total_wait_ms, 2),
+        "total_timeouts": pool.total_timeouts,
+    }
@@ -0,0 +1,77 @@
+# --- START OF FILE py_ai_core/core/http_client.py ---
+
+"""
+大模型上游调用共享的 HTTP 连接池。
+
+所有提供方的 AsyncOpenAI 客户端共用同一个 httpx.AsyncClient:
+- 开启 HTTP/2 时，同一上游的并发请求复用一条连接多路传输，省去反复的 TCP/TLS 握手；
+- 连接数、keep-alive 与连接/读取/排队超时都可配置；
+- 应用启动时预热连接，关闭时统一释放。
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, Iterable
+
+import httpx
+
+from py_ai_core.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def create_llm_http_client() -> httpx.AsyncClient:
+    """根据配置创建上游调用使用的 HTTP 客户端。"""
+    return httpx.AsyncClient(
+        http2=settings.LLM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings.LLM_CONNECT_TIMEOUT_SECONDS,
+            read=settings.LLM_READ_TIMEOUT_SECONDS,
+            write=settings.LLM_READ_TIMEOUT_SECONDS,
+            pool=settings.LLM_POOL_TIMEOUT_SECONDS,
+        ),
+    )
+
+
+async def warm_up(client: httpx.AsyncClient, base_urls: Iterable[str]) -> None:
+    """
+    向每个上游地址发送一个轻量请求，提前建立连接并完成 TLS 握手。
+    只关心连接是否建立，响应状态码不重要；失败只记录日志，不影响启动。
+    """
+
+    async def touch(url: str) -> None:
+        try:
+            await client.head(url)
+            logger.info("已预热到 %s 的连接。", url)
+        except httpx.HTTPError as e:
+            logger.warning("预热到 %s 的连接失败: %s", url, e)
+
+    await asyncio.gather(*(touch(url) for url in dict.fromkeys(base_urls)))
+
+
+def http_pool_stats(client: httpx.AsyncClient) -> Dict[str, Any]:
+    """
+    返回连接池的实时状态。依赖 httpcore 连接池的内部结构，
+    取不到时对应的计数为 0，不影响调用方。
+    """
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return {
+        "http2_enabled": settings.LLM_HTTP2,
+        "max_connections": settings.LLM_MAX_CONNECTIONS,
+        "max_keepalive_connections": settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "http2_connections": sum(1 for conn in connections if "HTTP/2" in conn.info()),
+        "requests_in_flight": len(getattr(pool, "_requests", [])),
+    }
+
+
+# --- END OF FILE py_ai_core/core/http_client.py ---
@@ -5,7 +5,7 @@ import uuid
 import logging
 from fastapi import Request, Response
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
-from py_ai_core.core.context import request_id_var
+from py_ai_core.core.context import llm_usage_var, new_llm_usage, request_id_var
 
 access_logger = logging.getLogger("py_ai_core.access")
 
@@ -16,6 +16,9 @@ class CtxTimingMiddleware(BaseHTTPMiddleware):
     ) -> Response:
         request_id = str(uuid.uuid4())
         token = request_id_var.set(request_id)
+        # 本请求内所有上游调用的 token 用量都累加到这个字典里
+        usage = new_llm_usage()
+        usage_token = llm_usage_var.set(usage)
 
         start_time = time.time()
         response = await call_next(request)
@@ -42,9 +45,21 @@ class CtxTimingMiddleware(BaseHTTPMiddleware):
             "duration": {"ms": process_time_ms},
         }
 
+        # 流式响应在这里返回时才开始推送，它的用量不在访问日志里，只计入会话汇总
+        if usage["llm_calls"]:
+            extra_data["llm"] = {
+                "usage": dict(usage),
+                "cached_token_ratio": (
+                    usage["cached_tokens"] / usage["prompt_tokens"]
+                    if usage["prompt_tokens"]
+                    else 0.0
+                ),
+            }
+
         # 使用 extra 参数传递这个字典，python-json-logger会自动处理
         access_logger.info(log_message, extra=extra_data)
 
+        llm_usage_var.reset(usage_token)
         request_id_var.reset(token)
 
         return response
@@ -0,0 +1,127 @@
+# --- START OF FILE py_ai_core/core/state_backend.py ---
+
+"""
+可插拔的共享状态后端。
+
+会话热缓存、健康检查缓存等需要在多个 worker / Pod 之间共享的短期状态，
+都通过这里的 `StateBackend` 接口读写：
+- `InMemoryStateBackend`: 进程内实现，适合单 worker 部署和测试。
+- `RedisStateBackend`: 基于 Redis 协议的实现，适合多 worker / 多实例部署。
+
+通过配置项 STATE_BACKEND ("memory" 或 "redis") 选择具体实现。
+"""
+
+import json
+import logging
+import math
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+
+from cachetools import TLRUCache
+
+from py_ai_core.core.config import settings
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # redis 是可选依赖，只有选用 Redis 后端时才需要
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend(ABC):
+    """共享状态后端的抽象接口。所有值都必须可以被 JSON 序列化。"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Any]:
+        """读取一个键，不存在或已过期时返回 None。"""
+
+    @abstractmethod
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """写入一个键。ttl 为秒数，None 表示不过期。"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """删除一个键。"""
+
+    async def close(self) -> None:
+        """释放后端持有的连接等资源。"""
+
+
+def _ttl_to_expiry(key, item, now):
+    ttl = item[0]
+    return now + ttl if ttl is not None else math.inf
+
+
+class InMemoryStateBackend(StateBackend):
+    """
+    进程内状态后端，带逐键 TTL 与 LRU 淘汰。
+    值按引用保存，调用方不应原地修改读出的对象。
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self._cache: TLRUCache = TLRUCache(maxsize=maxsize, ttu=_ttl_to_expiry)
+
+    async def get(self, key: str) -> Optional[Any]:
+        item = self._cache.get(key)
+        return item[1] if item is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self._cache[key] = (ttl, value)
+
+    async def delete(self, key: str) -> None:
+        self._cache.pop(key, None)
+
+
+class RedisStateBackend(StateBackend):
+    """
+    基于 Redis 协议的状态后端，值以 JSON 字符串保存。
+    可以传入现成的客户端（例如测试中的 fakeredis），否则根据 url 创建。
+    """
+
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = ""):
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError(
+                    "STATE_BACKEND=redis 需要安装 redis 包: pip install 'py-ai-core[redis]'"
+                )
+            client = aioredis.from_url(url)
+        self._client = client
+        self._prefix = prefix
+
+    async def get(self, key: str) -> Optional[Any]:
+        raw = await self._client.get(self._prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        payload = json.dumps(value, ensure_ascii=False)
+        px = max(int(ttl * 1000), 1) if ttl is not None else None
+        await self._client.set(self._prefix + key, payload, px=px)
+
+    async def delete(self, key: str) -> None:
+        await self._client.delete(self._prefix + key)
+
+    async def close(self) -> None:
+        await self._client.aclose()
+
+
+def create_state_backend() -> StateBackend:
+    """根据配置创建状态后端。"""
+    if settings.STATE_BACKEND == "redis":
+        logger.info("使用 Redis 状态后端: %s", settings.REDIS_URL)
+        return RedisStateBackend(
+            url=settings.REDIS_URL, prefix=settings.STATE_KEY_PREFIX
+        )
+    logger.info("使用进程内状态后端。")
+    return InMemoryStateBackend(maxsize=settings.STATE_MEMORY_MAXSIZE)
+
+
+def rate_limit_storage_uri() -> str:
+    """slowapi 限流器的存储地址，与状态后端保持一致。"""
+    return settings.REDIS_URL if settings.STATE_BACKEND == "redis" else "memory://"
+
+
+# 创建一个全局单例
+state_backend = create_state_backend()
+
+# --- END OF FILE py_ai_core/core/state_backend.py ---
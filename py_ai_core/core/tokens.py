@@ -0,0 +1,83 @@
+# --- START OF FILE py_ai_core/core/tokens.py ---
+
+"""
+消息 token 数估算与历史窗口的 token 预算。
+
+安装了 tiktoken 时使用对应模型的分词器精确计数（未知模型回退到 cl100k_base），
+否则使用一个偏保守的启发式估算：CJK 字符按每字 1 个 token，其余字符按每 4 个字符 1 个 token。
+每条消息的 token 数在写入时计算一次，与消息一起保存，构建上下文时直接累加。
+"""
+
+import json
+import logging
+import math
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from py_ai_core.core.config import settings
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken 是可选依赖，没有安装时使用启发式估算
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# 每条消息在聊天格式中的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=32)
+def _get_encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        logger.debug("tiktoken 不认识模型 '%s'，使用 cl100k_base 分词。", model)
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _is_cjk(char: str) -> bool:
+    code = ord(char)
+    return (
+        0x4E00 <= code <= 0x9FFF  # 中日韩统一表意文字
+        or 0x3400 <= code <= 0x4DBF  # 扩展 A
+        or 0x3040 <= code <= 0x30FF  # 日文假名
+        or 0xAC00 <= code <= 0xD7AF  # 韩文音节
+        or 0x3000 <= code <= 0x303F  # 中文标点
+        or 0xFF00 <= code <= 0xFFEF  # 全角字符
+    )
+
+
+def count_text_tokens(text: str, model: Optional[str] = None) -> int:
+    """估算一段文本的 token 数。"""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        return len(_get_encoding(model or settings.MODEL_NAME).encode(text))
+    cjk = sum(1 for char in text if _is_cjk(char))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_message_tokens(message: Dict[str, Any], model: Optional[str] = None) -> int:
+    """估算一条聊天消息（含工具调用的函数名与参数）占用的 token 数。"""
+    content = message.get("content")
+    if content is not None and not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    parts = [content or "", message.get("name") or ""]
+    for tool_call in message.get("tool_calls") or []:
+        function = tool_call.get("function") or {}
+        parts.append(function.get("name") or "")
+        parts.append(function.get("arguments") or "")
+    return MESSAGE_OVERHEAD_TOKENS + sum(count_text_tokens(p, model) for p in parts)
+
+
+def history_token_budget(model: Optional[str] = None) -> int:
+    """
+    返回给定模型的历史窗口 token 预算。
+    HISTORY_TOKEN_BUDGETS 中为该模型单独配置的值优先，否则使用 HISTORY_TOKEN_BUDGET。
+    """
+    model = model or settings.MODEL_NAME
+    return settings.HISTORY_TOKEN_BUDGETS.get(model, settings.HISTORY_TOKEN_BUDGET)
+
+
+# --- END OF FILE py_ai_core/core/tokens.py ---
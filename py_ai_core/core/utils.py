@@ -1,7 +1,8 @@
 # --- py_ai_core/core/utils.py ---
 from slowapi import Limiter
 from slowapi.util import get_remote_address
-from cachetools import TTLCache
 
-limiter = Limiter(key_func=get_remote_address)
-health_check_cache = TTLCache(maxsize=1, ttl=5)
\ No newline at end of file
+from py_ai_core.core.state_backend import rate_limit_storage_uri
+
+# 限流计数与状态后端使用同一存储，多 worker 部署时计数在所有进程间共享
+limiter = Limiter(key_func=get_remote_address, storage_uri=rate_limit_storage_uri())
@@ -17,12 +17,20 @@ setup_logging()
 # ===================================================================
 # 2. 导入所有需要的模块
 # ===================================================================
+from py_ai_core.core.config import settings
 from py_ai_core.core.database import engine, Base
 from py_ai_core.models import db_models
-from py_ai_core.mcp.router import router as mcp_router
+from py_ai_core.models.migrations import apply_schema_migrations
+from py_ai_core.mcp.jobs import job_queue
+from py_ai_core.mcp.router import answer_chat, router as mcp_router
 from py_ai_core.mcp.ops_router import router as ops_router
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
+from py_ai_core.services.llm_service import llm_service
+from py_ai_core.services.session_service import session_service
 from py_ai_core.core.middleware import CtxTimingMiddleware
 from py_ai_core.core.utils import limiter
+from py_ai_core.core.state_backend import state_backend
+from py_ai_core.tools.sandbox import tool_sandbox
 from py_ai_core.core.telemetry import setup_telemetry  # ✅ 导入OTel初始化函数
 from py_ai_core import tools
 
@@ -54,6 +62,7 @@ async def lifespan(app: FastAPI):
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
             logger.info("数据库表已检查并成功创建（如果不存在）。")
+            await apply_schema_migrations(conn)
     except Exception as e:
         logger.exception("数据库表创建失败！错误: %s", e)
         raise
@@ -64,6 +73,14 @@ async def lifespan(app: FastAPI):
     heartbeat = asyncio.create_task(heartbeat_task())
     logger.info("心跳日志后台任务已启动。")
 
+    if settings.HISTORY_WRITE_MODE == "write_behind":
+        session_service.history_writer.start()
+
+    if settings.LLM_HTTP_WARMUP:
+        await llm_service.warm_up()
+
+    job_queue.start(answer_chat)
+
     yield  # FastAPI应用在此处运行
 
     # === 应用关闭时执行 ===
@@ -73,6 +90,13 @@ async def lifespan(app: FastAPI):
         await heartbeat
     except asyncio.CancelledError:
         logger.info("心跳日志后台任务已成功取消。")
+    # 先停止任务 worker：被中断的任务放回队列，它们产生的历史写入仍由写入器落库
+    await job_queue.stop()
+    await session_service.history_writer.stop()
+    await session_service.summarizer.stop()
+    await llm_service.aclose()
+    await tool_sandbox.shutdown()
+    await state_backend.close()
     logger.info("应用已成功关闭。")
 
 
@@ -101,6 +125,17 @@ def create_app() -> FastAPI:
             content={"detail": f"Rate limit exceeded: {exc.detail}"},
         )
 
+    # 上游容量已满时快速失败，告诉客户端多久之后再试
+    @app.exception_handler(UpstreamOverloadedError)
+    async def upstream_overloaded_handler(
+        request: Request, exc: UpstreamOverloadedError
+    ):
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "服务繁忙，请稍后重试。"},
+            headers={"Retry-After": str(max(int(round(exc.retry_after)), 1))},
+        )
+
     # 添加中间件 (顺序很重要，外层先添加)
     app.add_middleware(SlowAPIMiddleware)
     app.add_middleware(CtxTimingMiddleware)
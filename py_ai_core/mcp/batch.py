@@ -0,0 +1,275 @@
+# --- START OF FILE py_ai_core/mcp/batch.py ---
+
+"""
+批量聊天。
+
+离线/批量任务可以一次提交成百上千条 ChatRequest，而不必逐条调用 /v1/mcp/chat:
+- 条目走与聊天端点完全相同的流程（SessionService / LLMService / 工具循环），
+  并发数有上限，上游的并发限制与背压同样生效；
+- 同一会话的条目按提交顺序依次执行，保证历史记录的顺序；不同会话之间并发；
+- 每完成一条就输出一行 JSON (BatchChatResult)，单条失败只影响自己，错误写在该行里；
+- 断点续跑: HTTP 接口指定 batch_id 时，成功的结果保存在共享状态后端中，
+  用同一 batch_id 重新提交会直接返回这些结果；命令行入口则跳过输出文件中已经成功的条目。
+
+命令行用法:
+
+    python -m py_ai_core.mcp.batch prompts.jsonl -o results.jsonl --concurrency 8
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections import Counter
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from pydantic import ValidationError
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_usage_var, new_llm_usage
+from py_ai_core.core.state_backend import StateBackend, state_backend
+from py_ai_core.models.schemas import (
+    BatchChatItem,
+    BatchChatResult,
+    ChatRequest,
+    ChatResponse,
+)
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
+
+logger = logging.getLogger(__name__)
+
+AnswerFn = Callable[[ChatRequest], Awaitable[ChatResponse]]
+
+
+def assign_custom_ids(items: List[BatchChatItem]) -> List[Tuple[int, str, Any]]:
+    """为每一项确定 custom_id（缺省为下标），custom_id 重复时抛出 ValueError。"""
+    numbered = [
+        (index, item.custom_id or str(index), item) for index, item in enumerate(items)
+    ]
+    duplicates = [
+        cid
+        for cid, count in Counter(cid for _, cid, _ in numbered).items()
+        if count > 1
+    ]
+    if duplicates:
+        raise ValueError(f"custom_id 重复: {', '.join(duplicates[:5])}")
+    return numbered
+
+
+def describe_error(exc: Exception) -> Dict[str, Any]:
+    """把单条失败的异常转换成结果行里的 error 字段，不向调用方暴露内部细节。"""
+    if isinstance(exc, UpstreamOverloadedError):
+        return {
+            "type": "overloaded",
+            "detail": "服务繁忙，请稍后重试。",
+            "retry_after": exc.retry_after,
+        }
+    return {"type": "internal_error", "detail": "处理请求时发生内部错误。"}
+
+
+async def run_batch(
+    items: List[BatchChatItem],
+    answer: AnswerFn,
+    concurrency: Optional[int] = None,
+    batch_id: Optional[str] = None,
+    skip: Optional[Set[str]] = None,
+    state: Optional[StateBackend] = None,
+) -> AsyncIterator[BatchChatResult]:
+    """
+    执行一个批次，按完成顺序产出每一项的结果。
+    :param answer: 处理单条请求的协程函数，通常是 router.answer_chat。
+    :param concurrency: 同时执行的条目数，受 BATCH_MAX_CONCURRENCY 限制。
+    :param batch_id: 指定时保存成功的结果，并复用同一 batch_id 之前保存的结果。
+    :param skip: 不需要执行、也不产出结果的 custom_id（例如输出文件中已完成的条目）。
+    """
+    state = state or state_backend
+    skip = skip or set()
+    concurrency = min(
+        concurrency or settings.BATCH_DEFAULT_CONCURRENCY,
+        settings.BATCH_MAX_CONCURRENCY,
+    )
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+    results: asyncio.Queue = asyncio.Queue()
+
+    # 同一会话的条目放进同一组，组内按顺序执行
+    groups: Dict[str, List[Tuple[int, str, BatchChatItem]]] = {}
+    expected = 0
+    for index, custom_id, item in assign_custom_ids(items):
+        if custom_id in skip:
+            continue
+        expected += 1
+        if not item.session_id:
+            results.put_nowait(
+                BatchChatResult(
+                    index=index,
+                    custom_id=custom_id,
+                    status="error",
+                    error={
+                        "type": "invalid_request",
+                        "detail": "session_id is required.",
+                    },
+                )
+            )
+            continue
+        groups.setdefault(item.session_id, []).append((index, custom_id, item))
+
+    async def run_item(index: int, custom_id: str, item: BatchChatItem):
+        key = f"batch:{batch_id}:{custom_id}" if batch_id else None
+        if key:
+            stored = await state.get(key)
+            if stored is not None:
+                return BatchChatResult(**{**stored, "index": index, "resumed": True})
+
+        # 每一项单独统计用量与预算
+        llm_usage_var.set(new_llm_usage())
+        try:
+            response = await answer(item)
+        except Exception as e:
+            if isinstance(e, UpstreamOverloadedError):
+                logger.warning("批量条目 '%s' 因上游过载失败。", custom_id)
+            else:
+                logger.exception("批量条目 '%s' 处理失败。", custom_id)
+            return BatchChatResult(
+                index=index,
+                custom_id=custom_id,
+                status="error",
+                session_id=item.session_id,
+                error=describe_error(e),
+            )
+
+        result = BatchChatResult(
+            index=index,
+            custom_id=custom_id,
+            status="ok",
+            session_id=response.session_id,
+            answer=response.answer,
+        )
+        if key:
+            await state.set(
+                key, result.model_dump(), ttl=settings.BATCH_RESULT_TTL_SECONDS
+            )
+        return result
+
+    async def run_group(group):
+        for index, custom_id, item in group:
+            async with semaphore:
+                result = await run_item(index, custom_id, item)
+            await results.put(result)
+
+    logger.info(
+        "开始执行批次 '%s': %d 条，%d 个会话，并发 %d。",
+        batch_id or "-",
+        expected,
+        len(groups),
+        concurrency,
+    )
+    tasks = [asyncio.create_task(run_group(group)) for group in groups.values()]
+    try:
+        for _ in range(expected):
+            yield await results.get()
+    finally:
+        # 调用方提前退出（例如客户端断开）时取消尚未完成的条目
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _read_items(path: str) -> Tuple[List[BatchChatItem], List[BatchChatResult]]:
+    """读取输入的 JSONL 文件，无法解析的行直接转换为错误结果。"""
+    items, invalid = [], []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(BatchChatItem.model_validate_json(line))
+            except ValidationError as e:
+                invalid.append(
+                    BatchChatResult(
+                        index=-1,
+                        custom_id=f"line:{line_no}",
+                        status="error",
+                        error={"type": "invalid_request", "detail": str(e)},
+                    )
+                )
+    return items, invalid
+
+
+def _completed_ids(path: str) -> Set[str]:
+    """从已有的输出文件中读取成功条目的 custom_id，用于断点续跑。"""
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 上次中断时写了一半的行
+            if row.get("status") == "ok":
+                done.add(row["custom_id"])
+    return done
+
+
+async def _main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="批量执行 JSONL 文件中的聊天请求。")
+    parser.add_argument(
+        "input", help="输入文件，每行一个 ChatRequest（可带 custom_id）"
+    )
+    parser.add_argument("-o", "--output", required=True, help="结果输出文件 (JSONL)")
+    parser.add_argument("--concurrency", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    # 延迟导入：导入路由会注册全部工具
+    from py_ai_core.core.database import engine
+    from py_ai_core.mcp.router import answer_chat
+    from py_ai_core.services.llm_service import llm_service
+    from py_ai_core.services.session_service import session_service
+
+    items, invalid = _read_items(args.input)
+    done = _completed_ids(args.output)
+    if done:
+        logger.info("输出文件中已有 %d 条成功结果，将跳过这些条目。", len(done))
+
+    counts: Counter = Counter()
+    try:
+        with open(args.output, "a", encoding="utf-8") as out:
+            for result in invalid:
+                out.write(result.model_dump_json() + "\n")
+                counts[result.status] += 1
+            async for result in run_batch(
+                items, answer_chat, args.concurrency, skip=done
+            ):
+                out.write(result.model_dump_json() + "\n")
+                out.flush()
+                counts[result.status] += 1
+    finally:
+        await session_service.summarizer.stop()
+        await llm_service.aclose()
+        await engine.dispose()
+
+    print(
+        f"完成: 成功 {counts['ok']} 条，失败 {counts['error']} 条，"
+        f"跳过已完成 {len(done)} 条。",
+        file=sys.stderr,
+    )
+    return 1 if counts["error"] else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main()))
+
+# --- END OF FILE py_ai_core/mcp/batch.py ---
@@ -0,0 +1,486 @@
+# --- START OF FILE py_ai_core/mcp/jobs.py ---
+
+"""
+异步聊天任务队列。
+
+带工具调用的聊天可能持续几十秒，同步的 /v1/mcp/chat 在整个过程中都占着 HTTP 连接。
+任务模式把请求与执行分开:
+- 提交: 写入 chat_jobs 表后立即返回 job_id；
+- 执行: 每个进程启动 JOB_WORKERS 个 worker，用 `FOR UPDATE SKIP LOCKED` 按优先级领取任务，
+  领取是一个很短的事务，执行期间不持有行锁，也不占用数据库连接；
+- 结果: 客户端轮询任务状态，或在提交时提供 callback_url，任务结束后推送结果。
+  callback_url 由服务端发起请求，为防止被用来探测内网 (SSRF)，只允许指向公网地址
+  或 JOB_CALLBACK_ALLOWED_HOSTS 中的主机，且不跟随重定向；推送时直接连接检查通过的 IP，
+  不再重新解析域名，避免 DNS rebinding 在检查之后把域名改指向内网。
+
+可靠性:
+- 运行中的任务每 JOB_HEARTBEAT_SECONDS 续一次心跳；超过 JOB_LEASE_SECONDS 没有心跳的任务
+  （worker 崩溃或被强制结束）会被重新放回队列，最多执行 JOB_MAX_ATTEMPTS 次；
+- 取消排队中的任务直接生效；取消运行中的任务由执行它的 worker 在下一次心跳时发现并中断，
+  中断前已经写入的历史不会回滚；
+- 上游过载时任务按建议的等待时间推迟后重新排队，而不是立即失败。
+
+JOB_WORKERS 默认为 0，API 进程只接收任务；执行任务应单独运行专门的进程，
+避免长时间的任务与 API 请求争用同一个事件循环:
+
+    python -m py_ai_core.mcp.jobs
+"""
+
+import asyncio
+import datetime
+import ipaddress
+import logging
+import socket
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_usage_var, new_llm_usage
+from py_ai_core.core.database import AsyncSessionLocal
+from py_ai_core.mcp.batch import describe_error
+from py_ai_core.models.db_models import ChatJob
+from py_ai_core.models.schemas import (
+    ChatJobRequest,
+    ChatJobStatus,
+    ChatRequest,
+    ChatResponse,
+)
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
+
+logger = logging.getLogger(__name__)
+
+AnswerFn = Callable[[ChatRequest], Awaitable[ChatResponse]]
+
+
+class CallbackURLError(ValueError):
+    """callback_url 指向了不允许推送的地址。"""
+
+
+async def check_callback_url(url: str) -> Optional[str]:
+    """
+    检查 callback_url 是否允许推送，不允许时抛出 CallbackURLError:
+    - 只允许 http/https；
+    - 配置了 JOB_CALLBACK_ALLOWED_HOSTS 时，主机名必须在列表中；
+    - 否则主机解析出的所有地址都必须是公网地址（拒绝私有、回环、链路本地等地址）。
+    提交任务时与每次推送前都会检查，后者防止域名在提交之后被改为解析到内网。
+
+    :return: 检查通过的 IP 地址，推送时应直接连接它而不是重新解析域名；
+        主机在允许列表中时返回 None，按原地址推送。
+    """
+    parsed = httpx.URL(url)
+    if parsed.scheme not in ("http", "https") or not parsed.host:
+        raise CallbackURLError("callback_url 必须是 http 或 https 地址。")
+    host = parsed.host
+    if settings.JOB_CALLBACK_ALLOWED_HOSTS:
+        if host not in settings.JOB_CALLBACK_ALLOWED_HOSTS:
+            raise CallbackURLError(f"callback_url 的主机 '{host}' 不在允许列表中。")
+        return None
+
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )
+    except socket.gaierror:
+        raise CallbackURLError(f"无法解析 callback_url 的主机 '{host}'。")
+    for *_, sockaddr in infos:
+        # IPv6 链路本地地址可能带有 "%网卡名" 后缀
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if not address.is_global or address.is_multicast:
+            raise CallbackURLError(
+                f"callback_url 的主机 '{host}' 解析到非公网地址 {address}，不允许回调。"
+            )
+    return str(ipaddress.ip_address(infos[0][4][0].split("%")[0]))
+
+
+def pin_callback_url(url: str, address: str) -> Tuple[httpx.URL, Dict[str, Any]]:
+    """
+    把 callback_url 的主机替换为检查通过的 IP，返回新地址与请求参数:
+    Host 头保持原主机名；https 时 TLS 的 SNI 与证书校验仍按原主机名进行。
+    """
+    original = httpx.URL(url)
+    return original.copy_with(host=address), {
+        "headers": {"Host": original.netloc.decode("ascii")},
+        "extensions": {"sni_hostname": original.host},
+    }
+
+
+def job_status(job: ChatJob) -> ChatJobStatus:
+    """把任务行转换为对外返回的状态。"""
+    return ChatJobStatus(
+        job_id=job.id,
+        session_id=job.session_id,
+        status=job.status,
+        priority=job.priority or 0,
+        attempts=job.attempts or 0,
+        answer=(job.result or {}).get("answer"),
+        error=job.error,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+class JobQueue:
+    def __init__(self):
+        self._answer: Optional[AnswerFn] = None
+        self._workers: List[asyncio.Task] = []
+        self._reaper: Optional[asyncio.Task] = None
+        self._callback_client: Optional[httpx.AsyncClient] = None
+        # 本进程提交任务时唤醒空闲的 worker，不必等到下一次轮询
+        self._wakeup = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return any(not task.done() for task in self._workers)
+
+    # --- 提交、查询与取消 (请求路径) ---
+
+    async def submit(self, request: ChatJobRequest, db: AsyncSession) -> ChatJob:
+        """
+        把请求写入队列并立即返回任务。
+        callback_url 不允许推送时抛出 CallbackURLError，任务不会入队。
+        """
+        callback_url = str(request.callback_url) if request.callback_url else None
+        if callback_url:
+            await check_callback_url(callback_url)
+        job = ChatJob(
+            id=str(uuid.uuid4()),
+            session_id=request.session_id,
+            request=request.model_dump(
+                exclude={"priority", "callback_url"}, exclude_none=True
+            ),
+            priority=request.priority,
+            status="queued",
+            callback_url=callback_url,
+            attempts=0,
+        )
+        db.add(job)
+        await db.commit()
+        await db.refresh(job)
+        self._wakeup.set()
+        logger.info(
+            "会话 '%s' 提交了异步任务 '%s' (优先级 %d)。",
+            job.session_id,
+            job.id,
+            job.priority,
+        )
+        return job
+
+    async def get(self, job_id: str, db: AsyncSession) -> Optional[ChatJob]:
+        result = await db.execute(select(ChatJob).where(ChatJob.id == job_id))
+        return result.scalars().first()
+
+    async def cancel(self, job_id: str, db: AsyncSession) -> Optional[ChatJob]:
+        """
+        取消任务。排队中的任务不会再被领取；运行中的任务由执行它的 worker
+        在下一次心跳时中断。已经结束的任务保持原状。
+        """
+        result = await db.execute(
+            update(ChatJob)
+            .where(ChatJob.id == job_id, ChatJob.status.in_(("queued", "running")))
+            .values(status="cancelled", finished_at=func.now())
+        )
+        await db.commit()
+        if result.rowcount:
+            logger.info("异步任务 '%s' 已取消。", job_id)
+        return await self.get(job_id, db)
+
+    # --- worker 生命周期 ---
+
+    def start(self, answer: AnswerFn, workers: Optional[int] = None) -> None:
+        """启动 worker 与回收任务，在应用生命周期开始时调用。"""
+        workers = settings.JOB_WORKERS if workers is None else workers
+        if workers <= 0:
+            return
+        self._answer = answer
+        self._callback_client = httpx.AsyncClient(
+            timeout=settings.JOB_CALLBACK_TIMEOUT_SECONDS
+        )
+        self._workers = [
+            asyncio.create_task(self._worker_loop(i)) for i in range(workers)
+        ]
+        self._reaper = asyncio.create_task(self._reaper_loop())
+        logger.info("异步任务队列已启动，worker 数: %d。", workers)
+
+    async def stop(self) -> None:
+        """停止所有 worker。运行中的任务被中断并放回队列，由其他进程或下次启动继续执行。"""
+        tasks = self._workers + ([self._reaper] if self._reaper else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers, self._reaper = [], None
+        if self._callback_client is not None:
+            await self._callback_client.aclose()
+            self._callback_client = None
+        if tasks:
+            logger.info("异步任务队列已停止。")
+
+    async def _worker_loop(self, worker_no: int) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("worker %d 领取任务失败。", worker_no)
+                await asyncio.sleep(settings.JOB_POLL_INTERVAL_SECONDS)
+                continue
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), settings.JOB_POLL_INTERVAL_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # 任务状态没能写回时由心跳超时回收
+                logger.exception("worker %d 处理任务 '%s' 失败。", worker_no, job.id)
+
+    async def _reaper_loop(self) -> None:
+        while True:
+            await asyncio.sleep(max(settings.JOB_LEASE_SECONDS / 2, 1.0))
+            try:
+                await self._requeue_stale()
+            except Exception:
+                logger.exception("回收心跳超时的任务失败。")
+
+    # --- 执行单个任务 ---
+
+    async def _process(self, job: ChatJob) -> None:
+        """执行一个已领取的任务，执行期间定期续心跳，并在发现取消时中断。"""
+        logger.info("开始执行异步任务 '%s' (第 %d 次)。", job.id, job.attempts)
+        execution = asyncio.create_task(self._execute(job))
+        cancelled_by_request = False
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {execution}, timeout=settings.JOB_HEARTBEAT_SECONDS
+                )
+                if done:
+                    break
+                try:
+                    still_running = await self._heartbeat(job.id)
+                except Exception:
+                    logger.warning("异步任务 '%s' 续心跳失败。", job.id, exc_info=True)
+                    continue
+                if not still_running:
+                    cancelled_by_request = True
+                    execution.cancel()
+                    await asyncio.gather(execution, return_exceptions=True)
+                    break
+        except asyncio.CancelledError:
+            # worker 被停止：中断任务并放回队列
+            execution.cancel()
+            await asyncio.gather(execution, return_exceptions=True)
+            await self._finish(job.id, "queued")
+            raise
+
+        if cancelled_by_request:
+            logger.info("异步任务 '%s' 在执行中被取消。", job.id)
+            status, result, error = "cancelled", None, None
+        else:
+            try:
+                response = execution.result()
+            except UpstreamOverloadedError as e:
+                if job.attempts < settings.JOB_MAX_ATTEMPTS:
+                    logger.warning(
+                        "异步任务 '%s' 因上游过载推迟 %.0f 秒后重试。",
+                        job.id,
+                        e.retry_after,
+                    )
+                    await self._finish(job.id, "queued", delay=e.retry_after)
+                    return
+                status, result, error = "failed", None, describe_error(e)
+            except Exception as e:
+                logger.exception("异步任务 '%s' 执行失败。", job.id)
+                status, result, error = "failed", None, describe_error(e)
+            else:
+                status, error = "succeeded", None
+                result = {"answer": response.answer, "session_id": response.session_id}
+            await self._finish(job.id, status, result=result, error=error)
+
+        if job.callback_url:
+            await self._send_callback(job, status, result, error)
+
+    async def _execute(self, job: ChatJob) -> ChatResponse:
+        # 每个任务单独统计用量与预算
+        llm_usage_var.set(new_llm_usage())
+        return await self._answer(ChatRequest(**job.request))
+
+    async def _send_callback(
+        self,
+        job: ChatJob,
+        status: str,
+        result: Optional[Dict[str, Any]],
+        error: Optional[Dict[str, Any]],
+    ) -> None:
+        """把任务结果 POST 到 callback_url，失败时按指数退避重试，最终失败只记录日志。"""
+        try:
+            address = await check_callback_url(job.callback_url)
+        except CallbackURLError as e:
+            logger.warning("异步任务 '%s' 的回调被拒绝: %s", job.id, e)
+            return
+        # 重试时也连接同一个已检查过的地址，不再重新解析域名
+        if address is None:
+            url, request_kwargs = job.callback_url, {}
+        else:
+            url, request_kwargs = pin_callback_url(job.callback_url, address)
+        payload = {
+            "job_id": job.id,
+            "session_id": job.session_id,
+            "status": status,
+            "answer": (result or {}).get("answer"),
+            "error": error,
+        }
+        for attempt in range(settings.JOB_CALLBACK_MAX_RETRIES + 1):
+            try:
+                response = await self._callback_client.post(
+                    url, json=payload, **request_kwargs
+                )
+                if response.status_code < 500:
+                    return
+                logger.warning(
+                    "异步任务 '%s' 的回调返回 %d。", job.id, response.status_code
+                )
+            except httpx.HTTPError as e:
+                logger.warning("异步任务 '%s' 的回调失败: %s", job.id, e)
+            if attempt < settings.JOB_CALLBACK_MAX_RETRIES:
+                await asyncio.sleep(2**attempt)
+        logger.error("异步任务 '%s' 的回调重试耗尽，放弃推送。", job.id)
+
+    # --- 数据库操作 (每个都是一个很短的独立事务) ---
+
+    async def _claim(self) -> Optional[ChatJob]:
+        """领取一个可执行的任务：优先级最高、提交最早，跳过已被其他 worker 锁住的行。"""
+        next_job = (
+            select(ChatJob.id)
+            .where(ChatJob.status == "queued", ChatJob.available_at <= func.now())
+            .order_by(ChatJob.priority.desc(), ChatJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(ChatJob)
+                .where(ChatJob.id == next_job)
+                .values(
+                    status="running",
+                    attempts=ChatJob.attempts + 1,
+                    started_at=func.now(),
+                    heartbeat_at=func.now(),
+                )
+                .returning(ChatJob)
+            )
+            job = result.scalars().first()
+            await db.commit()
+            return job
+
+    async def _heartbeat(self, job_id: str) -> bool:
+        """续心跳。任务已不在运行状态（被取消或被回收）时返回 False。"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(ChatJob)
+                .where(ChatJob.id == job_id, ChatJob.status == "running")
+                .values(heartbeat_at=func.now())
+            )
+            await db.commit()
+            return result.rowcount > 0
+
+    async def _finish(
+        self,
+        job_id: str,
+        status: str,
+        result: Optional[Dict[str, Any]] = None,
+        error: Optional[Dict[str, Any]] = None,
+        delay: float = 0.0,
+    ) -> None:
+        """
+        结束或重新排队一个运行中的任务。只更新仍处于 running 状态的行，
+        执行期间被取消的任务保持 cancelled。
+        """
+        values: Dict[str, Any] = {"status": status, "heartbeat_at": None}
+        if status == "queued":
+            values["available_at"] = func.now() + datetime.timedelta(seconds=delay)
+        else:
+            values.update(result=result, error=error, finished_at=func.now())
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(ChatJob)
+                .where(ChatJob.id == job_id, ChatJob.status == "running")
+                .values(**values)
+            )
+            await db.commit()
+        logger.info("异步任务 '%s' 状态更新为 %s。", job_id, status)
+
+    async def _requeue_stale(self) -> None:
+        """把心跳超时的运行中任务放回队列；已达到最大执行次数的标记为失败。"""
+        stale = (
+            ChatJob.status == "running",
+            ChatJob.heartbeat_at
+            < func.now() - datetime.timedelta(seconds=settings.JOB_LEASE_SECONDS),
+        )
+        async with AsyncSessionLocal() as db:
+            failed = await db.execute(
+                update(ChatJob)
+                .where(*stale, ChatJob.attempts >= settings.JOB_MAX_ATTEMPTS)
+                .values(
+                    status="failed",
+                    error={"type": "lease_expired", "detail": "任务多次执行均未完成。"},
+                    finished_at=func.now(),
+                    heartbeat_at=None,
+                )
+            )
+            requeued = await db.execute(
+                update(ChatJob).where(*stale).values(status="queued", heartbeat_at=None)
+            )
+            await db.commit()
+        if failed.rowcount or requeued.rowcount:
+            logger.warning(
+                "已回收心跳超时的异步任务: %d 个重新排队，%d 个标记为失败。",
+                requeued.rowcount,
+                failed.rowcount,
+            )
+
+
+# 创建一个全局单例
+job_queue = JobQueue()
+
+
+async def _main() -> None:
+    from py_ai_core.core.database import engine
+    from py_ai_core.mcp.router import answer_chat
+    from py_ai_core.services.llm_service import llm_service
+    from py_ai_core.services.session_service import session_service
+
+    job_queue.start(answer_chat, workers=max(settings.JOB_WORKERS, 1))
+    try:
+        await asyncio.gather(*job_queue._workers)
+    finally:
+        await job_queue.stop()
+        await session_service.summarizer.stop()
+        await llm_service.aclose()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
+
+# --- END OF FILE py_ai_core/mcp/jobs.py ---
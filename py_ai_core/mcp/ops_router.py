@@ -1,12 +1,20 @@
 # --- START OF FILE py_ai_core/mcp/ops_router.py (Final Dependency Injection Version) ---
+import datetime
 import logging
-from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import List, Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from pydantic import BaseModel
 
-from py_ai_core.core.database import get_db
-from py_ai_core.core.utils import limiter, health_check_cache
+from py_ai_core.core.database import get_db, get_pool_stats
+from py_ai_core.core.utils import limiter
+from py_ai_core.core.state_backend import state_backend
+from py_ai_core.services.llm_service import llm_service
+from py_ai_core.services.usage_service import usage_report
+from py_ai_core.tools.executor import tool_executor
+from py_ai_core.tools.selection import tool_selector
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -15,6 +23,136 @@ class HealthCheckResponse(BaseModel):
     status: str
     database_connection: str
 
+
+class DBPoolStatsResponse(BaseModel):
+    size: int
+    max_overflow: int
+    checked_out: int
+    checked_in: int
+    overflow: int
+    waiting: int
+    total_waits: int
+    total_wait_ms: float
+    total_timeouts: int
+
+
+class LLMHTTPPoolStatsResponse(BaseModel):
+    http2_enabled: bool
+    max_connections: int
+    max_keepalive_connections: int
+    connections: int
+    idle: int
+    active: int
+    http2_connections: int
+    requests_in_flight: int
+
+
+class LLMUsageTotals(BaseModel):
+    requests: int
+    llm_calls: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+    cached_token_ratio: float
+
+
+class LLMUsageBucket(LLMUsageTotals):
+    bucket_start: datetime.datetime
+
+
+class LLMUsageSession(LLMUsageTotals):
+    session_id: str
+
+
+class LLMUsageResponse(BaseModel):
+    since: datetime.datetime
+    granularity: str
+    totals: LLMUsageTotals
+    buckets: List[LLMUsageBucket]
+    sessions: List[LLMUsageSession]
+
+
+class LLMCoalescingStatsResponse(BaseModel):
+    in_flight: int
+    leaders: int
+    coalesced: int
+    coalesced_ratio: float
+
+
+class LLMLimiterStats(BaseModel):
+    limit: int
+    in_flight: int
+    queued: int
+    total_queued: int
+    avg_queue_ms: float
+    max_queue_ms: float
+    total_rejected: int
+
+
+class LLMProviderStats(BaseModel):
+    name: str
+    model: str
+    weight: float
+    state: str
+    ewma_latency_ms: Optional[float]
+    p95_latency_ms: Optional[float]
+    consecutive_failures: int
+    total_calls: int
+    total_failures: int
+    limiter: LLMLimiterStats
+
+
+class LLMProvidersResponse(BaseModel):
+    policy: str
+    hedging_enabled: bool
+    total_hedges: int
+    providers: List[LLMProviderStats]
+
+
+class LLMCacheStatsResponse(BaseModel):
+    enabled: bool
+    semantic_enabled: bool
+    exact_hits: int
+    semantic_hits: int
+    misses: int
+    stores: int
+    bypassed: int
+    errors: int
+    hit_ratio: float
+    index_size: int
+
+
+class ToolSandboxStats(BaseModel):
+    calls: int
+    limit_exceeded: int
+    crashed: int
+    recycled: int
+    workers: int
+    idle_workers: int
+
+
+class ToolExecutionStatsResponse(BaseModel):
+    executions: int
+    cache_hits: int
+    timeouts: int
+    coalesced: int
+    in_flight: int
+    sandbox: ToolSandboxStats
+
+
+class ToolSelectionStatsResponse(BaseModel):
+    mode: str
+    top_k: int
+    pinned: List[str]
+    selections: int
+    avg_latency_ms: float
+    max_latency_ms: float
+    avg_offered_tools: float
+    avg_catalog_tools: float
+    called_tools: int
+    called_in_selection: int
+    recall: float
+
 # ✅ 1. 创建一个专门用于速率限制的依赖项
 #    我们将速率限制的逻辑封装在这个函数里。
 #    FastAPI会在调用 health_check 之前，先执行这个函数。
@@ -28,6 +166,7 @@ async def rate_limit_dependency(request: Request):
     return
 
 HEALTH_CHECK_CACHE_KEY = "health_check_result"
+HEALTH_CHECK_CACHE_TTL_SECONDS = 5
 
 @router.get(
     "/health",
@@ -48,28 +187,170 @@ async def health_check(request: Request, db: AsyncSession = Depends(get_db)):
     - Rate Limit: 60 requests per minute per IP.
     - Cache: Results are cached for 5 seconds.
     """
-    # 手动缓存逻辑保持不变，它已经被证明是异步安全的
-    try:
-        cached_response = health_check_cache[HEALTH_CHECK_CACHE_KEY]
+    # 缓存保存在共享状态后端中，多个 worker 共用同一份检查结果
+    cached_response = await state_backend.get(HEALTH_CHECK_CACHE_KEY)
+    if cached_response is not None:
         logger.debug("健康检查命中缓存。")
-        return cached_response
-    except KeyError:
-        logger.debug("健康检查未命中缓存，执行实际的数据库查询...")
-        db_status = "ok"
-        try:
-            result = await db.execute(text("SELECT 1"))
-            if result.scalar_one() != 1:
-                raise Exception("Database returned unexpected result.")
-        except Exception as e:
-            logger.error("健康检查失败：数据库连接异常！错误: %s", e, exc_info=True)
-            db_status = "error"
-            raise HTTPException(
-                status_code=503,
-                detail={"status": "error", "database_connection": f"failed: {e}"},
-            )
-
-        response = HealthCheckResponse(status="ok", database_connection=db_status)
-        health_check_cache[HEALTH_CHECK_CACHE_KEY] = response
-        return response
+        return HealthCheckResponse(**cached_response)
+
+    logger.debug("健康检查未命中缓存，执行实际的数据库查询...")
+    db_status = "ok"
+    try:
+        result = await db.execute(text("SELECT 1"))
+        if result.scalar_one() != 1:
+            raise Exception("Database returned unexpected result.")
+    except Exception as e:
+        logger.error("健康检查失败：数据库连接异常！错误: %s", e, exc_info=True)
+        db_status = "error"
+        raise HTTPException(
+            status_code=503,
+            detail={"status": "error", "database_connection": f"failed: {e}"},
+        )
+
+    response = HealthCheckResponse(status="ok", database_connection=db_status)
+    await state_backend.set(
+        HEALTH_CHECK_CACHE_KEY,
+        response.model_dump(),
+        ttl=HEALTH_CHECK_CACHE_TTL_SECONDS,
+    )
+    return response
+
+
+@router.get(
+    "/health/db-pool",
+    tags=["运维(Operations)"],
+    summary="查看数据库连接池的实时状态",
+    response_model=DBPoolStatsResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def db_pool_stats(request: Request):
+    """
+    返回当前 worker 的连接池状态：已借出/空闲连接数、溢出连接数，
+    以及因池子耗尽而排队等待连接的次数、累计等待时间和超时次数。
+    """
+    return DBPoolStatsResponse(**get_pool_stats())
+
+
+@router.get(
+    "/health/llm-cache",
+    tags=["运维(Operations)"],
+    summary="查看大模型响应缓存的命中统计",
+    response_model=LLMCacheStatsResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def llm_cache_stats(request: Request):
+    """
+    返回当前 worker 的大模型响应缓存统计：精确/语义命中次数、未命中次数、
+    写入次数、被请求跳过的次数、缓存故障次数、命中率以及语义索引中的问题数。
+    """
+    return LLMCacheStatsResponse(**llm_service.cache.stats())
+
+
+@router.get(
+    "/health/llm-providers",
+    tags=["运维(Operations)"],
+    summary="查看大模型提供方的健康状态与延迟",
+    response_model=LLMProvidersResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def llm_providers_stats(request: Request):
+    """
+    返回当前 worker 中每个大模型提供方的熔断器状态、延迟 EWMA 与 p95、
+    调用与失败次数、自适应并发上限与排队情况，以及已发出的对冲请求总数。
+    """
+    return LLMProvidersResponse(**llm_service.pool.stats())
+
+
+@router.get(
+    "/health/llm-coalescing",
+    tags=["运维(Operations)"],
+    summary="查看相同大模型请求的合并统计",
+    response_model=LLMCoalescingStatsResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def llm_coalescing_stats(request: Request):
+    """
+    返回当前 worker 中正在进行的上游请求数、真正发往上游的请求数 (leaders)，
+    以及因与进行中的相同请求合并而省下的请求数 (coalesced)。
+    """
+    return LLMCoalescingStatsResponse(**llm_service.single_flight.stats())
+
+
+@router.get(
+    "/health/llm-http-pool",
+    tags=["运维(Operations)"],
+    summary="查看大模型上游 HTTP 连接池的实时状态",
+    response_model=LLMHTTPPoolStatsResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def llm_http_pool_stats(request: Request):
+    """
+    返回当前 worker 到大模型上游的连接数（空闲/活跃/HTTP2）与在途请求数。
+    """
+    return LLMHTTPPoolStatsResponse(**llm_service.http_pool_stats())
+
+
+@router.get(
+    "/health/tools",
+    tags=["运维(Operations)"],
+    summary="查看工具执行的统计",
+    response_model=ToolExecutionStatsResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def tool_execution_stats(request: Request):
+    """
+    返回当前 worker 中工具的实际执行次数、结果缓存命中数、超时数、
+    因与进行中的相同调用合并而省下的执行数，以及沙箱进程池的状态。
+    """
+    return ToolExecutionStatsResponse(**tool_executor.get_stats())
+
+
+@router.get(
+    "/health/tool-selection",
+    tags=["运维(Operations)"],
+    summary="查看按问题筛选工具的统计",
+    response_model=ToolSelectionStatsResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def tool_selection_stats(request: Request):
+    """
+    返回当前 worker 中工具筛选的耗时、每个请求平均提供的工具数与工具目录大小，
+    以及召回率: 模型实际调用的工具中落在筛选结果内的比例（以 shadow 模式下的数字为准）。
+    """
+    return ToolSelectionStatsResponse(**tool_selector.get_stats())
+
+
+@router.get(
+    "/health/llm-usage",
+    tags=["运维(Operations)"],
+    summary="查看大模型 token 用量汇总",
+    response_model=LLMUsageResponse,
+    dependencies=[Depends(rate_limit_dependency)],
+)
+async def llm_usage(
+    request: Request,
+    session_id: Optional[str] = None,
+    hours: int = Query(24, ge=1, le=24 * 90),
+    granularity: Literal["minute", "hour", "day"] = "hour",
+    top_sessions: int = Query(20, ge=1, le=500),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    返回最近 hours 小时内的 token 用量：总计、按 granularity 分桶的时间序列，
+    以及用量最多的会话（指定 session_id 时只统计该会话）。
+    数据来自 llm_usage_rollups 表，时间粒度不会细于 USAGE_ROLLUP_BUCKET。
+    """
+    since = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        hours=hours
+    )
+    report = await usage_report(
+        db,
+        since,
+        granularity=granularity,
+        session_id=session_id,
+        top_sessions=top_sessions,
+    )
+    return LLMUsageResponse(since=since, granularity=granularity, **report)
+
 
 # --- END OF FILE py_ai_core/mcp/ops_router.py (Final Dependency Injection Version) ---
\ No newline at end of file
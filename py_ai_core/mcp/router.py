@@ -1,35 +1,61 @@
 # --- START OF FILE py_ai_core/mcp/router.py ---
 
 import json
+import time
 import asyncio
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional
 
 from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from openai.types.chat import ChatCompletionMessage
 
-from py_ai_core.core.database import get_db
-from py_ai_core.models.schemas import ChatRequest, ChatResponse
+from py_ai_core.core.config import settings
+from py_ai_core.core.context import (
+    llm_cache_bypass_var,
+    llm_usage_var,
+    new_llm_usage,
+)
+from py_ai_core.core.database import get_db, AsyncSessionLocal
+from py_ai_core.mcp.batch import assign_custom_ids, run_batch
+from py_ai_core.mcp.jobs import CallbackURLError, job_queue, job_status
+from py_ai_core.models.schemas import (
+    BatchChatRequest,
+    ChatJobRequest,
+    ChatJobStatus,
+    ChatRequest,
+    ChatResponse,
+)
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
 from py_ai_core.services.llm_service import llm_service
 from py_ai_core.services.session_service import session_service
-from py_ai_core.tools.registry import tool_registry
+from py_ai_core.tools.executor import ToolTimeoutError, tool_executor
+from py_ai_core.tools.registry import ToolArgumentError, tool_registry
+from py_ai_core.tools.sandbox import SandboxCrashedError, SandboxLimitExceeded
+from py_ai_core.tools.selection import tool_selector
 
 # ✅ 关键修复: 导入 tools 包，这将触发 __init__.py 中的工具自动注册。
 # 这一行导入是为了执行工具注册的“副作用”，即使这里没有直接使用 `tools` 变量。
 from py_ai_core import tools
 
-
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 所有请求共享的工具并发上限，避免一轮里大量工具调用无节制地并发
+_tool_semaphore = asyncio.Semaphore(settings.TOOL_MAX_CONCURRENCY)
+
 # --- 主路由函数 ---
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest, db: AsyncSession = Depends(get_db)):
-    """处理聊天请求的核心端点。现在逻辑更清晰，负责主流程编排。"""
+async def chat_endpoint(request: ChatRequest):
+    """
+    处理聊天请求的核心端点。现在逻辑更清晰，负责主流程编排。
+    不依赖请求级的 get_db：数据库连接只在读取上下文和保存历史时短暂借用，
+    等待大模型期间不占用连接池，并发聊天数不再受连接池大小限制。
+    """
     session_id = request.session_id
     if not session_id:
         raise HTTPException(status_code=400, detail="session_id is required.")
@@ -38,92 +64,395 @@ async def chat_endpoint(request: ChatRequest, db: AsyncSession = Depends(get_db)
     logger.debug("会话 '%s' 的原始请求体: %s", session_id, request.model_dump_json())
 
     try:
-        # 1. 准备请求上下文
-        system_prompt_content = await session_service.get_or_create_session_prompt(
-            session_id, db, request.system_prompt
-        )
-        history_messages = await session_service.get_history(session_id, db)
+        return await answer_chat(request)
+
+    except UpstreamOverloadedError:
+        # 交给应用级的异常处理器返回 503 与 Retry-After
+        logger.warning("会话 '%s' 的请求因上游过载被拒绝。", session_id)
+        raise
+    except Exception as e:
+        logger.exception("处理会话 '%s' 的请求时发生未知错误。", session_id)
+        raise HTTPException(status_code=500, detail="处理请求时发生内部错误。")
+
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest):
+    """
+    聊天端点的流式版本，以 Server-Sent Events 逐段推送模型输出。
+
+    事件类型: start / delta / tool_call_start / tool_call_end / done / error。
+    """
+    session_id = request.session_id
+    if not session_id:
+        raise HTTPException(status_code=400, detail="session_id is required.")
+
+    logger.info("收到新的流式聊天请求，会话ID: '%s'", session_id)
+    logger.debug("会话 '%s' 的原始请求体: %s", session_id, request.model_dump_json())
+
+    return StreamingResponse(
+        _chat_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-        system_message = {"role": "system", "content": system_prompt_content}
-        current_user_message = {"role": "user", "content": request.query}
-        messages_for_llm = [system_message] + history_messages + [current_user_message]
 
-        # 2. 从LLM获取决策
-        tool_schemas = tool_registry.get_all_schemas()
-        model_message = await llm_service.get_model_decision(
-            messages_for_llm, tool_schemas
+@router.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """
+    批量聊天端点，适合离线/批量任务。
+
+    每完成一项就以 JSON Lines (application/x-ndjson) 推送一行 BatchChatResult，
+    顺序为完成顺序；单项失败时该行的 status 为 "error"，不影响其他条目。
+    指定 batch_id 时，用同一 batch_id 重新提交会直接返回之前已成功的结果。
+    """
+    if len(request.items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"单个批次最多 {settings.BATCH_MAX_ITEMS} 条。",
         )
-        if not model_message:
-            raise HTTPException(status_code=500, detail="与大模型通信失败。")
-
-        # 3. 根据决策分发任务
-        if model_message.tool_calls:
-            final_answer, messages_to_save = await _handle_tool_calls(
-                session_id=session_id,
-                model_message=model_message,
-                messages_for_llm=messages_for_llm,
-                current_user_message=current_user_message,
-            )
-        else:
-            final_answer, messages_to_save = _handle_direct_answer(
-                model_message=model_message,
-                current_user_message=current_user_message,
-            )
+    try:
+        assign_custom_ids(request.items)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # 4. 保存交互历史
-        await session_service.update_history(session_id, messages_to_save, db)
+    logger.info(
+        "收到批量聊天请求 '%s'，共 %d 条。", request.batch_id or "-", len(request.items)
+    )
 
-        # 5. 返回最终结果
-        return ChatResponse(answer=final_answer, session_id=session_id)
+    async def result_lines() -> AsyncIterator[str]:
+        async for result in run_batch(
+            request.items,
+            answer_chat,
+            concurrency=request.concurrency,
+            batch_id=request.batch_id,
+        ):
+            yield result.model_dump_json() + "\n"
 
-    except Exception as e:
-        logger.exception("处理会话 '%s' 的请求时发生未知错误。", session_id)
-        raise HTTPException(status_code=500, detail="处理请求时发生内部错误。")
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+
+@router.post("/jobs", response_model=ChatJobStatus, status_code=202)
+async def submit_chat_job(request: ChatJobRequest, db: AsyncSession = Depends(get_db)):
+    """
+    以异步任务的方式提交聊天请求，立即返回 job_id。
+    结果通过 GET /jobs/{job_id} 轮询，或在任务结束后推送到 callback_url。
+    """
+    if not request.session_id:
+        raise HTTPException(status_code=400, detail="session_id is required.")
+    try:
+        job = await job_queue.submit(request, db)
+    except CallbackURLError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return job_status(job)
+
+
+@router.get("/jobs/{job_id}", response_model=ChatJobStatus)
+async def get_chat_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """查询异步任务的状态与结果。"""
+    job = await job_queue.get(job_id, db)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在。")
+    return job_status(job)
+
+
+@router.post("/jobs/{job_id}/cancel", response_model=ChatJobStatus)
+async def cancel_chat_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """取消排队中或运行中的异步任务；已结束的任务原样返回。"""
+    job = await job_queue.cancel(job_id, db)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在。")
+    return job_status(job)
 
 
 # --- 内部辅助函数 (所有辅助函数保持不变) ---
 
 
-async def _handle_tool_calls(
+async def answer_chat(request: ChatRequest) -> ChatResponse:
+    """
+    一次非流式聊天的完整流程：准备上下文、运行工具调用循环、保存历史。
+    聊天端点、批量接口与异步任务共用；异常由调用方处理。
+    读取与写入阶段各自使用一个短暂的数据库会话，调用大模型和执行工具期间不持有连接。
+    """
+    session_id = request.session_id
+
+    # 1. 准备请求上下文
+    messages_for_llm, current_user_message = await _prepare_turn(request)
+
+    # 2. 多轮获取模型决策并执行工具，直到模型给出最终回答
+    #    工具目录较大时只提供与问题相关的工具
+    selection = tool_selector.select(request.query, messages_for_llm)
+    final_answer, messages_to_save = await _run_agent_loop(
+        session_id=session_id,
+        messages_for_llm=messages_for_llm,
+        current_user_message=current_user_message,
+        tool_schemas=selection.schemas,
+    )
+    tool_selector.record_calls(selection, messages_to_save)
+
+    # 4. 保存交互历史
+    await _save_turn(request, messages_to_save)
+
+    # 5. 返回最终结果
+    return ChatResponse(answer=final_answer, session_id=session_id)
+
+
+async def _prepare_turn(
+    request: ChatRequest,
+) -> tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    准备一次聊天请求的上下文，流式与非流式路径共用。
+    返回发给大模型的完整消息列表，以及本轮的用户消息。
+    """
+    llm_cache_bypass_var.set(not request.use_cache)
+
+    # 会话关闭时连接立即归还连接池
+    async with AsyncSessionLocal() as db:
+        system_prompt_content, history_messages = (
+            await session_service.get_turn_context(
+                request.session_id, db, request.system_prompt
+            )
+        )
+
+    system_message = {"role": "system", "content": system_prompt_content}
+    current_user_message = {"role": "user", "content": request.query}
+    messages_for_llm = [system_message] + history_messages + [current_user_message]
+    return messages_for_llm, current_user_message
+
+
+async def _save_turn(request: ChatRequest, messages_to_save: List[Dict[str, Any]]):
+    """使用一个短暂的数据库会话保存本轮交互历史。"""
+    async with AsyncSessionLocal() as db:
+        await session_service.update_history(
+            request.session_id,
+            messages_to_save,
+            db,
+            system_prompt=request.system_prompt,
+            usage=llm_usage_var.get(),
+        )
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """将一个事件编码为 SSE 文本帧。"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+async def _chat_event_stream(request: ChatRequest) -> AsyncIterator[str]:
+    """
+    流式聊天的事件生成器。
+    响应体在端点函数返回后才开始发送，因此这里自行管理数据库会话，
+    而不依赖请求级的 get_db 依赖项。
+    """
+    session_id = request.session_id
+    try:
+        # 1. 准备请求上下文
+        messages_for_llm, current_user_message = await _prepare_turn(request)
+
+        yield _sse_event("start", {"session_id": session_id})
+
+        # 2. 多轮流式获取模型决策，文本增量与工具调用的开始、结束都会推送事件
+        selection = tool_selector.select(request.query, messages_for_llm)
+        async for event in _agent_loop_events(
+            session_id=session_id,
+            messages_for_llm=messages_for_llm,
+            current_user_message=current_user_message,
+            tool_schemas=selection.schemas,
+            stream=True,
+        ):
+            if event["type"] == "final":
+                final_answer = event["answer"]
+                messages_to_save = event["messages_to_save"]
+            else:
+                event_type = event.pop("type")
+                yield _sse_event(event_type, event)
+        tool_selector.record_calls(selection, messages_to_save)
+
+        # 3. 流结束后保存完整的交互历史
+        await _save_turn(request, messages_to_save)
+
+        yield _sse_event("done", {"answer": final_answer, "session_id": session_id})
+
+    except UpstreamOverloadedError as e:
+        logger.warning("会话 '%s' 的流式请求因上游过载被拒绝。", session_id)
+        yield _sse_event(
+            "error",
+            {"detail": "服务繁忙，请稍后重试。", "retry_after": e.retry_after},
+        )
+    except Exception:
+        logger.exception("处理会话 '%s' 的流式请求时发生未知错误。", session_id)
+        yield _sse_event("error", {"detail": "处理请求时发生内部错误。"})
+
+
+class _LoopBudget:
+    """单个请求内工具调用循环的时间与 token 预算。"""
+
+    def __init__(self):
+        self.deadline = time.monotonic() + settings.AGENT_TIME_BUDGET_SECONDS
+        self.usage = llm_usage_var.get()
+        if self.usage is None:
+            self.usage = new_llm_usage()
+            llm_usage_var.set(self.usage)
+        self.tokens_at_start = self.usage["total_tokens"]
+
+    def exhausted(self, session_id: str) -> bool:
+        """判断预算是否已用尽，用尽时记录原因。"""
+        if settings.AGENT_TIME_BUDGET_SECONDS > 0 and time.monotonic() >= self.deadline:
+            logger.warning("会话 '%s' 的工具循环已超出时间预算，提前结束。", session_id)
+            return True
+        tokens_used = self.usage["total_tokens"] - self.tokens_at_start
+        if (
+            settings.AGENT_TOKEN_BUDGET > 0
+            and tokens_used >= settings.AGENT_TOKEN_BUDGET
+        ):
+            logger.warning(
+                "会话 '%s' 的工具循环已用掉 %d 个 token，超出预算，提前结束。",
+                session_id,
+                tokens_used,
+            )
+            return True
+        return False
+
+
+async def _run_agent_loop(
     session_id: str,
-    model_message: ChatCompletionMessage,
     messages_for_llm: List[Dict[str, Any]],
     current_user_message: Dict[str, Any],
+    tool_schemas: List[Dict[str, Any]],
 ) -> tuple[str, List[Dict[str, Any]]]:
-    """处理模型决定调用工具的逻辑分支。"""
+    """非流式地运行工具调用循环，返回最终回答与需要保存的消息。"""
+    async for event in _agent_loop_events(
+        session_id, messages_for_llm, current_user_message, tool_schemas
+    ):
+        if event["type"] == "final":
+            return event["answer"], event["messages_to_save"]
+
+
+async def _model_turn(
+    messages: List[Dict[str, Any]],
+    tool_schemas: Optional[List[Dict[str, Any]]],
+    stream: bool,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    请求一次模型决策。
+    流式时先逐个产出文本增量 {"type": "delta"}；最后总是产出 {"type": "message"}。
+    """
+    if stream:
+        async for event in llm_service.stream_model_decision(messages, tool_schemas):
+            yield event
+        return
+    model_message = await llm_service.get_model_decision(messages, tool_schemas)
+    if not model_message:
+        raise HTTPException(status_code=500, detail="与大模型通信失败。")
+    yield {"type": "message", "message": model_message}
+
+
+async def _agent_loop_events(
+    session_id: str,
+    messages_for_llm: List[Dict[str, Any]],
+    current_user_message: Dict[str, Any],
+    tool_schemas: List[Dict[str, Any]],
+    stream: bool = False,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    多轮工具调用循环：把每轮的工具结果回灌给模型，直到模型不再请求工具。
+    模型直接给出文本时不再额外发起总结调用；只有在轮数或预算用尽时才强制总结。
+
+    以事件的形式产出进度（delta / tool_call_start / tool_call_end），
+    最后产出 {"type": "final", "answer": ..., "messages_to_save": ...}。
+    流式与非流式路径共用这一个循环，区别只在于模型调用是否流式。
+    """
+    messages = list(messages_for_llm)
+    messages_to_save = [current_user_message]
+    budget = _LoopBudget()
+    final_answer = None
+
+    for round_no in range(1, max(settings.MAX_TOOL_ROUNDS, 1) + 1):
+        model_message = None
+        async for event in _model_turn(messages, tool_schemas, stream):
+            if event["type"] == "delta":
+                yield {"type": "delta", "content": event["content"]}
+            else:
+                model_message = event["message"]
+
+        if not model_message.tool_calls:
+            logger.info("大模型在第 %d 轮提供了直接回答。", round_no)
+            final_answer = model_message.content or "抱歉，我无法回答。"
+            break
+
+        for tc in model_message.tool_calls:
+            yield {
+                "type": "tool_call_start",
+                "id": tc.id,
+                "name": tc.function.name,
+                "arguments": tc.function.arguments,
+                "round": round_no,
+            }
+        round_messages = await _handle_tool_calls(session_id, model_message, round_no)
+        for result in round_messages[1:]:
+            yield {
+                "type": "tool_call_end",
+                "id": result["tool_call_id"],
+                "name": result["name"],
+                "content": result["content"],
+                "round": round_no,
+            }
+        messages.extend(round_messages)
+        messages_to_save.extend(round_messages)
+        if budget.exhausted(session_id):
+            break
+    else:
+        logger.warning(
+            "会话 '%s' 已达到最大工具调用轮数 %d，强制总结。",
+            session_id,
+            settings.MAX_TOOL_ROUNDS,
+        )
+
+    # 工具轮数或预算用尽时，强制进行一次不带工具的总结
+    if final_answer is None:
+        if stream:
+            summary_message = None
+            async for event in llm_service.stream_model_decision(messages):
+                if event["type"] == "delta":
+                    yield {"type": "delta", "content": event["content"]}
+                else:
+                    summary_message = event["message"]
+            final_answer = summary_message.content or "抱歉，我无法回答。"
+        else:
+            final_answer = await llm_service.get_summary_from_tool_results(messages)
+
+    messages_to_save.append({"role": "assistant", "content": final_answer})
+    yield {
+        "type": "final",
+        "answer": final_answer,
+        "messages_to_save": messages_to_save,
+    }
+
+
+async def _handle_tool_calls(
+    session_id: str,
+    model_message: ChatCompletionMessage,
+    round_no: int,
+) -> List[Dict[str, Any]]:
+    """
+    执行一轮工具调用。
+    返回本轮需要追加到上下文的消息：带 tool_calls 的 assistant 消息及各工具结果。
+    """
     logger.info(
-        "大模型决定为会话 '%s' 调用工具: %s",
+        "大模型在第 %d 轮决定为会话 '%s' 调用工具: %s",
+        round_no,
         session_id,
         [tc.function.name for tc in model_message.tool_calls],
     )
     assistant_message_with_tool_calls = model_message.model_dump(exclude_unset=True)
-    tasks = [execute_tool(tc, session_id) for tc in model_message.tool_calls]
-    tool_results = await asyncio.gather(*tasks)
-    messages_for_summary = (
-        messages_for_llm + [assistant_message_with_tool_calls] + tool_results
-    )
-    final_answer = await llm_service.get_summary_from_tool_results(messages_for_summary)
-    messages_to_save = [
-        current_user_message,
-        assistant_message_with_tool_calls,
-        *tool_results,
-        {"role": "assistant", "content": final_answer},
-    ]
-    return final_answer, messages_to_save
 
+    async def run_with_limit(tool_call):
+        async with _tool_semaphore:
+            return await execute_tool(tool_call, session_id)
 
-def _handle_direct_answer(
-    model_message: ChatCompletionMessage,
-    current_user_message: Dict[str, Any],
-) -> tuple[str, List[Dict[str, Any]]]:
-    """处理模型直接回答的逻辑分支。"""
-    logger.info("大模型提供了直接回答。")
-    final_answer = model_message.content or "抱歉，我无法回答。"
-    messages_to_save = [
-        current_user_message,
-        {"role": "assistant", "content": final_answer},
-    ]
-    return final_answer, messages_to_save
+    tool_results = await asyncio.gather(
+        *[run_with_limit(tc) for tc in model_message.tool_calls]
+    )
+    return [assistant_message_with_tool_calls, *tool_results]
 
 
 async def execute_tool(tool_call, session_id: str):
@@ -144,12 +473,17 @@ async def execute_tool(tool_call, session_id: str):
         }
     try:
         tool_args_str = tool_call.function.arguments
-        tool_args = json.loads(tool_args_str)
+        try:
+            tool_args = json.loads(tool_args_str or "{}")
+        except json.JSONDecodeError as e:
+            raise ToolArgumentError(f"工具 '{tool_name}' 的参数不是合法的 JSON: {e}")
+        # 用注册时预先构建的参数模型校验并转换参数，不合法的参数不会进入工具内部
+        tool_args = tool_registry.validate_arguments(tool_name, tool_args)
         logger.debug(
             "为会话 '%s' 调用工具 '%s' 的参数: %s", session_id, tool_name, tool_args
         )
-        result = await tool_to_call(**tool_args)
-        str_result = str(result)
+        # 超时、并发上限、结果缓存与沙箱按工具注册时声明的选项执行
+        str_result = await tool_executor.run(tool_name, tool_to_call, tool_args)
         logger.info("为会话 '%s' 成功执行工具 '%s'。", session_id, tool_name)
         return {
             "tool_call_id": tool_call.id,
@@ -157,6 +491,39 @@ async def execute_tool(tool_call, session_id: str):
             "name": tool_name,
             "content": str_result,
         }
+    except ToolArgumentError as e:
+        logger.warning("会话 '%s' 的工具调用参数不合法: %s", session_id, e)
+        return {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_name,
+            "content": json.dumps(
+                {"error": {"type": "invalid_arguments", "detail": str(e)}},
+                ensure_ascii=False,
+            ),
+        }
+    except (ToolTimeoutError, SandboxLimitExceeded, SandboxCrashedError) as e:
+        limit = "wall" if isinstance(e, ToolTimeoutError) else getattr(e, "limit", None)
+        logger.warning(
+            "为会话 '%s' 执行工具 '%s' 时调用被中止: %s", session_id, tool_name, e
+        )
+        # 以结构化错误告诉模型调用被中止，便于它换一种方式或放弃该工具
+        error = {
+            "type": (
+                "timeout"
+                if limit in ("cpu", "wall")
+                else "resource_limit" if limit else "sandbox_error"
+            ),
+            "detail": str(e),
+        }
+        if limit:
+            error["limit"] = limit
+        return {
+            "tool_call_id": tool_call.id,
+            "role": "tool",
+            "name": tool_name,
+            "content": json.dumps({"error": error}, ensure_ascii=False),
+        }
     except Exception as e:
         logger.exception("为会话 '%s' 执行工具 '%s' 时失败。", session_id, tool_name)
         return {
@@ -1,7 +1,19 @@
 # --- START OF FILE py_ai_core/models/db_models.py ---
 
 import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, func
+from sqlalchemy import (
+    BigInteger,
+    text,
+    Column,
+    Integer,
+    String,
+    Text,
+    DateTime,
+    Index,
+    func,
+    desc,
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from py_ai_core.core.database import Base
 
 
@@ -21,6 +33,13 @@ class ChatSession(Base):
     # 存储这个会话绑定的 system_prompt
     system_prompt = Column(Text, nullable=True)  # 允许为空，表示使用默认prompt
 
+    # 该会话已分配出去的最大消息序号，写入新消息时在同一条 upsert 语句里递增
+    last_seq = Column(Integer, nullable=False, server_default="0")
+
+    # 较早消息的滚动摘要，以及它覆盖到的最大消息序号；构建上下文时只读取序号更大的消息
+    summary = Column(Text, nullable=True)
+    summary_seq = Column(Integer, nullable=False, server_default="0")
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
@@ -36,15 +55,96 @@ class ChatMessage(Base):
     """
 
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # 历史窗口查询按 (session_id, seq) 做范围扫描，不再需要对会话的全部消息排序
+        Index("ix_chat_messages_session_seq", "session_id", desc("seq"), unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String(255), index=True, nullable=False)
+    session_id = Column(String(255), nullable=False)
+    # 会话内的消息序号，从 1 开始连续递增
+    seq = Column(Integer, nullable=False)
     role = Column(String(50), nullable=False)
-    content = Column(Text, nullable=False)
+    # 完整的消息字典，以 JSONB 保存，读取时无需再做 json.loads
+    content = Column(JSONB, nullable=False)
+    # 写入时估算的 token 数，构建上下文窗口时直接累加；迁移前的旧数据为 NULL
+    token_count = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    def __repr__(self):
+        return f"<ChatMessage(id={self.id}, session_id='{self.session_id}', seq={self.seq}, role='{self.role}')>"
+
+
+class LLMUsageRollup(Base):
+    """
+    LLMUsageRollup 数据模型，对应 'llm_usage_rollups' 表。
+    按 (会话, 时间桶) 汇总大模型的 token 用量，每个会话每个时间桶只有一行，
+    写入历史时在同一个事务里累加。
+    """
+
+    __tablename__ = "llm_usage_rollups"
+    __table_args__ = (
+        # 不指定会话、按时间范围汇总时使用
+        Index("ix_llm_usage_rollups_bucket_start", "bucket_start"),
+    )
+
+    session_id = Column(String(255), primary_key=True)
+    # 时间桶的起点，粒度由 USAGE_ROLLUP_BUCKET 决定
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    requests = Column(Integer, nullable=False, server_default="0")
+    llm_calls = Column(Integer, nullable=False, server_default="0")
+    prompt_tokens = Column(BigInteger, nullable=False, server_default="0")
+    completion_tokens = Column(BigInteger, nullable=False, server_default="0")
+    cached_tokens = Column(BigInteger, nullable=False, server_default="0")
+
+    def __repr__(self):
+        return f"<LLMUsageRollup(session_id='{self.session_id}', bucket_start={self.bucket_start})>"
+
+
+class ChatJob(Base):
+    """
+    ChatJob 数据模型，对应 'chat_jobs' 表。
+    异步聊天任务的持久化队列：worker 以 FOR UPDATE SKIP LOCKED 领取任务，
+    多个 worker/进程并发领取时互不阻塞，也不会领到同一个任务。
+    """
+
+    __tablename__ = "chat_jobs"
+    __table_args__ = (
+        # 领取任务时只扫描排队中的任务，按优先级从高到低、提交时间从早到晚
+        Index(
+            "ix_chat_jobs_queue",
+            desc("priority"),
+            "created_at",
+            postgresql_where=text("status = 'queued'"),
+        ),
+        # 回收心跳超时的运行中任务
+        Index(
+            "ix_chat_jobs_running",
+            "heartbeat_at",
+            postgresql_where=text("status = 'running'"),
+        ),
+    )
+
+    id = Column(String(36), primary_key=True)
+    session_id = Column(String(255), nullable=False, index=True)
+    # 提交时的 ChatRequest
+    request = Column(JSONB, nullable=False)
+    priority = Column(Integer, nullable=False, server_default="0")
+    # queued / running / succeeded / failed / cancelled
+    status = Column(String(20), nullable=False, server_default="queued")
+    callback_url = Column(Text, nullable=True)
+    result = Column(JSONB, nullable=True)
+    error = Column(JSONB, nullable=True)
+    attempts = Column(Integer, nullable=False, server_default="0")
+    # 在此时间之前不会被领取，用于上游过载时推迟重试
+    available_at = Column(DateTime(timezone=True), server_default=func.now())
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
 
     def __repr__(self):
-        return f"<ChatMessage(id={self.id}, session_id='{self.session_id}', role='{self.role}')>"
+        return f"<ChatJob(id='{self.id}', session_id='{self.session_id}', status='{self.status}')>"
 
 
 # --- END OF FILE py_ai_core/models/db_models.py ---
@@ -0,0 +1,106 @@
+# --- START OF FILE py_ai_core/models/migrations.py ---
+
+"""
+数据库结构迁移。
+
+项目通过 `Base.metadata.create_all` 建表，它只会创建不存在的表，不会修改已有的表。
+这里维护一组幂等的 SQL 语句，把旧版本创建的表升级到当前结构；
+在新建的数据库上，这些语句都不会产生任何效果。
+
+应用启动时会自动执行迁移。对于数据量很大的表（例如千万级消息），
+类型转换会重写整张表并持有排他锁，建议在停机窗口内单独执行:
+
+    python -m py_ai_core.models.migrations
+"""
+
+import asyncio
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+# 多个 worker 同时启动时，用事务级 advisory lock 保证迁移只被执行一次
+MIGRATION_LOCK_ID = 0x70795F6169  # "py_ai"
+
+SCHEMA_MIGRATIONS = [
+    # --- chat_messages: 会话内序号 + JSONB 内容 + (session_id, seq) 复合索引 ---
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS last_seq INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS seq INTEGER",
+    # 回填只在 seq 列还允许 NULL（即迁移尚未完成）时执行: 检查目录表不扫描数据，
+    # 迁移完成后每次启动都不再读取整张消息表；编号也只针对仍有未编号消息的会话
+    """
+    DO $$
+    BEGIN
+        IF (SELECT is_nullable FROM information_schema.columns
+            WHERE table_name = 'chat_messages' AND column_name = 'seq') = 'YES' THEN
+            CREATE TEMP TABLE unnumbered_sessions ON COMMIT DROP AS
+                SELECT DISTINCT session_id FROM chat_messages WHERE seq IS NULL;
+
+            UPDATE chat_messages AS m
+            SET seq = numbered.rn
+            FROM (
+                SELECT id, row_number() OVER (PARTITION BY session_id ORDER BY created_at, id) AS rn
+                FROM chat_messages
+                WHERE session_id IN (SELECT session_id FROM unnumbered_sessions)
+            ) AS numbered
+            WHERE m.id = numbered.id AND m.seq IS NULL;
+
+            UPDATE chat_sessions AS s
+            SET last_seq = m.max_seq
+            FROM (
+                SELECT session_id, max(seq) AS max_seq FROM chat_messages
+                WHERE session_id IN (SELECT session_id FROM unnumbered_sessions)
+                GROUP BY session_id
+            ) AS m
+            WHERE s.session_id = m.session_id AND s.last_seq < m.max_seq;
+
+            ALTER TABLE chat_messages ALTER COLUMN seq SET NOT NULL;
+        END IF;
+    END $$
+    """,
+    """
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'chat_messages' AND column_name = 'content') = 'text' THEN
+            ALTER TABLE chat_messages ALTER COLUMN content TYPE JSONB USING content::jsonb;
+        END IF;
+    END $$
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_chat_messages_session_seq "
+    "ON chat_messages (session_id, seq DESC)",
+    "DROP INDEX IF EXISTS ix_chat_messages_session_id",
+    # --- chat_messages: 按 token 预算构建上下文窗口 ---
+    # 旧数据保持 NULL，读取时再估算，避免在启动时扫描重写整张表
+    "ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS token_count INTEGER",
+    # --- chat_sessions: 滚动摘要 ---
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary TEXT",
+    "ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS summary_seq INTEGER NOT NULL DEFAULT 0",
+]
+
+
+async def apply_schema_migrations(conn: AsyncConnection) -> None:
+    """在给定连接（及其事务）中依次执行所有迁移语句。"""
+    await conn.execute(text(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})"))
+    for statement in SCHEMA_MIGRATIONS:
+        await conn.execute(text(statement))
+    logger.info(
+        "数据库结构迁移已检查并执行完毕，共 %d 条语句。", len(SCHEMA_MIGRATIONS)
+    )
+
+
+async def _main() -> None:
+    from py_ai_core.core.database import engine
+
+    async with engine.begin() as conn:
+        await apply_schema_migrations(conn)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
+
+# --- END OF FILE py_ai_core/models/migrations.py ---
@@ -1,7 +1,9 @@
 # --- START OF FILE py_ai_core/models/schemas.py ---
 
-from pydantic import BaseModel
-from typing import Optional
+import datetime
+
+from pydantic import BaseModel, Field, HttpUrl
+from typing import Any, Dict, List, Optional
 
 
 class ChatRequest(BaseModel):
@@ -9,6 +11,8 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = None
     # ✅ 允许客户端在请求中指定或更新 system_prompt
     system_prompt: Optional[str] = None
+    # 为 False 时跳过大模型响应缓存，强制重新生成回答
+    use_cache: bool = True
 
 
 class ChatResponse(BaseModel):
@@ -16,4 +20,51 @@ class ChatResponse(BaseModel):
     session_id: Optional[str] = None
 
 
+class ChatJobRequest(ChatRequest):
+    # 数值越大越先执行
+    priority: int = 0
+    # 任务结束后以 POST 推送结果的 http(s) 地址，不提供时由客户端轮询；
+    # 不允许指向内网地址（见 mcp/jobs.py 的 check_callback_url）
+    callback_url: Optional[HttpUrl] = None
+
+
+class ChatJobStatus(BaseModel):
+    job_id: str
+    session_id: str
+    status: str  # queued / running / succeeded / failed / cancelled
+    priority: int = 0
+    attempts: int = 0
+    answer: Optional[str] = None
+    error: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime.datetime] = None
+    started_at: Optional[datetime.datetime] = None
+    finished_at: Optional[datetime.datetime] = None
+
+
+class BatchChatItem(ChatRequest):
+    # 调用方为每一项指定的标识，结果行原样带回；缺省时使用该项在批次中的下标
+    custom_id: Optional[str] = None
+
+
+class BatchChatRequest(BaseModel):
+    items: List[BatchChatItem] = Field(..., min_length=1)
+    # 指定 batch_id 后，已成功的项会被记录下来，用同一 batch_id 重新提交时直接返回而不再执行
+    batch_id: Optional[str] = None
+    # 本批次的并发数，不超过 BATCH_MAX_CONCURRENCY
+    concurrency: Optional[int] = Field(None, ge=1)
+
+
+class BatchChatResult(BaseModel):
+    """批量接口每完成一项输出的一行 JSON。"""
+
+    index: int  # 该项在批次中的下标；命令行入口中无法解析的输入行为 -1
+    custom_id: str
+    status: str  # "ok" / "error"
+    session_id: Optional[str] = None
+    answer: Optional[str] = None
+    error: Optional[Dict[str, Any]] = None
+    # 为 True 表示该结果来自之前的一次提交，本次没有重新执行
+    resumed: bool = False
+
+
 # --- END OF FILE py_ai_core/models/schemas.py ---
@@ -0,0 +1,163 @@
+# --- START OF FILE py_ai_core/services/concurrency_limiter.py ---
+
+"""
+上游并发限制与自适应背压。
+
+每个大模型提供方持有一个 `AdaptiveLimiter`，用 AIMD（加性增、乘性减）算法调整并发上限:
+- 每次调用成功，上限增加 1/limit，相当于每“一整轮”并发成功后上限加 1；
+- 上游返回 429 / 503 或超时，上限减半（短时间内的多次过载只减一次）；
+- 其他失败（请求错误、网络错误、调用方取消等）不调整上限，它们不说明上游还有余量。
+超出上限的请求进入有界的等待队列；队列已满或排队超时时立即抛出
+`UpstreamOverloadedError`，由应用返回 503 并附带 Retry-After，而不是继续堆积协程与内存。
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Optional
+
+from py_ai_core.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamOverloadedError(Exception):
+    """上游容量已满，本次请求被拒绝。retry_after 为建议客户端等待的秒数。"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = (
+            retry_after
+            if retry_after is not None
+            else settings.LLM_OVERLOAD_RETRY_AFTER_SECONDS
+        )
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        queue_timeout: float,
+    ):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._last_decrease = 0.0
+        self.total_queued = 0
+        self.total_queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.total_rejected = 0
+
+    @classmethod
+    def from_settings(cls, name: str) -> "AdaptiveLimiter":
+        return cls(
+            name,
+            initial_limit=settings.LLM_CONCURRENCY_INITIAL,
+            min_limit=settings.LLM_CONCURRENCY_MIN,
+            max_limit=settings.LLM_CONCURRENCY_MAX,
+            max_queue=settings.LLM_QUEUE_MAX,
+            queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+        )
+
+    async def acquire(self) -> None:
+        """获取一个并发名额，必要时排队等待。"""
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.total_rejected += 1
+            raise UpstreamOverloadedError(f"提供方 '{self.name}' 的等待队列已满。")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.total_rejected += 1
+            raise UpstreamOverloadedError(
+                f"在提供方 '{self.name}' 的等待队列中排队超过 {self.queue_timeout:.0f} 秒。"
+            )
+        except asyncio.CancelledError:
+            # 名额已经转交给本请求但它被取消了，归还名额
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            waited = time.monotonic() - started
+            self.total_queued += 1
+            self.total_queue_seconds += waited
+            self.max_queue_seconds = max(self.max_queue_seconds, waited)
+
+    def release(self, succeeded: bool = True, overloaded: bool = False) -> None:
+        """归还名额，并根据本次调用的结果调整并发上限: 成功时加性增，过载时乘性减。"""
+        if overloaded:
+            now = time.monotonic()
+            # 同一波过载会让很多在途请求同时失败，1 秒内只减一次
+            if now - self._last_decrease >= 1.0:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit / 2)
+                logger.warning(
+                    "提供方 '%s' 过载，并发上限降为 %d。", self.name, int(self.limit)
+                )
+        elif succeeded:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._release_slot()
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        # 名额直接转交给排在最前面的等待者
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        在并发名额内执行一次上游调用:
+            async with limiter.slot() as outcome:
+                ...
+                outcome["overloaded"] = True  # 上游返回过载时标记
+        正常退出视为成功；有异常抛出时视为失败，只有标记为过载才降低上限。
+        """
+        await self.acquire()
+        outcome = {"overloaded": False}
+        succeeded = False
+        try:
+            yield outcome
+            succeeded = True
+        finally:
+            self.release(succeeded=succeeded, overloaded=outcome["overloaded"])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "total_queued": self.total_queued,
+            "avg_queue_ms": (
+                self.total_queue_seconds / self.total_queued * 1000
+                if self.total_queued
+                else 0.0
+            ),
+            "max_queue_ms": self.max_queue_seconds * 1000,
+            "total_rejected": self.total_rejected,
+        }
+
+
+# --- END OF FILE py_ai_core/services/concurrency_limiter.py ---
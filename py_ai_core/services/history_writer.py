@@ -0,0 +1,206 @@
+# --- START OF FILE py_ai_core/services/history_writer.py ---
+
+"""
+后台批量历史写入器 (write-behind)。
+
+默认情况下 `update_history` 在请求路径上同步提交，响应要等数据库落盘。
+开启 HISTORY_WRITE_MODE="write_behind" 后，新消息先放进内存队列，
+由后台任务按“条数或时间”触发，把多个请求的消息合并成一个事务批量写入（group commit），
+把提交延迟从响应路径上移走，同时减少高并发下的提交次数。
+
+持久性保证（可配置）:
+- 已返回给客户端的消息，最迟在 HISTORY_WRITER_FLUSH_INTERVAL_MS 之后写入数据库；
+  进程在此之前崩溃会丢失这部分消息。
+- 写入失败时按 HISTORY_WRITER_MAX_RETRIES 重试，仍失败则记录错误并丢弃该批次，
+  同时通过 on_drop 回调通知调用方（SessionService 借此让相关会话的热缓存失效，
+  避免缓存里的历史与数据库不一致）。
+- 正常关闭时会在 HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS 内把队列写完。
+- 读取某个会话的上下文前，只等待该会话自己未落库的对话写完，同样以该时长为上限。
+- HISTORY_WRITER_SYNCHRONOUS_COMMIT=False 时批次以 synchronous_commit=off 提交，
+  数据库崩溃时可能再丢失最近一小段已提交的批次，换取更低的提交延迟。
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from py_ai_core.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PendingTurn(NamedTuple):
+    """一轮对话中待写入的消息。"""
+
+    session_id: str
+    messages: List[Dict[str, Any]]
+    system_prompt: Optional[str] = None
+    # 与 messages 一一对应的 token 数，在请求路径上已经算好时随消息一起传入
+    token_counts: Optional[List[int]] = None
+    # 这一轮对话的大模型 token 用量 (见 core/context.py 的 new_llm_usage)，计入会话汇总
+    usage: Optional[Dict[str, int]] = None
+
+
+# 关闭时放入队列的哨兵，让后台任务立即提交当前批次
+_FLUSH_NOW = object()
+
+
+class HistoryWriter:
+    def __init__(
+        self,
+        flush: Callable[[List[PendingTurn]], Awaitable[None]],
+        on_drop: Optional[Callable[[List[PendingTurn]], Awaitable[None]]] = None,
+    ):
+        """
+        :param flush: 把一批待写入的对话在一个事务里写入数据库的协程函数。
+        :param on_drop: 重试耗尽、批次被丢弃时调用的协程函数，参数为被丢弃的对话。
+        """
+        self._flush = flush
+        self._on_drop = on_drop
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # 每个会话尚未落库的对话轮，按提交顺序排列；该轮写入或被丢弃后对应的 future 完成
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        """启动后台写入任务，在应用生命周期开始时调用。"""
+        self._queue = asyncio.Queue(maxsize=settings.HISTORY_WRITER_MAX_PENDING)
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            "后台历史写入器已启动 (批大小: %d, 刷新间隔: %d ms)。",
+            settings.HISTORY_WRITER_BATCH_SIZE,
+            settings.HISTORY_WRITER_FLUSH_INTERVAL_MS,
+        )
+
+    async def stop(self) -> None:
+        """在超时时间内写完队列中剩余的消息，然后停止后台任务。"""
+        if not self.running:
+            return
+        logger.info("正在关闭后台历史写入器，剩余 %d 轮待写入...", self._queue.qsize())
+        # 不再等待刷新间隔，立即把手头的批次写出去
+        await self._queue.put(_FLUSH_NOW)
+        try:
+            await asyncio.wait_for(
+                self._queue.join(), settings.HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            logger.error(
+                "后台历史写入器未能在 %.1f 秒内写完，%d 轮对话将丢失。",
+                settings.HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS,
+                self._queue.qsize(),
+            )
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        logger.info("后台历史写入器已停止。")
+
+    async def submit(self, turn: PendingTurn) -> None:
+        """提交一轮待写入的对话。队列已满时等待，对上游形成背压。"""
+        await self._queue.put(turn)
+        self._pending.setdefault(turn.session_id, []).append(
+            asyncio.get_running_loop().create_future()
+        )
+
+    def has_pending(self, session_id: str) -> bool:
+        """该会话是否还有尚未落库的消息。"""
+        return bool(self._pending.get(session_id))
+
+    async def wait_for_session(self, session_id: str) -> bool:
+        """
+        等待该会话此刻已提交的对话写入完成（或被丢弃），最多等待 HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS。
+        只等这个会话自己的批次，不受其它会话持续写入的影响。超时返回 False。
+        """
+        waiters = list(self._pending.get(session_id, ()))
+        if not waiters:
+            return True
+        _, not_done = await asyncio.wait(
+            waiters, timeout=settings.HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS
+        )
+        if not_done:
+            logger.warning(
+                "等待会话 '%s' 的后台写入超过 %.1f 秒，仍有 %d 轮未落库。",
+                session_id,
+                settings.HISTORY_WRITER_DRAIN_TIMEOUT_SECONDS,
+                len(not_done),
+            )
+            return False
+        return True
+
+    async def drain(self) -> None:
+        """等待当前队列中的所有消息写入完成。"""
+        if self.running:
+            await self._queue.join()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = settings.HISTORY_WRITER_FLUSH_INTERVAL_MS / 1000
+        while True:
+            batch = []
+            deadline = None
+            while len(batch) < settings.HISTORY_WRITER_BATCH_SIZE:
+                if deadline is None:
+                    item = await self._queue.get()
+                    deadline = loop.time() + interval
+                else:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _FLUSH_NOW:
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+            if batch:
+                await self._flush_batch(batch)
+
+    async def _flush_batch(self, batch: List[PendingTurn]) -> None:
+        for attempt in range(1, settings.HISTORY_WRITER_MAX_RETRIES + 2):
+            try:
+                await self._flush(batch)
+                logger.debug("后台历史写入器已提交一批 %d 轮对话。", len(batch))
+                break
+            except Exception:
+                if attempt > settings.HISTORY_WRITER_MAX_RETRIES:
+                    logger.exception(
+                        "后台历史写入失败且重试耗尽，丢弃 %d 轮对话 (会话: %s)。",
+                        len(batch),
+                        sorted({turn.session_id for turn in batch}),
+                    )
+                    await self._notify_drop(batch)
+                    break
+                logger.warning(
+                    "后台历史写入失败，第 %d 次重试...", attempt, exc_info=True
+                )
+                await asyncio.sleep(0.1 * 2**attempt)
+
+        for turn in batch:
+            # 队列按提交顺序出队，批次里同一会话的第一轮就对应最早的 future
+            waiters = self._pending.get(turn.session_id)
+            if waiters:
+                waiter = waiters.pop(0)
+                if not waiter.done():
+                    waiter.set_result(None)
+                if not waiters:
+                    del self._pending[turn.session_id]
+            self._queue.task_done()
+
+    async def _notify_drop(self, batch: List[PendingTurn]) -> None:
+        if self._on_drop is None:
+            return
+        try:
+            await self._on_drop(batch)
+        except Exception:
+            logger.exception("处理被丢弃的历史批次时出错。")
+
+
+# --- END OF FILE py_ai_core/services/history_writer.py ---
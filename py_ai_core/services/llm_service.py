@@ -1,17 +1,67 @@
 # py_ai_core/services/llm_service.py
 
 import logging
-from openai import AsyncOpenAI
-from typing import List, Dict, Any
+from openai.types.chat import ChatCompletionMessage
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable
 from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_cache_bypass_var, llm_usage_var
+from py_ai_core.core.http_client import create_llm_http_client, http_pool_stats, warm_up
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
+from py_ai_core.services.provider_pool import create_provider_pool
+from py_ai_core.services.response_cache import ResponseCache, canonical_key
+from py_ai_core.services.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
 
+def _record_usage(usage, coalesced: bool = False) -> None:
+    """
+    把一次上游调用的 token 用量累加到当前请求的用量记录中。
+    coalesced=True 表示本请求合并到了其他请求发起的调用上: 只累加 total_tokens
+    供预算控制使用，不计入调用次数与计费用的 token 数。
+    """
+    request_usage = llm_usage_var.get()
+    if request_usage is None or usage is None:
+        return
+    if coalesced:
+        request_usage["coalesced_calls"] += 1
+        request_usage["total_tokens"] += usage.total_tokens or 0
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    request_usage["llm_calls"] += 1
+    request_usage["prompt_tokens"] += usage.prompt_tokens or 0
+    # 向量化请求的用量没有 completion_tokens
+    request_usage["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+    request_usage["cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+    request_usage["total_tokens"] += usage.total_tokens or 0
+
+
+SUMMARY_INSTRUCTION = (
+    "你负责压缩一段对话的历史。请把“已有摘要”和“新的对话内容”合并成一段新的摘要，"
+    "保留用户的目标、偏好、已确认的事实、工具调用得到的关键结果以及尚未解决的问题，"
+    "省略寒暄和重复内容。只输出摘要本身。"
+)
+
+
+def _render_for_summary(message: Dict[str, Any]) -> str:
+    """把一条消息渲染成摘要输入中的一行文本。"""
+    role = message.get("role")
+    content = message.get("content") or ""
+    if role == "tool":
+        return f"[工具 {message.get('name', '')} 的结果] {content}"
+    if message.get("tool_calls"):
+        calls = ", ".join(
+            f"{tc['function']['name']}({tc['function']['arguments']})"
+            for tc in message["tool_calls"]
+        )
+        return f"[助手调用工具] {calls}"
+    return f"[{'用户' if role == 'user' else '助手'}] {content}"
+
+
 class LLMService:
     def __init__(self):
         """
-        构造函数，初始化与大模型服务的异步客户端。
+        构造函数，初始化大模型提供方池（每个提供方一个异步客户端）。
         """
         logger.info("正在初始化大模型服务 (LLMService)...")
 
@@ -20,12 +70,82 @@ class LLMService:
                 "关键配置 OPENAI_API_KEY 或 OPENAI_API_BASE 未设置！服务可能无法正常工作。"
             )
 
-        self.client = AsyncOpenAI(
-            api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_API_BASE
-        )
+        self.http_client = create_llm_http_client()
+        self.pool = create_provider_pool(self.http_client)
         logger.info(
-            "大模型服务客户端已成功创建，目标地址: %s", settings.OPENAI_API_BASE
+            "大模型服务已就绪，共 %d 个提供方，路由策略: %s",
+            len(self.pool.providers),
+            self.pool.policy,
+        )
+        self.cache = ResponseCache(embed=self.get_embedding)
+        self.single_flight = SingleFlight()
+
+    async def _coalesced(
+        self,
+        kind: str,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]],
+        request: Callable[[], Awaitable[Any]],
+    ):
+        """
+        执行一次上游请求；同时进行中的相同请求合并为一次。
+        用户要求跳过缓存（重新生成）时也不合并，保证拿到一次独立的生成结果。
+        共享的调用运行在 leader 的上下文里，用量由每个调用方在自己的上下文中记录。
+        """
+        if not settings.LLM_SINGLE_FLIGHT_ENABLED or llm_cache_bypass_var.get():
+            response = await request()
+            _record_usage(response.usage)
+            return response
+
+        leader = False
+
+        async def run():
+            nonlocal leader
+            leader = True
+            return await request()
+
+        key = canonical_key(kind, settings.MODEL_NAME, messages, tools)
+        response = await self.single_flight.do(key, run)
+        _record_usage(response.usage, coalesced=not leader)
+        return response
+
+    async def _create_completion(self, **kwargs):
+        """经提供方池发起一次非流式请求。用量由调用方 (_coalesced) 记录。"""
+        return await self.pool.call(
+            lambda provider: provider.client.chat.completions.create(
+                model=provider.model, **kwargs
+            )
+        )
+
+    async def warm_up(self) -> None:
+        """应用启动时预热到各个提供方的连接。"""
+        await warm_up(
+            self.http_client,
+            [p.base_url for p in self.pool.providers if p.base_url],
+        )
+
+    async def aclose(self) -> None:
+        """应用关闭时释放共享的 HTTP 连接池。"""
+        await self.http_client.aclose()
+        logger.info("大模型服务的 HTTP 连接池已关闭。")
+
+    def http_pool_stats(self) -> Dict[str, Any]:
+        """返回共享 HTTP 连接池的实时状态。"""
+        return http_pool_stats(self.http_client)
+
+    async def get_embedding(self, text: str) -> List[float]:
+        """
+        获取一段文本的向量表示，用于响应缓存的语义匹配。
+        与聊天请求一样经提供方池发起（并发上限、熔断、重试），用量计入当前请求。
+        """
+        response = await self.pool.call(
+            lambda provider: provider.client.embeddings.create(
+                model=settings.RESPONSE_CACHE_EMBEDDING_MODEL, input=text
+            ),
+            record_latency=False,
         )
+        _record_usage(response.usage)
+        return response.data[0].embedding
 
     async def get_model_decision(
         self, messages: List[Dict[str, Any]], tool_schemas: List[Dict[str, Any]]
@@ -38,16 +158,33 @@ class LLMService:
             "发送给大模型的决策请求内容: messages=%s, tools=%s", messages, tool_schemas
         )
 
+        lookup = await self.cache.lookup(
+            "decision", settings.MODEL_NAME, messages, tool_schemas
+        )
+        if lookup is not None and lookup.value is not None:
+            return ChatCompletionMessage.model_validate(lookup.value)
+
+        request_kwargs: Dict[str, Any] = {"messages": messages}
+        # 筛选后可能没有任何工具；上游不接受空的 tools 列表
+        if tool_schemas:
+            request_kwargs["tools"] = tool_schemas
+            request_kwargs["tool_choice"] = "auto"
+
         try:
-            response = await self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=messages,
-                tools=tool_schemas,
-                tool_choice="auto",
+            response = await self._coalesced(
+                "decision",
+                messages,
+                tool_schemas,
+                lambda: self._create_completion(**request_kwargs),
             )
             model_message = response.choices[0].message
             logger.info("成功从大模型获取决策响应。")
             logger.debug("大模型决策响应详情: %s", model_message)
+            # 工具调用的结果可能随时间变化或带有副作用，只缓存直接回答
+            if lookup is not None and not model_message.tool_calls:
+                await self.cache.store(
+                    lookup, model_message.model_dump(exclude_none=True)
+                )
             return model_message
 
         except Exception as e:
@@ -66,20 +203,146 @@ class LLMService:
         logger.info("正在向大模型请求对工具结果进行总结...")
         logger.debug("发送给大模型的总结请求内容: %s", messages_for_summary)
 
+        lookup = await self.cache.lookup(
+            "summary", settings.MODEL_NAME, messages_for_summary
+        )
+        if lookup is not None and lookup.value is not None:
+            return lookup.value
+
         try:
-            response = await self.client.chat.completions.create(
-                model=settings.MODEL_NAME,
-                messages=messages_for_summary,
+            response = await self._coalesced(
+                "summary",
+                messages_for_summary,
+                None,
+                lambda: self._create_completion(messages=messages_for_summary),
             )
             summary_content = response.choices[0].message.content
             logger.info("成功从大模型获取总结性回复。")
             logger.debug("大模型总结回复详情: %.200s...", summary_content)
+            if lookup is not None and summary_content:
+                await self.cache.store(lookup, summary_content)
             return summary_content
 
+        except UpstreamOverloadedError:
+            raise
         except Exception as e:
             logger.exception("调用大模型总结 API 时发生严重错误。")
             return "抱歉，我在总结工具执行结果时遇到了一个问题。"
 
+    async def get_conversation_summary(
+        self, previous_summary: Optional[str], messages: List[Dict[str, Any]]
+    ) -> str:
+        """
+        把较早的对话压缩成一段摘要，与已有摘要合并。
+        :param previous_summary: 会话当前保存的摘要，没有时为 None。
+        :param messages: 需要并入摘要的消息，按时间正序排列。
+        :return: 新的摘要文本。失败时抛出异常，由调用方决定是否重试，不会保存错误文本。
+        """
+        logger.info("正在向大模型请求生成会话摘要 (%d 条消息)...", len(messages))
+        transcript = "\n".join(_render_for_summary(msg) for msg in messages)
+        user_content = (
+            f"已有摘要:\n{previous_summary or '(无)'}\n\n新的对话内容:\n{transcript}"
+        )
+        response = await self.pool.call(
+            lambda provider: provider.client.chat.completions.create(
+                model=settings.SUMMARY_MODEL_NAME or provider.model,
+                messages=[
+                    {"role": "system", "content": SUMMARY_INSTRUCTION},
+                    {"role": "user", "content": user_content},
+                ],
+                max_tokens=settings.SUMMARY_MAX_TOKENS,
+            )
+        )
+        _record_usage(response.usage)
+        summary = response.choices[0].message.content or ""
+        logger.info("成功从大模型获取会话摘要。")
+        logger.debug("会话摘要详情: %.200s...", summary)
+        return summary.strip()
+
+    async def stream_model_decision(
+        self,
+        messages: List[Dict[str, Any]],
+        tool_schemas: Optional[List[Dict[str, Any]]] = None,
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        以流式方式请求大模型，边接收边产出增量内容。
+        不传 tool_schemas 时即为不带工具的普通生成（例如对工具结果进行总结）。
+
+        产出的事件:
+        - {"type": "delta", "content": str}: 一段文本增量。
+        - {"type": "message", "message": ChatCompletionMessage}: 流结束后拼装好的完整消息，
+          结构与 get_model_decision 的返回值一致，工具调用的参数片段已被合并。
+        """
+        logger.info("正在以流式方式向大模型发起请求...")
+        logger.debug(
+            "发送给大模型的流式请求内容: messages=%s, tools=%s", messages, tool_schemas
+        )
+
+        request_kwargs: Dict[str, Any] = {
+            "messages": messages,
+            "stream": True,
+            # 让上游在最后一个数据块里附带 token 用量
+            "stream_options": {"include_usage": True},
+        }
+        if tool_schemas:
+            request_kwargs["tools"] = tool_schemas
+            request_kwargs["tool_choice"] = "auto"
+
+        try:
+            # 流式响应已经开始向客户端推送后无法再切换，只在建立连接阶段做故障转移，不做对冲；
+            # 并发名额在收到响应头时就已归还，耗时也不计入提供方的延迟统计
+            stream = await self.pool.call(
+                lambda provider: provider.client.chat.completions.create(
+                    model=provider.model, **request_kwargs
+                ),
+                hedge=False,
+                record_latency=False,
+            )
+
+            content_parts: List[str] = []
+            # 工具调用以 index 为键分片到达，需要逐片拼接 name 与 arguments
+            tool_calls: Dict[int, Dict[str, Any]] = {}
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    _record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield {"type": "delta", "content": delta.content}
+                for tc in delta.tool_calls or []:
+                    entry = tool_calls.setdefault(
+                        tc.index,
+                        {
+                            "id": None,
+                            "type": "function",
+                            "function": {"name": "", "arguments": ""},
+                        },
+                    )
+                    if tc.id:
+                        entry["id"] = tc.id
+                    if tc.function:
+                        if tc.function.name:
+                            entry["function"]["name"] += tc.function.name
+                        if tc.function.arguments:
+                            entry["function"]["arguments"] += tc.function.arguments
+
+        except Exception:
+            logger.exception("调用大模型流式 API 时发生严重错误。")
+            raise
+
+        message_dict: Dict[str, Any] = {
+            "role": "assistant",
+            "content": "".join(content_parts) or None,
+        }
+        if tool_calls:
+            message_dict["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        model_message = ChatCompletionMessage.model_validate(message_dict)
+        logger.info("大模型流式响应接收完毕。")
+        logger.debug("拼装后的大模型流式响应详情: %s", model_message)
+        yield {"type": "message", "message": model_message}
+
 
 # 创建一个全局单例
 llm_service = LLMService()
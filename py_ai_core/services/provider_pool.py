@@ -0,0 +1,419 @@
+# --- START OF FILE py_ai_core/services/provider_pool.py ---
+
+"""
+多上游大模型提供方的连接池与路由。
+
+每个提供方是一个 (OpenAI 兼容端点, 模型) 组合，池子为每个提供方跟踪:
+- 延迟的指数加权移动平均 (EWMA) 与最近若干次调用的 p95；
+- 熔断器: 连续失败达到阈值后熔断一段时间，之后放行一次试探请求 (half-open)，
+  成功则恢复，失败则继续熔断。
+
+路由策略 (LLM_ROUTING_POLICY):
+- "lowest_latency": 优先选择 EWMA 延迟最低的提供方（还没有样本的提供方优先被探测）；
+- "weighted": 按配置的权重随机选择；
+- "fallback": 严格按配置顺序，前一个失败才使用下一个。
+无论哪种策略，调用失败时都会依次改用下一个候选提供方。
+
+对冲请求 (LLM_HEDGING_ENABLED): 首个请求超过该提供方的 p95 延迟仍未返回时，
+向下一个候选提供方再发一份相同的请求，采用先返回的结果并取消另一个。
+
+每个提供方的在途请求数由各自的 AdaptiveLimiter 控制（见 concurrency_limiter.py）。
+所有候选都因 429 / 5xx / 网络错误失败时，整体按指数退避加随机抖动重试
+(LLM_MAX_RETRIES)，上游返回 retry-after 时至少等待该时长。
+OpenAI SDK 自带的重试被关闭，避免与这里的重试叠加成重试风暴。
+流式请求只在建立连接期间占用并发名额：收到响应头时调用就已返回，之后的数据块
+不再受并发上限约束。同样的原因，流式调用的耗时只是首包时间，与向量化请求一样
+不计入延迟统计（EWMA 与 p95），以免拉低路由与对冲所依据的聊天补全延迟。
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+import openai
+from openai import AsyncOpenAI
+
+from py_ai_core.core.config import settings
+from py_ai_core.services.concurrency_limiter import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 计算 p95 至少需要的样本数，样本不足时对冲延迟使用 LLM_HEDGE_MIN_DELAY_SECONDS
+_MIN_LATENCY_SAMPLES = 20
+
+# 这些错误由请求本身导致（例如上下文超长），换一个提供方也不会成功，也不应触发熔断
+_NON_RETRYABLE_ERRORS = (openai.BadRequestError, openai.UnprocessableEntityError)
+
+# 这些错误是暂时性的，所有候选都失败时整体退避重试
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.InternalServerError,
+    openai.APIConnectionError,
+    asyncio.TimeoutError,  # 超过 LLM_TOTAL_TIMEOUT_SECONDS
+)
+
+
+def _is_overload(error: Exception) -> bool:
+    """上游是否在表示自己过载（需要降低并发）。"""
+    if isinstance(
+        error, (openai.RateLimitError, openai.APITimeoutError, asyncio.TimeoutError)
+    ):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code == 503
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """读取上游响应中的 retry-after-ms / retry-after 头，没有时返回 None。"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """第 attempt 次重试前的等待时间：指数退避 + 随机抖动，且不少于上游要求的时长。"""
+    backoff = random.uniform(0, settings.LLM_RETRY_BASE_DELAY_SECONDS * 2**attempt)
+    retry_after = _retry_after_seconds(error)
+    if retry_after is not None:
+        backoff = retry_after + random.uniform(0, settings.LLM_RETRY_BASE_DELAY_SECONDS)
+    return min(backoff, settings.LLM_RETRY_MAX_DELAY_SECONDS)
+
+
+class Provider:
+    """池中的一个上游提供方及其健康状态。"""
+
+    def __init__(
+        self,
+        name: str,
+        client: Any,
+        model: str,
+        weight: float = 1.0,
+        base_url: Optional[str] = None,
+    ):
+        self.name = name
+        self.client = client
+        self.model = model
+        self.weight = weight
+        self.base_url = base_url
+        self.ewma_latency: Optional[float] = None
+        self._latencies: deque = deque(maxlen=200)
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.total_calls = 0
+        self.total_failures = 0
+        self.limiter = AdaptiveLimiter.from_settings(name)
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self._probing else "open"
+
+    def available(self, now: float) -> bool:
+        """熔断器是否允许向该提供方发送请求。"""
+        if self.opened_at is None:
+            return True
+        return (
+            not self._probing
+            and now - self.opened_at >= settings.LLM_BREAKER_RESET_SECONDS
+        )
+
+    def p95_latency(self) -> Optional[float]:
+        if len(self._latencies) < _MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def begin(self) -> None:
+        self.total_calls += 1
+        if self.opened_at is not None:
+            self._probing = True
+
+    def record_success(self, latency: Optional[float] = None) -> None:
+        """记录一次成功的调用；latency 为 None 时（例如流式调用）不更新延迟统计。"""
+        if latency is not None:
+            alpha = settings.LLM_EWMA_ALPHA
+            self.ewma_latency = (
+                latency
+                if self.ewma_latency is None
+                else alpha * latency + (1 - alpha) * self.ewma_latency
+            )
+            self._latencies.append(latency)
+        if self.opened_at is not None:
+            logger.info("提供方 '%s' 试探请求成功，熔断器恢复。", self.name)
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.total_failures += 1
+        self.consecutive_failures += 1
+        if (
+            self._probing
+            or self.consecutive_failures >= settings.LLM_BREAKER_FAILURE_THRESHOLD
+        ):
+            if not self._probing:
+                logger.warning(
+                    "提供方 '%s' 连续失败 %d 次，熔断 %.0f 秒。",
+                    self.name,
+                    self.consecutive_failures,
+                    settings.LLM_BREAKER_RESET_SECONDS,
+                )
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self) -> None:
+        """请求被取消（例如对冲中落败）时调用，不计入成功或失败。"""
+        self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.p95_latency()
+        return {
+            "name": self.name,
+            "model": self.model,
+            "weight": self.weight,
+            "state": self.state,
+            "ewma_latency_ms": (
+                self.ewma_latency * 1000 if self.ewma_latency is not None else None
+            ),
+            "p95_latency_ms": p95 * 1000 if p95 is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+            "total_calls": self.total_calls,
+            "total_failures": self.total_failures,
+            "limiter": self.limiter.stats(),
+        }
+
+
+class ProviderPool:
+    def __init__(self, providers: List[Provider], policy: str = "lowest_latency"):
+        if not providers:
+            raise ValueError("ProviderPool 至少需要一个提供方。")
+        self.providers = providers
+        self.policy = policy
+        self.total_hedges = 0
+
+    @property
+    def primary(self) -> Provider:
+        """配置中的第一个提供方，用于不参与路由的辅助调用（例如向量化）。"""
+        return self.providers[0]
+
+    def _ordered_candidates(self) -> List[Provider]:
+        now = time.monotonic()
+        healthy = [p for p in self.providers if p.available(now)]
+        if not healthy:
+            # 全部熔断时不直接失败，按熔断时间先后依次尝试
+            return sorted(self.providers, key=lambda p: p.opened_at or 0)
+
+        if self.policy == "fallback":
+            return healthy
+        if self.policy == "weighted":
+            ordered, remaining = [], list(healthy)
+            while remaining:
+                pick = random.choices(
+                    remaining, weights=[max(p.weight, 0.0) or 1e-9 for p in remaining]
+                )[0]
+                ordered.append(pick)
+                remaining.remove(pick)
+            return ordered
+        # lowest_latency: 还没有样本的提供方视为 0，保证每个提供方都会被探测到
+        return sorted(healthy, key=lambda p: p.ewma_latency or 0.0)
+
+    async def _attempt(
+        self,
+        provider: Provider,
+        call: Callable[[Provider], Awaitable[T]],
+        record_latency: bool = True,
+    ) -> T:
+        async with provider.limiter.slot() as outcome:
+            provider.begin()
+            started = time.monotonic()
+            try:
+                if settings.LLM_TOTAL_TIMEOUT_SECONDS > 0:
+                    result = await asyncio.wait_for(
+                        call(provider), settings.LLM_TOTAL_TIMEOUT_SECONDS
+                    )
+                else:
+                    result = await call(provider)
+            except asyncio.CancelledError:
+                provider.release()
+                raise
+            except _NON_RETRYABLE_ERRORS:
+                provider.release()
+                raise
+            except Exception as e:
+                outcome["overloaded"] = _is_overload(e)
+                provider.record_failure()
+                raise
+            provider.record_success(
+                time.monotonic() - started if record_latency else None
+            )
+            return result
+
+    async def call(
+        self,
+        call: Callable[[Provider], Awaitable[T]],
+        hedge: Optional[bool] = None,
+        record_latency: bool = True,
+    ) -> T:
+        """
+        按路由策略选择提供方执行 call(provider)，失败时依次改用下一个候选。
+        :param hedge: 是否允许对冲请求，默认取 LLM_HEDGING_ENABLED。流式请求等不适合重复发送的调用应传 False。
+        :param record_latency: 是否把本次耗时计入提供方的延迟统计。耗时与聊天补全不可比的调用
+            （流式请求只等到响应头、向量化请求）应传 False，以免影响路由与对冲延迟。
+        """
+        if hedge is None:
+            hedge = settings.LLM_HEDGING_ENABLED
+        for attempt in range(settings.LLM_MAX_RETRIES + 1):
+            try:
+                return await self._call_candidates(call, hedge, record_latency)
+            except _RETRYABLE_ERRORS as e:
+                if attempt >= settings.LLM_MAX_RETRIES:
+                    raise
+                delay = _retry_delay(e, attempt)
+                logger.warning(
+                    "所有提供方暂时不可用 (%s)，%.2f 秒后第 %d 次重试。",
+                    type(e).__name__,
+                    delay,
+                    attempt + 1,
+                )
+                await asyncio.sleep(delay)
+
+    async def _call_candidates(
+        self,
+        call: Callable[[Provider], Awaitable[T]],
+        hedge: bool,
+        record_latency: bool = True,
+    ) -> T:
+        """按顺序尝试每个候选提供方，直到有一个成功。"""
+        candidates = self._ordered_candidates()
+        last_error: Optional[Exception] = None
+
+        while candidates:
+            provider = candidates.pop(0)
+            try:
+                if hedge and candidates:
+                    return await self._hedged(
+                        provider, candidates, call, record_latency
+                    )
+                return await self._attempt(provider, call, record_latency)
+            except _NON_RETRYABLE_ERRORS:
+                raise
+            except Exception as e:
+                last_error = e
+                if candidates:
+                    logger.warning(
+                        "提供方 '%s' 调用失败 (%s)，改用下一个提供方。",
+                        provider.name,
+                        type(e).__name__,
+                    )
+        raise last_error
+
+    async def _hedged(
+        self,
+        provider: Provider,
+        candidates: List[Provider],
+        call: Callable[[Provider], Awaitable[T]],
+        record_latency: bool = True,
+    ) -> T:
+        """
+        先向 provider 发送请求，超过其 p95 延迟仍未返回时，
+        从 candidates 中取出下一个提供方发送对冲请求。
+        采用先成功返回的结果，取消另一个；两个都失败时抛出后一个错误。
+        """
+        delay = max(provider.p95_latency() or 0.0, settings.LLM_HEDGE_MIN_DELAY_SECONDS)
+        primary = asyncio.ensure_future(self._attempt(provider, call, record_latency))
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+
+            backup_provider = candidates.pop(0)
+            self.total_hedges += 1
+            logger.info(
+                "提供方 '%s' 超过 %.0f ms 未返回，向 '%s' 发送对冲请求。",
+                provider.name,
+                delay * 1000,
+                backup_provider.name,
+            )
+            tasks.append(
+                asyncio.ensure_future(
+                    self._attempt(backup_provider, call, record_latency)
+                )
+            )
+            pending = set(tasks)
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 落败的请求以及调用方取消时仍在进行的请求都要取消
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "hedging_enabled": settings.LLM_HEDGING_ENABLED,
+            "total_hedges": self.total_hedges,
+            "providers": [p.stats() for p in self.providers],
+        }
+
+
+def create_provider_pool(http_client: Optional[Any] = None) -> ProviderPool:
+    """
+    根据配置创建提供方池，所有提供方共用 http_client 的连接池。
+    LLM_PROVIDERS 为空时，使用 OPENAI_API_KEY / OPENAI_API_BASE / MODEL_NAME 作为唯一的提供方；
+    否则其中每一项可以包含 name、base_url、api_key、model、weight，缺省字段沿用上述单提供方配置。
+    """
+    configs = settings.LLM_PROVIDERS or [{}]
+    providers = []
+    for i, config in enumerate(configs):
+        base_url = config.get("base_url", settings.OPENAI_API_BASE)
+        client = AsyncOpenAI(
+            api_key=config.get("api_key", settings.OPENAI_API_KEY),
+            base_url=base_url,
+            # 重试由 ProviderPool 统一负责
+            max_retries=0,
+            http_client=http_client,
+        )
+        providers.append(
+            Provider(
+                name=config.get("name", f"provider-{i}"),
+                client=client,
+                model=config.get("model", settings.MODEL_NAME),
+                weight=float(config.get("weight", 1.0)),
+                base_url=base_url,
+            )
+        )
+        logger.info("已注册大模型提供方 '%s': %s", providers[-1].name, base_url)
+    return ProviderPool(providers, policy=settings.LLM_ROUTING_POLICY)
+
+
+# --- END OF FILE py_ai_core/services/provider_pool.py ---
@@ -0,0 +1,228 @@
+# --- START OF FILE py_ai_core/services/response_cache.py ---
+
+"""
+大模型响应缓存。
+
+两层缓存，都只在 RESPONSE_CACHE_ENABLED 开启时生效:
+- 精确层: 以 (调用类型, 模型, 消息列表, 工具定义) 的规范化 JSON 的 sha256 为键，
+  保存在共享状态后端中，带 TTL；进程内后端按 LRU 淘汰，Redis 后端依赖服务端的
+  maxmemory-policy (建议 allkeys-lru)。
+- 语义层 (RESPONSE_CACHE_SEMANTIC_ENABLED): 只用于没有历史记录的单轮提问
+  (系统提示词 + 一条用户消息)。用户问题的向量保存在进程内的向量索引里，
+  与已缓存问题的余弦相似度超过阈值时，复用那个问题在精确层中的响应。
+
+请求可以通过 llm_cache_bypass_var 跳过缓存（例如 ChatRequest.use_cache=False）。
+"""
+
+import hashlib
+import json
+import logging
+import math
+import operator
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_cache_bypass_var
+from py_ai_core.core.state_backend import StateBackend, state_backend
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖，没有安装时向量检索退化为纯 Python 实现
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def canonical_key(kind: str, model: str, messages: List[Dict[str, Any]], tools=None):
+    """对请求内容做规范化序列化（键排序、无多余空白）后取 sha256。"""
+    payload = json.dumps(
+        {"kind": kind, "model": model, "messages": messages, "tools": tools or []},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class VectorIndex:
+    """
+    进程内的定长向量索引，按 LRU 淘汰，线性扫描求最大余弦相似度。
+    向量按分区隔离：只有系统提示词、模型和工具定义都相同的问题才会互相匹配。
+    """
+
+    def __init__(self, maxsize: int = 1000):
+        self._maxsize = maxsize
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, partition: str, key: str, vector: List[float]) -> None:
+        vector = _normalize(vector)
+        if np is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+        self._entries[key] = (partition, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def search(self, partition: str, vector: List[float], threshold: float):
+        """返回相似度不低于阈值的最相近条目的键，没有则返回 None。"""
+        candidates = [
+            (key, stored)
+            for key, (stored_partition, stored) in self._entries.items()
+            if stored_partition == partition
+        ]
+        if not candidates:
+            return None
+        query = _normalize(vector)
+        if np is not None:
+            matrix = np.stack([stored for _, stored in candidates])
+            scores = matrix @ np.asarray(query, dtype=np.float32)
+            best = int(scores.argmax())
+            best_score = float(scores[best])
+        else:
+            scores = [sum(map(operator.mul, stored, query)) for _, stored in candidates]
+            best = max(range(len(scores)), key=scores.__getitem__)
+            best_score = scores[best]
+        if best_score < threshold:
+            return None
+        key = candidates[best][0]
+        self._entries.move_to_end(key)
+        return key
+
+
+class CacheLookup(NamedTuple):
+    """一次缓存查询的结果，未命中时原样传给 store() 以写入缓存。"""
+
+    key: str
+    value: Optional[Any] = None
+    partition: Optional[str] = None
+    vector: Optional[List[float]] = None
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        embed: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+        state: Optional[StateBackend] = None,
+    ):
+        """
+        :param embed: 把一段文本转成向量的协程函数，语义层需要。
+        :param state: 精确层使用的状态后端，默认为全局共享的后端。
+        """
+        self._embed = embed
+        self._state = state or state_backend
+        self._index = VectorIndex(maxsize=settings.RESPONSE_CACHE_INDEX_SIZE)
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "bypassed": 0,
+            "errors": 0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """返回当前 worker 的命中统计。"""
+        lookups = (
+            self._stats["exact_hits"]
+            + self._stats["semantic_hits"]
+            + self._stats["misses"]
+        )
+        hits = self._stats["exact_hits"] + self._stats["semantic_hits"]
+        return {
+            "enabled": settings.RESPONSE_CACHE_ENABLED,
+            "semantic_enabled": settings.RESPONSE_CACHE_SEMANTIC_ENABLED,
+            **self._stats,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "index_size": len(self._index),
+        }
+
+    async def lookup(
+        self,
+        kind: str,
+        model: str,
+        messages: List[Dict[str, Any]],
+        tools: Optional[List[Dict[str, Any]]] = None,
+    ) -> Optional[CacheLookup]:
+        """
+        查询缓存。缓存关闭或本次请求选择跳过时返回 None；
+        否则返回 CacheLookup，命中时其 value 为缓存的响应。
+        """
+        if not settings.RESPONSE_CACHE_ENABLED:
+            return None
+        if llm_cache_bypass_var.get():
+            self._stats["bypassed"] += 1
+            return None
+
+        key = canonical_key(kind, model, messages, tools)
+        try:
+            value = await self._state.get(f"llm_cache:{key}")
+            if value is not None:
+                self._stats["exact_hits"] += 1
+                logger.info("大模型响应缓存精确命中 (%s)。", kind)
+                return CacheLookup(key, value)
+
+            partition = vector = None
+            question = self._semantic_question(messages)
+            if question is not None:
+                partition = canonical_key(
+                    kind,
+                    model,
+                    [m for m in messages if m.get("role") == "system"],
+                    tools,
+                )
+                vector = await self._embed(question)
+                similar_key = self._index.search(
+                    partition, vector, settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD
+                )
+                if similar_key is not None:
+                    value = await self._state.get(f"llm_cache:{similar_key}")
+                    if value is not None:
+                        self._stats["semantic_hits"] += 1
+                        logger.info("大模型响应缓存语义命中 (%s)。", kind)
+                        return CacheLookup(key, value)
+        except Exception:
+            # 缓存故障不应影响正常请求，按未命中处理
+            self._stats["errors"] += 1
+            logger.warning("查询大模型响应缓存失败，按未命中处理。", exc_info=True)
+            return CacheLookup(key)
+
+        self._stats["misses"] += 1
+        return CacheLookup(key, partition=partition, vector=vector)
+
+    async def store(self, lookup: CacheLookup, value: Any) -> None:
+        """把一次未命中的调用结果写入缓存。"""
+        try:
+            await self._state.set(
+                f"llm_cache:{lookup.key}",
+                value,
+                ttl=settings.RESPONSE_CACHE_TTL_SECONDS,
+            )
+            if lookup.vector is not None:
+                self._index.add(lookup.partition, lookup.key, lookup.vector)
+            self._stats["stores"] += 1
+        except Exception:
+            self._stats["errors"] += 1
+            logger.warning("写入大模型响应缓存失败。", exc_info=True)
+
+    def _semantic_question(self, messages: List[Dict[str, Any]]) -> Optional[str]:
+        """只有“系统提示词 + 一条用户消息”的单轮提问才参与语义匹配，返回该问题。"""
+        if not settings.RESPONSE_CACHE_SEMANTIC_ENABLED or self._embed is None:
+            return None
+        turns = [m for m in messages if m.get("role") != "system"]
+        if len(turns) != 1 or turns[0].get("role") != "user":
+            return None
+        content = turns[0].get("content")
+        return content if isinstance(content, str) and content else None
+
+
+# --- END OF FILE py_ai_core/services/response_cache.py ---
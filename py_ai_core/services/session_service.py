@@ -6,173 +6,543 @@ from typing import List, Dict, Any, Optional
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import desc
+from sqlalchemy import desc, func, text, true, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 from py_ai_core.models.db_models import ChatMessage, ChatSession
+from py_ai_core.services.history_writer import HistoryWriter, PendingTurn
+from py_ai_core.services.llm_service import llm_service
+from py_ai_core.services.summarizer import BackgroundSummarizer
+from py_ai_core.services.usage_service import accumulate_usage, record_usage
 from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_usage_var, new_llm_usage
+from py_ai_core.core.database import AsyncSessionLocal
+from py_ai_core.core.state_backend import StateBackend, state_backend
+from py_ai_core.core.tokens import (
+    count_message_tokens,
+    count_text_tokens,
+    history_token_budget,
+)
 
 logger = logging.getLogger(__name__)
 
+# 会话摘要拼接在系统提示词之后时使用的标题
+SUMMARY_HEADER = "以下是本会话较早内容的摘要，供你参考:"
+
+
+def _parse_content(message_id: int, role: str, content: Any) -> Dict[str, Any]:
+    """
+    把数据库中保存的消息内容还原为消息字典。
+    JSONB 列读出来已经是字典；字符串只会出现在迁移前的旧数据里，需要再解析一次。
+    """
+    if isinstance(content, dict):
+        return content
+    try:
+        return json.loads(content)
+    except (json.JSONDecodeError, TypeError):
+        logger.warning("解析历史消息 content 失败，消息ID: %s", message_id)
+        return {"role": role, "content": content}
+
+
+def _build_buffer(rows) -> tuple[List[Dict[str, Any]], List[int]]:
+    """
+    把按时间正序排列的消息行还原为消息缓冲区，以及与之一一对应的 token 数。
+    迁移前写入的旧消息没有保存 token 数，在这里补算。
+    """
+    buffer, token_counts = [], []
+    for row in rows:
+        message = _parse_content(row.id, row.role, row.content)
+        buffer.append(message)
+        token_counts.append(
+            row.token_count
+            if row.token_count is not None
+            else count_message_tokens(message)
+        )
+    return buffer, token_counts
+
+
+def _select_window(
+    buffer: List[Dict[str, Any]],
+    token_counts: Optional[List[int]] = None,
+    budget: Optional[int] = None,
+    first_seq: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    “智能滑动窗口”：从按时间正序排列的缓冲区里，由新到旧累加每条消息的 token 数，
+    截取不超过 token 预算的最近消息。
+    HISTORY_WINDOW_MODE="aligned" 且已知缓冲区第一条消息的序号 (first_seq) 时，
+    窗口起点向后取整到 HISTORY_BLOCK_SIZE 的块边界：起点在多轮之间保持不变，
+    直到预算装不下时才整块前移，发给模型的消息前缀因此很少变化。
+    如果窗口最老的消息是工具结果（发起它的 tool_calls 已被截掉），就继续向后收缩，
+    保证发给模型的工具调用链总是完整的。
+    """
+    if budget is None:
+        budget = history_token_budget()
+    if token_counts is None or len(token_counts) != len(buffer):
+        token_counts = [count_message_tokens(msg) for msg in buffer]
+
+    start, used = len(buffer), 0
+    while start > 0 and used + token_counts[start - 1] <= budget:
+        start -= 1
+        used += token_counts[start]
+    block = settings.HISTORY_BLOCK_SIZE
+    if (
+        settings.HISTORY_WINDOW_MODE == "aligned"
+        and first_seq is not None
+        and block > 1
+    ):
+        offset = (first_seq + start - 1) % block
+        aligned = start + (block - offset if offset else 0)
+        # 预算只够装下不到两个块时，对齐会丢掉太多最近的消息，退回逐条滑动
+        if aligned <= len(buffer) - block:
+            start = aligned
+    while start < len(buffer) and buffer[start].get("role") == "tool":
+        logger.debug("窗口以不完整的工具调用链开头，正在收缩历史窗口...")
+        start += 1
+    return buffer[start:]
+
 
 class SessionService:
-    # ... __init__, get_or_create_session, get_or_create_session_prompt 函数保持不变 ...
-    def __init__(self):
+    def __init__(self, state: Optional[StateBackend] = None):
+        # 热会话缓存保存在共享状态后端中，键为 "session:<session_id>"，
+        # 值为 {"system_prompt": str | None, "messages": list | None, "token_counts": list | None}。
+        # messages 是已解析、按时间正序排列的最近 HISTORY_FETCH_LIMIT 条消息，
+        # 与数据库查询读取的缓冲区大小一致，因此从缓存截取出的窗口与查库结果相同；
+        # token_counts 与 messages 一一对应；last_seq 是 messages 最后一条的序号，
+        # summary / summary_seq 是会话的滚动摘要及其覆盖到的序号。
+        self._state = state or state_backend
+        # write-behind 模式下的后台写入器，由应用生命周期负责启动和停止
+        self.history_writer = HistoryWriter(
+            self._flush_turns, on_drop=self._invalidate_cached
+        )
+        # 窗口装不下的较早消息由后台任务压缩进会话摘要
+        self.summarizer = BackgroundSummarizer(self._refresh_summary)
         logger.info("数据库会话服务 (SessionService) 已初始化。")
 
-    async def get_or_create_session(
-        self, session_id: str, db: AsyncSession
-    ) -> ChatSession:
-        """获取或创建一个会话对象。"""
-        query = select(ChatSession).where(ChatSession.session_id == session_id)
-        result = await db.execute(query)
-        session = result.scalars().first()
-
-        if not session:
-            logger.info("会话 '%s' 不存在，正在创建新会话...", session_id)
-            session = ChatSession(
-                session_id=session_id, system_prompt=settings.DEFAULT_SYSTEM_PROMPT
-            )
-            db.add(session)
-            await db.commit()
-            await db.refresh(session)
-            logger.info("新会话 '%s' 已成功创建并使用默认系统提示词。", session_id)
-        return session
+    async def _get_cached(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return await self._state.get(f"session:{session_id}")
 
-    async def get_or_create_session_prompt(
-        self, session_id: str, db: AsyncSession, requested_prompt: Optional[str] = None
-    ) -> str:
+    async def _update_cached(
+        self, session_id: str, entry: Optional[Dict[str, Any]] = None, **fields
+    ) -> None:
         """
-        获取会话的系统提示词。如果请求中提供了新的提示词，则更新会话。
+        更新某个会话缓存条目的部分字段，并重置其存活时间。
+        调用方已经读出条目时可以通过 entry 传入，省去一次后端读取。
         """
-        session = await self.get_or_create_session(session_id, db)
-
-        if requested_prompt and session.system_prompt != requested_prompt:
-            logger.info("为会话 '%s' 更新系统提示词。", session_id)
-            session.system_prompt = requested_prompt
-            await db.commit()
-            await db.refresh(session)
-            logger.info("会话 '%s' 的系统提示词已更新。", session_id)
-
-        return session.system_prompt or settings.DEFAULT_SYSTEM_PROMPT
+        if entry is None:
+            entry = await self._get_cached(session_id)
+        entry = {
+            "system_prompt": None,
+            "messages": None,
+            "token_counts": None,
+            "last_seq": None,
+            "summary": None,
+            "summary_seq": 0,
+            **(entry or {}),
+            **fields,
+        }
+        await self._state.set(
+            f"session:{session_id}", entry, ttl=settings.SESSION_CACHE_TTL_SECONDS
+        )
 
-    async def get_history(
-        self, session_id: str, db: AsyncSession
-    ) -> List[Dict[str, Any]]:
-        """
-        根据 session_id 从数据库获取历史消息。
-        实现了“智能滑动窗口”机制，确保工具调用链的完整性。
+    async def get_turn_context(
+        self, session_id: str, db: AsyncSession, requested_prompt: Optional[str] = None
+    ) -> tuple[str, List[Dict[str, Any]]]:
         """
-        if not session_id:
-            return []
+        一次性准备一轮对话所需的上下文：系统提示词和历史窗口。
 
-        logger.info("正在从数据库为会话 '%s' 获取历史记录 (智能截断)...", session_id)
-
-        # 1. 为了保证逻辑完整性，我们稍微多取一些数据，比如窗口大小的两倍。
-        #    这样可以确保我们有足够的上下文来判断截断点。
+        这是聊天请求的快速路径，只读不写：
+        - 命中热缓存时不访问数据库；
+        - 未命中时用一条 SELECT（会话 LEFT JOIN LATERAL 最近消息）同时取回提示词和历史。
+        会话的创建与提示词的变更都推迟到 update_history 中，与新消息在同一个事务里提交。
+        """
+        if self.history_writer.has_pending(session_id):
+            # 后台还有未落库的消息时，缓存与数据库里都还没有它们，先等这个会话的写完，避免读到残缺的历史
+            await self.history_writer.wait_for_session(session_id)
+
+        entry = await self._get_cached(session_id)
+        if (
+            entry
+            and entry["system_prompt"] is not None
+            and entry["messages"] is not None
+            and entry.get("last_seq") is not None
+        ):
+            logger.debug("会话 '%s' 的上下文命中缓存。", session_id)
+            return self._build_turn_context(session_id, entry, requested_prompt)
+
+        logger.info("正在从数据库为会话 '%s' 一次性获取提示词与历史记录...", session_id)
+        # 会话内的序号是连续的，最近 N 条消息就是 seq 落在 (last_seq - N, last_seq]
+        # 区间内的行，可以直接在 (session_id, seq) 复合索引上做范围扫描；
+        # 已经并入摘要的消息不再读取
+        window = (
+            select(
+                ChatMessage.id,
+                ChatMessage.seq,
+                ChatMessage.role,
+                ChatMessage.content,
+                ChatMessage.token_count,
+            )
+            .where(
+                ChatMessage.session_id == ChatSession.session_id,
+                ChatMessage.seq
+                > func.greatest(
+                    ChatSession.last_seq - settings.HISTORY_FETCH_LIMIT,
+                    ChatSession.summary_seq,
+                ),
+            )
+            .lateral("history_window")
+        )
         query = (
-            select(ChatMessage)
-            .where(ChatMessage.session_id == session_id)
-            .order_by(desc(ChatMessage.created_at), desc(ChatMessage.id))
-            .limit(settings.MAX_HISTORY_MESSAGES * 2)  # 多取一些作为缓冲区
+            select(
+                ChatSession.system_prompt,
+                ChatSession.last_seq,
+                ChatSession.summary,
+                ChatSession.summary_seq,
+                window.c.id,
+                window.c.role,
+                window.c.content,
+                window.c.token_count,
+            )
+            .select_from(ChatSession)
+            .outerjoin(window, true())
+            .where(ChatSession.session_id == session_id)
+            .order_by(desc(window.c.seq))
         )
-
         result = await db.execute(query)
-        # 注意：这里是倒序的，最新的在最前面
-        recent_messages_desc = result.scalars().all()
-
-        if not recent_messages_desc:
-            logger.info("会话 '%s' 在数据库中没有历史记录。", session_id)
-            return []
-
-        # 2. 从最新的消息开始，截取到我们配置的窗口大小
-        #    我们操作的是倒序列表，所以是从列表的开头截取
-        if len(recent_messages_desc) > settings.MAX_HISTORY_MESSAGES:
-            truncated_desc = recent_messages_desc[: settings.MAX_HISTORY_MESSAGES]
+        rows = result.all()
+
+        if rows:
+            stored_prompt = rows[0].system_prompt or settings.DEFAULT_SYSTEM_PROMPT
+            session_state = {
+                "last_seq": rows[0].last_seq,
+                "summary": rows[0].summary,
+                "summary_seq": rows[0].summary_seq,
+            }
         else:
-            truncated_desc = recent_messages_desc
-
-        # 3. ✅✅✅ 智能截断的核心逻辑 ✅✅✅
-        #    检查被截断后的“最老”一条消息（在倒序列表里是最后一条）
-        #    如果它是一个 'tool' 或者是有 'tool_calls' 的 'assistant' 消息，
-        #    说明一个完整的调用链被切断了，我们需要往前多取几条，直到找到这个链的起点。
-        final_messages_desc = list(truncated_desc)
-
-        # 从被截断的边缘开始往回看
-        oldest_message_in_window_index = len(truncated_desc) - 1
-
-        # 只要窗口的最老一条消息是工具调用链的一部分，就继续往前扩张窗口
-        while oldest_message_in_window_index < len(recent_messages_desc) - 1:
-            oldest_message_model = final_messages_desc[-1]
-            try:
-                # 解析消息内容来判断
-                content_dict = json.loads(oldest_message_model.content)
-                role = content_dict.get("role")
-                has_tool_calls = "tool_calls" in content_dict
-
-                # 如果最老的消息是 tool，或者是有 tool_calls 的 assistant，说明链条不完整
-                if role == "tool" or (role == "assistant" and has_tool_calls):
-                    logger.debug("发现不完整的工具调用链，正在向前扩展历史窗口...")
-                    # 从原始的、更长的历史记录中，把更早的一条消息加进来
-                    oldest_message_in_window_index += 1
-                    final_messages_desc.append(
-                        recent_messages_desc[oldest_message_in_window_index]
-                    )
-                else:
-                    # 如果最老的消息是 user 或者普通的 assistant 回答，说明链条是完整的，可以停止扩展
-                    break
-            except (json.JSONDecodeError, AttributeError):
-                # 解析失败或格式不对，也视为一个完整的终点
-                break
-
-        # 4. 将最终确定的、倒序的消息列表，反转成正确的对话顺序
-        messages_in_correct_order = list(reversed(final_messages_desc))
-
-        logger.info(
-            "成功获取会话 '%s' 的 %d 条历史消息 (原始上限: %d, 智能扩展后)。",
-            session_id,
-            len(messages_in_correct_order),
-            settings.MAX_HISTORY_MESSAGES,
-        )
+            logger.info("会话 '%s' 不存在，将在写入历史时创建。", session_id)
+            stored_prompt = settings.DEFAULT_SYSTEM_PROMPT
+            session_state = {"last_seq": 0, "summary": None, "summary_seq": 0}
 
-        history_dicts = []
-        for msg in messages_in_correct_order:
-            try:
-                message_dict = json.loads(msg.content)
-                history_dicts.append(message_dict)
-            except json.JSONDecodeError:
-                logger.warning("解析历史消息 content 失败，消息ID: %s", msg.id)
-                history_dicts.append({"role": msg.role, "content": msg.content})
-
-        return history_dicts
+        # 查询结果是倒序的，最新的在最前面；没有消息的会话会得到一行 id 为 NULL 的记录
+        buffer, token_counts = _build_buffer(
+            row for row in reversed(rows) if row.id is not None
+        )
+        entry = {
+            "system_prompt": stored_prompt,
+            "messages": buffer,
+            "token_counts": token_counts,
+            **session_state,
+        }
+        await self._update_cached(session_id, entry=entry)
+        return self._build_turn_context(session_id, entry, requested_prompt)
+
+    def _build_turn_context(
+        self,
+        session_id: str,
+        entry: Dict[str, Any],
+        requested_prompt: Optional[str] = None,
+    ) -> tuple[str, List[Dict[str, Any]]]:
+        """
+        在缓存条目上构建一轮对话的上下文:
+        - 已并入摘要的消息从缓冲区中跳过，摘要拼接在系统提示词之后；
+        - 剩余的 token 预算用来截取最近的历史窗口；
+        - 窗口外还没有摘要的消息累计足够多时，提交后台摘要任务。
+        """
+        system_prompt = requested_prompt or entry["system_prompt"]
+        buffer = entry["messages"]
+        token_counts = entry.get("token_counts")
+        if token_counts is None or len(token_counts) != len(buffer):
+            token_counts = [count_message_tokens(msg) for msg in buffer]
+
+        # 缓冲区是序号连续的最近消息，第一条的序号可以由 last_seq 推出
+        first_seq = entry["last_seq"] - len(buffer) + 1
+        skip = min(max(entry.get("summary_seq", 0) - first_seq + 1, 0), len(buffer))
+        buffer, token_counts = buffer[skip:], token_counts[skip:]
+
+        budget = history_token_budget()
+        summary_messages = []
+        if entry.get("summary"):
+            summary_block = f"{SUMMARY_HEADER}\n{entry['summary']}"
+            budget = max(budget - count_text_tokens(summary_block), 0)
+            if settings.HISTORY_WINDOW_MODE == "aligned":
+                # 摘要更新时不改动系统提示词，前缀至少在系统提示词与工具定义处保持稳定
+                summary_messages = [{"role": "system", "content": summary_block}]
+            else:
+                system_prompt = f"{system_prompt}\n\n{summary_block}"
+
+        window = _select_window(buffer, token_counts, budget, first_seq + skip)
+        dropped = len(buffer) - len(window)
+        if (
+            settings.SUMMARY_ENABLED
+            and dropped
+            and sum(token_counts[:dropped]) >= settings.SUMMARY_TRIGGER_TOKENS
+        ):
+            self.summarizer.schedule(session_id, first_seq + skip + dropped - 1)
+        return system_prompt, summary_messages + window
 
-    # ... update_history 函数保持不变 ...
     async def update_history(
-        self, session_id: str, new_messages: List[Dict[str, Any]], db: AsyncSession
+        self,
+        session_id: str,
+        new_messages: List[Dict[str, Any]],
+        db: AsyncSession,
+        system_prompt: Optional[str] = None,
+        usage: Optional[Dict[str, int]] = None,
     ):
         """
-        向数据库中为指定 session_id 写入新的消息。
+        为指定 session_id 写入新的消息。
+        - 同步模式: 在一个事务里 upsert 会话并插入消息，只提交一次。
+        - write-behind 模式: 交给后台写入器，与其他请求的消息合并批量提交。
+        两种模式下都在消息落库后，按数据库分配的序号把新消息追加到热缓存中。
+        传入本轮的 token 用量 (usage) 时，它会在同一个事务里累加到会话的用量汇总。
         """
         if not session_id or not new_messages:
             return
 
-        logger.info(
-            "正在为会话 '%s' 向数据库写入 %d 条新消息...", session_id, len(new_messages)
+        # token 数只在写入时计算一次，随消息一起落库并进入缓存
+        token_counts = [count_message_tokens(msg) for msg in new_messages]
+        turn = PendingTurn(
+            session_id,
+            list(new_messages),
+            system_prompt,
+            token_counts,
+            dict(usage) if usage is not None else None,
+        )
+        # write-behind 模式下由后台写入器在提交后更新缓存（见 _flush_turns）
+        if self.history_writer.running:
+            await self.history_writer.submit(turn)
+            logger.info(
+                "已将会话 '%s' 的 %d 条新消息加入后台写入队列。",
+                session_id,
+                len(new_messages),
+            )
+        else:
+            logger.info(
+                "正在为会话 '%s' 向数据库写入 %d 条新消息...",
+                session_id,
+                len(new_messages),
+            )
+            last_seqs = await self._persist_turns([turn], db)
+            await self._append_cached([turn], last_seqs)
+            logger.info(
+                "成功为会话 '%s' 写入了 %d 条新消息。", session_id, len(new_messages)
+            )
+
+    async def _append_cached(
+        self, turns: List[PendingTurn], last_seqs: Dict[str, int]
+    ) -> None:
+        """
+        把已经落库的对话追加到各会话的热缓存条目。
+        last_seqs 是数据库为每个会话分配的最新序号（_persist_turns 的返回值）。
+        缓存的 last_seq 正好衔接这批消息时才追加；否则说明期间有其他请求或进程
+        写入过同一会话（共享后端上的读-改-写不是原子的），直接让条目失效，
+        下一轮从数据库重新读取。
+        """
+        per_session: Dict[str, List[PendingTurn]] = {}
+        for turn in turns:
+            per_session.setdefault(turn.session_id, []).append(turn)
+
+        for session_id, session_turns in per_session.items():
+            entry = await self._get_cached(session_id)
+            if not entry or entry["messages"] is None:
+                continue
+            new_messages, token_counts, system_prompt = [], [], None
+            for turn in session_turns:
+                new_messages.extend(turn.messages)
+                token_counts.extend(
+                    turn.token_counts
+                    if turn.token_counts is not None
+                    else [count_message_tokens(msg) for msg in turn.messages]
+                )
+                system_prompt = turn.system_prompt or system_prompt
+
+            last_seq = last_seqs[session_id]
+            if entry.get("last_seq") != last_seq - len(new_messages):
+                logger.info(
+                    "会话 '%s' 的缓存序号 (%s) 与数据库 (%d) 不衔接，缓存失效。",
+                    session_id,
+                    entry.get("last_seq"),
+                    last_seq - len(new_messages),
+                )
+                await self._state.delete(f"session:{session_id}")
+                continue
+
+            cached_counts = entry.get("token_counts")
+            if cached_counts is None or len(cached_counts) != len(entry["messages"]):
+                cached_counts = [count_message_tokens(m) for m in entry["messages"]]
+            limit = settings.HISTORY_FETCH_LIMIT
+            await self._update_cached(
+                session_id,
+                entry=entry,
+                system_prompt=system_prompt or entry["system_prompt"],
+                messages=(entry["messages"] + new_messages)[-limit:],
+                token_counts=(cached_counts + token_counts)[-limit:],
+                last_seq=last_seq,
+            )
+
+    async def _persist_turns(
+        self, turns: List[PendingTurn], db: AsyncSession
+    ) -> Dict[str, int]:
+        """
+        在一个事务里写入一批对话，只提交一次:
+        1. 一条多行 upsert 创建/更新涉及的所有会话，并为新消息预留序号；
+        2. 一条多行 INSERT 写入所有消息；
+        3. 带有用量的对话再用一条多行 upsert 累加到用量汇总表。
+        返回每个会话写入后的 last_seq。
+        """
+        # 同一条 upsert 语句不能两次更新同一行，先按会话合并
+        per_session: Dict[str, Dict[str, Any]] = {}
+        usage_per_session: Dict[str, Dict[str, int]] = {}
+        for turn in turns:
+            if turn.usage is not None:
+                accumulate_usage(
+                    usage_per_session.setdefault(turn.session_id, {}), turn.usage
+                )
+            merged = per_session.setdefault(
+                turn.session_id,
+                {"messages": [], "token_counts": [], "system_prompt": None},
+            )
+            merged["messages"].extend(turn.messages)
+            merged["token_counts"].extend(
+                turn.token_counts
+                if turn.token_counts is not None
+                else [count_message_tokens(msg) for msg in turn.messages]
+            )
+            if turn.system_prompt:
+                merged["system_prompt"] = turn.system_prompt
+
+        # system_prompt 为 NULL 表示使用默认提示词，因此只有显式传入时才覆盖已有值。
+        # last_seq 加上本次的消息数并返回新值，即为这批消息预留的序号区间；
+        # 会话行上的锁保证并发写入不会分到重复的序号，按 session_id 排序避免死锁。
+        upsert_sessions = pg_insert(ChatSession).values(
+            [
+                {
+                    "session_id": sid,
+                    "system_prompt": merged["system_prompt"],
+                    "last_seq": len(merged["messages"]),
+                }
+                for sid, merged in sorted(per_session.items())
+            ]
         )
+        upsert_sessions = upsert_sessions.on_conflict_do_update(
+            index_elements=[ChatSession.session_id],
+            set_={
+                "system_prompt": func.coalesce(
+                    upsert_sessions.excluded.system_prompt, ChatSession.system_prompt
+                ),
+                "last_seq": ChatSession.last_seq + upsert_sessions.excluded.last_seq,
+                "updated_at": func.now(),
+            },
+        ).returning(ChatSession.session_id, ChatSession.last_seq)
+        result = await db.execute(upsert_sessions)
+        last_seqs = dict(result.all())
 
         db_messages = []
-        for msg in new_messages:
-            content_str = json.dumps(msg, ensure_ascii=False)
-            role = msg.get("role", "unknown")
-            db_messages.append(
-                ChatMessage(session_id=session_id, role=role, content=content_str)
+        for sid, merged in per_session.items():
+            first_seq = last_seqs[sid] - len(merged["messages"]) + 1
+            db_messages.extend(
+                ChatMessage(
+                    session_id=sid,
+                    seq=first_seq + offset,
+                    role=msg.get("role", "unknown"),
+                    content=msg,
+                    token_count=token_count,
+                )
+                for offset, (msg, token_count) in enumerate(
+                    zip(merged["messages"], merged["token_counts"])
+                )
             )
 
         db.add_all(db_messages)
+        if usage_per_session:
+            await record_usage(db, usage_per_session)
         await db.commit()
-        logger.info(
-            "成功为会话 '%s' 写入了 %d 条新消息。", session_id, len(db_messages)
+        return last_seqs
+
+    async def _flush_turns(self, turns: List[PendingTurn]):
+        """后台写入器的刷新函数：使用独立的数据库会话提交一批对话。"""
+        async with AsyncSessionLocal() as db:
+            if not settings.HISTORY_WRITER_SYNCHRONOUS_COMMIT:
+                await db.execute(text("SET LOCAL synchronous_commit = off"))
+            last_seqs = await self._persist_turns(turns, db)
+        # 批次已经提交，缓存更新失败不能让写入器重试（会重复插入），只记录错误
+        try:
+            await self._append_cached(turns, last_seqs)
+        except Exception:
+            logger.exception("批量写入后更新会话缓存失败。")
+
+    async def _invalidate_cached(self, turns: List[PendingTurn]):
+        """后台写入最终失败时，让涉及的会话缓存失效，下一轮从数据库重新读取。"""
+        session_ids = {turn.session_id for turn in turns}
+        for session_id in session_ids:
+            await self._state.delete(f"session:{session_id}")
+        logger.warning(
+            "已使 %d 个会话的缓存失效（其消息未能写入数据库）。", len(session_ids)
         )
 
+    async def _refresh_summary(self, session_id: str, upto_seq: int):
+        """
+        后台摘要任务：把会话中序号不超过 upto_seq、尚未摘要的消息与已有摘要合并成新摘要。
+        调用大模型期间不占用数据库连接；保存时以 summary_seq 做乐观并发控制，
+        其他 worker 已经更新过摘要时放弃本次结果。
+        """
+        if self.history_writer.has_pending(session_id):
+            await self.history_writer.wait_for_session(session_id)
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(ChatSession.summary, ChatSession.summary_seq).where(
+                    ChatSession.session_id == session_id
+                )
+            )
+            session = result.one_or_none()
+            if session is None or session.summary_seq >= upto_seq:
+                return
+            # 积压过多时只摘要最近的一段，更早的消息此前已经被窗口截断
+            start_seq = max(
+                session.summary_seq, upto_seq - settings.HISTORY_FETCH_LIMIT
+            )
+            result = await db.execute(
+                select(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+                .where(
+                    ChatMessage.session_id == session_id,
+                    ChatMessage.seq > start_seq,
+                    ChatMessage.seq <= upto_seq,
+                )
+                .order_by(ChatMessage.seq)
+            )
+            messages = [
+                _parse_content(row.id, row.role, row.content) for row in result.all()
+            ]
+
+        # 摘要调用的用量同样计入会话汇总，但不算作一次聊天请求
+        usage = new_llm_usage()
+        llm_usage_var.set(usage)
+        summary = await llm_service.get_conversation_summary(session.summary, messages)
+
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(ChatSession)
+                .where(
+                    ChatSession.session_id == session_id,
+                    ChatSession.summary_seq == session.summary_seq,
+                )
+                .values(summary=summary, summary_seq=upto_seq)
+            )
+            await record_usage(
+                db, {session_id: accumulate_usage({}, usage, requests=0)}
+            )
+            await db.commit()
+        if result.rowcount == 0:
+            logger.info("会话 '%s' 的摘要已被其他任务更新，放弃本次结果。", session_id)
+            return
+
+        entry = await self._get_cached(session_id)
+        if entry and entry.get("summary_seq", 0) < upto_seq:
+            await self._update_cached(
+                session_id, entry=entry, summary=summary, summary_seq=upto_seq
+            )
+        logger.info("会话 '%s' 的摘要已更新，覆盖到序号 %d。", session_id, upto_seq)
+
 
 # 创建一个全局单例
 session_service = SessionService()
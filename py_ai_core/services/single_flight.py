@@ -0,0 +1,78 @@
+# --- START OF FILE py_ai_core/services/single_flight.py ---
+
+"""
+相同请求的合并 (single-flight)。
+
+同一时刻多个请求以相同的键调用 do() 时，只有第一个（leader）真正执行，
+其余调用等待并共享它的结果或异常。
+
+取消语义:
+- 共享的调用运行在独立的任务里，单个等待方被取消（例如客户端断开）只会让它自己退出，
+  不影响其他仍在等待的调用方；
+- 所有等待方都取消之后，共享的调用才会被取消，避免为没人要的结果继续消耗上游资源。
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """以 key 合并并发调用，返回 fn() 的结果。"""
+        flight = self._flights.get(key)
+        if flight is None:
+            # 任务复制了 leader 的上下文，需要按请求记录的信息（例如用量）应由各调用方在返回后自行记录
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            logger.info("相同的请求正在进行中，合并等待其结果。")
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        # 所有等待方都已取消时，没有人会读取任务的异常，这里读取一次避免 asyncio 告警
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / total if total else 0.0,
+        }
+
+
+# --- END OF FILE py_ai_core/services/single_flight.py ---
@@ -0,0 +1,61 @@
+# --- START OF FILE py_ai_core/services/summarizer.py ---
+
+"""
+会话摘要的后台调度器。
+
+历史窗口装不下的较早消息会被压缩进每个会话保存的滚动摘要里。
+生成摘要需要一次额外的大模型调用，因此不在请求路径上执行:
+请求只负责发现窗口溢出并提交任务，由这里在后台运行，同一会话同时最多只有一个摘要任务。
+"""
+
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+from py_ai_core.core.context import llm_usage_var
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundSummarizer:
+    def __init__(self, refresh: Callable[[str, int], Awaitable[None]]):
+        """
+        :param refresh: 把会话中序号不超过 upto_seq 的消息合并进摘要并保存的协程函数。
+        """
+        self._refresh = refresh
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def schedule(self, session_id: str, upto_seq: int) -> bool:
+        """
+        为会话提交一个摘要任务。该会话已有任务在运行时直接忽略，下一轮请求会再次检查。
+        :return: 是否真正提交了新任务。
+        """
+        if session_id in self._tasks:
+            return False
+        task = asyncio.create_task(self._run(session_id, upto_seq))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+        logger.info(
+            "已为会话 '%s' 提交后台摘要任务 (覆盖到序号 %d)。", session_id, upto_seq
+        )
+        return True
+
+    async def _run(self, session_id: str, upto_seq: int) -> None:
+        # 任务复制了发起请求的上下文，摘要调用的用量不应计入该请求
+        llm_usage_var.set(None)
+        try:
+            await self._refresh(session_id, upto_seq)
+        except Exception:
+            logger.exception("为会话 '%s' 生成摘要失败。", session_id)
+
+    async def stop(self) -> None:
+        """取消所有尚未完成的摘要任务，在应用关闭时调用。"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tasks:
+            logger.info("已取消 %d 个未完成的后台摘要任务。", len(tasks))
+
+
+# --- END OF FILE py_ai_core/services/summarizer.py ---
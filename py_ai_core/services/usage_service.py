@@ -0,0 +1,144 @@
+# --- START OF FILE py_ai_core/services/usage_service.py ---
+
+"""
+大模型 token 用量的持久化汇总。
+
+每次上游调用的用量先在请求内累加（见 core/context.py 的 llm_usage_var），
+写入历史时再按 (会话, 时间桶) 累加到 llm_usage_rollups 表:
+- 与新消息在同一个事务里写入，不额外增加提交次数；
+- 每个会话每个时间桶只有一行，表的大小与活跃会话数、时间跨度成正比，而不是与请求数成正比。
+"""
+
+import datetime
+import logging
+from typing import Any, Dict, Optional
+
+from sqlalchemy import BigInteger, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from py_ai_core.core.config import settings
+from py_ai_core.models.db_models import LLMUsageRollup
+
+logger = logging.getLogger(__name__)
+
+# 支持的时间粒度，同时用作 date_trunc 的第一个参数
+GRANULARITIES = ("minute", "hour", "day")
+
+# 汇总表中累加的计数列
+USAGE_FIELDS = (
+    "requests",
+    "llm_calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+)
+
+
+def accumulate_usage(
+    target: Dict[str, int], usage: Optional[Dict[str, int]], requests: int = 1
+) -> Dict[str, int]:
+    """把一份请求用量累加到 target 中，requests 为这份用量对应的聊天请求数。"""
+    for field in USAGE_FIELDS:
+        target.setdefault(field, 0)
+    target["requests"] += requests
+    for field in USAGE_FIELDS[1:]:
+        target[field] += (usage or {}).get(field, 0)
+    return target
+
+
+async def record_usage(db: AsyncSession, per_session: Dict[str, Dict[str, int]]):
+    """
+    在调用方的事务里把各会话的用量累加到当前时间桶，不提交。
+    多个会话合并为一条多行 upsert，按 session_id 排序避免并发事务之间死锁。
+    """
+    if not settings.USAGE_ACCOUNTING_ENABLED:
+        return
+    rows = [
+        {
+            "session_id": session_id,
+            "bucket_start": func.date_trunc(settings.USAGE_ROLLUP_BUCKET, func.now()),
+            **{field: usage.get(field, 0) for field in USAGE_FIELDS},
+        }
+        for session_id, usage in sorted(per_session.items())
+        if any(usage.get(field) for field in USAGE_FIELDS)
+    ]
+    if not rows:
+        return
+    stmt = pg_insert(LLMUsageRollup).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LLMUsageRollup.session_id, LLMUsageRollup.bucket_start],
+        set_={
+            field: getattr(LLMUsageRollup, field) + getattr(stmt.excluded, field)
+            for field in USAGE_FIELDS
+        },
+    )
+    await db.execute(stmt)
+
+
+def cached_token_ratio(usage: Dict[str, int]) -> float:
+    """prompt token 中命中上游提示词缓存的比例，衡量提示词前缀的稳定程度。"""
+    prompt_tokens = usage.get("prompt_tokens", 0)
+    return usage.get("cached_tokens", 0) / prompt_tokens if prompt_tokens else 0.0
+
+
+def _totals(row) -> Dict[str, Any]:
+    totals = {field: int(getattr(row, field) or 0) for field in USAGE_FIELDS}
+    totals["cached_token_ratio"] = cached_token_ratio(totals)
+    return totals
+
+
+async def usage_report(
+    db: AsyncSession,
+    since: datetime.datetime,
+    granularity: str = "hour",
+    session_id: Optional[str] = None,
+    top_sessions: int = 20,
+) -> Dict[str, Any]:
+    """
+    汇总 since 之后的用量:
+    - buckets: 按 granularity 重新分桶的时间序列；
+    - sessions: 用量最多的 top_sessions 个会话（指定 session_id 时只有该会话）。
+    每一项都带有 cached_token_ratio。
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"不支持的时间粒度: {granularity}")
+    sums = [
+        cast(
+            func.coalesce(func.sum(getattr(LLMUsageRollup, field)), 0), BigInteger
+        ).label(field)
+        for field in USAGE_FIELDS
+    ]
+    conditions = [LLMUsageRollup.bucket_start >= since]
+    if session_id:
+        conditions.append(LLMUsageRollup.session_id == session_id)
+
+    # 粒度以字面量写入 SQL，SELECT 与 GROUP BY 中的表达式才会被识别为同一个
+    bucket = func.date_trunc(
+        literal_column(f"'{granularity}'"), LLMUsageRollup.bucket_start
+    ).label("bucket_start")
+    result = await db.execute(
+        select(bucket, *sums).where(*conditions).group_by(bucket).order_by(bucket)
+    )
+    buckets = [
+        {"bucket_start": row.bucket_start, **_totals(row)} for row in result.all()
+    ]
+
+    token_total = func.sum(
+        LLMUsageRollup.prompt_tokens + LLMUsageRollup.completion_tokens
+    )
+    result = await db.execute(
+        select(LLMUsageRollup.session_id, *sums)
+        .where(*conditions)
+        .group_by(LLMUsageRollup.session_id)
+        .order_by(token_total.desc())
+        .limit(top_sessions)
+    )
+    sessions = [{"session_id": row.session_id, **_totals(row)} for row in result.all()]
+
+    totals = {field: sum(b[field] for b in buckets) for field in USAGE_FIELDS}
+    totals["cached_token_ratio"] = cached_token_ratio(totals)
+    return {"totals": totals, "buckets": buckets, "sessions": sessions}
+
+
+# --- END OF FILE py_ai_core/services/usage_service.py ---
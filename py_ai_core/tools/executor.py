@@ -0,0 +1,132 @@
+# --- START OF FILE py_ai_core/tools/executor.py ---
+
+"""
+按 @tool 声明的选项执行工具（见 registry.ToolOptions）:
+- timeout: 单次调用（含等待该工具的并发名额）的时间上限，超时的调用被取消；
+- max_concurrency: 每个工具独立的并发上限，慢工具不会占满全局的工具并发；
+- pure / cache_ttl: 结果按规范化后的参数缓存在共享状态后端里，相同的调用直接返回缓存；
+  工具返回 ToolErrorResult 表示出错，这样的结果不缓存；
+- pure / idempotent: 相同参数的并发调用合并为一次执行；
+- cpu_bound / untrusted: 在沙箱进程池中执行（见 tools/sandbox.py）。
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from pydantic_core import to_jsonable_python
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.state_backend import StateBackend, state_backend
+from py_ai_core.services.single_flight import SingleFlight
+from py_ai_core.tools.registry import ToolErrorResult, ToolOptions, tool_registry
+from py_ai_core.tools.sandbox import tool_sandbox
+
+logger = logging.getLogger(__name__)
+
+
+class ToolTimeoutError(Exception):
+    """工具调用超过了声明的（或默认的）时间上限。"""
+
+    def __init__(self, name: str, timeout: float):
+        super().__init__(f"工具 '{name}' 超过了 {timeout} 秒的时间上限。")
+        self.timeout = timeout
+
+
+def canonical_arguments(args: Dict[str, Any]) -> str:
+    """参数的规范化序列化（键排序、无多余空白），参数顺序不同的相同调用得到相同的键。"""
+    return json.dumps(
+        args,
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=to_jsonable_python,  # 校验后的参数里可能有 pydantic 模型
+    )
+
+
+class ToolExecutor:
+    def __init__(self, state: Optional[StateBackend] = None):
+        self.state = state or state_backend
+        self.single_flight = SingleFlight()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats = {"executions": 0, "cache_hits": 0, "timeouts": 0}
+
+    async def run(self, name: str, func: Callable, args: Dict[str, Any]) -> str:
+        """执行工具并返回字符串形式的结果。超时抛出 ToolTimeoutError，其它异常原样抛出。"""
+        options = tool_registry.get_options(name)
+        key = (
+            f"tool:{name}:"
+            + hashlib.sha256(canonical_arguments(args).encode("utf-8")).hexdigest()
+        )
+        ttl = self._cache_ttl(options)
+        if ttl:
+            cached = await self.state.get(key)
+            if cached is not None:
+                self._stats["cache_hits"] += 1
+                logger.info("工具 '%s' 命中结果缓存。", name)
+                return cached
+
+        async def execute() -> str:
+            result = await self._execute(name, func, args, options)
+            if ttl and not isinstance(result, ToolErrorResult):
+                await self.state.set(key, str(result), ttl=ttl)
+            return str(result)
+
+        if options.pure or options.idempotent:
+            return await self.single_flight.do(key, execute)
+        return await execute()
+
+    @staticmethod
+    def _cache_ttl(options: ToolOptions) -> float:
+        if options.cache_ttl is not None:
+            return options.cache_ttl
+        return settings.TOOL_PURE_CACHE_TTL_SECONDS if options.pure else 0
+
+    async def _execute(
+        self, name: str, func: Callable, args: Dict[str, Any], options: ToolOptions
+    ) -> Any:
+        timeout = (
+            options.timeout
+            if options.timeout is not None
+            else settings.TOOL_DEFAULT_TIMEOUT_SECONDS
+        )
+        self._stats["executions"] += 1
+        try:
+            return await asyncio.wait_for(
+                self._call(name, func, args, options), timeout or None
+            )
+        except asyncio.TimeoutError:
+            self._stats["timeouts"] += 1
+            raise ToolTimeoutError(name, timeout)
+
+    async def _call(
+        self, name: str, func: Callable, args: Dict[str, Any], options: ToolOptions
+    ) -> Any:
+        slot = contextlib.nullcontext()
+        if options.max_concurrency:
+            if name not in self._semaphores:
+                self._semaphores[name] = asyncio.Semaphore(options.max_concurrency)
+            slot = self._semaphores[name]
+        async with slot:
+            if settings.TOOL_SANDBOX_ENABLED and options.sandboxed:
+                # 计算密集或不可信的工具在沙箱进程中执行，事件循环只等待结果
+                return await tool_sandbox.run(func, args)
+            return await func(**args)
+
+    def get_stats(self) -> Dict[str, Any]:
+        flights = self.single_flight.stats()
+        return {
+            **self._stats,
+            "coalesced": flights["coalesced"],
+            "in_flight": flights["in_flight"],
+            "sandbox": tool_sandbox.get_stats(),
+        }
+
+
+# 创建一个全局单例
+tool_executor = ToolExecutor()
+
+# --- END OF FILE py_ai_core/tools/executor.py ---
@@ -0,0 +1,299 @@
+# --- START OF FILE py_ai_core/tools/expression.py ---
+
+"""
+calculate 工具使用的安全表达式引擎。
+
+表达式用 ast 解析，只允许白名单中的语法节点（数字、变量、四则运算、乘方、取模、
+白名单函数调用），然后编译成一组嵌套的闭包:
+- 编译结果按表达式字符串缓存，重复的计算不再重新解析；
+- 不经过 eval，也就不存在属性访问、下标、lambda 等逃逸路径；
+- 乘方在计算之前检查指数大小与结果位数，每一步的结果都检查数量级，
+  "9**9**9" 这类表达式直接报错，而不是占满 CPU 与内存。
+
+向量模式 (evaluate_many) 对同一个表达式代入多组变量取值，一次调用算出全部结果:
+安装了 numpy 时整组数据按数组运算，否则逐行用标量闭包计算。
+"""
+
+import ast
+import math
+import operator
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Mapping, Sequence
+
+from py_ai_core.core.config import settings
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是可选依赖，没有安装时向量模式逐行计算
+    np = None
+
+# 一个安全的数学函数和常量的白名单
+SAFE_MATH_FUNCTIONS: Dict[str, Callable] = {
+    "abs": abs,
+    "acos": math.acos,
+    "asin": math.asin,
+    "atan": math.atan,
+    "atan2": math.atan2,
+    "ceil": math.ceil,
+    "cos": math.cos,
+    "cosh": math.cosh,
+    "degrees": math.degrees,
+    "exp": math.exp,
+    "fabs": math.fabs,
+    "floor": math.floor,
+    "fmod": math.fmod,
+    "frexp": math.frexp,
+    "hypot": math.hypot,
+    "ldexp": math.ldexp,
+    "log": math.log,
+    "log10": math.log10,
+    "modf": math.modf,
+    "pow": math.pow,
+    "radians": math.radians,
+    "sin": math.sin,
+    "sinh": math.sinh,
+    "sqrt": math.sqrt,
+    "tan": math.tan,
+    "tanh": math.tanh,
+}
+
+SAFE_MATH_CONSTANTS: Dict[str, float] = {"pi": math.pi, "e": math.e}
+
+# 向量模式下对应的 numpy 函数；不在表中的函数（例如 frexp）不能用于向量模式
+_NUMPY_FUNCTION_NAMES = {
+    "abs": "abs",
+    "acos": "arccos",
+    "asin": "arcsin",
+    "atan": "arctan",
+    "atan2": "arctan2",
+    "ceil": "ceil",
+    "cos": "cos",
+    "cosh": "cosh",
+    "degrees": "degrees",
+    "exp": "exp",
+    "fabs": "fabs",
+    "floor": "floor",
+    "fmod": "fmod",
+    "hypot": "hypot",
+    "log": "log",
+    "log10": "log10",
+    "pow": "power",
+    "radians": "radians",
+    "sin": "sin",
+    "sinh": "sinh",
+    "sqrt": "sqrt",
+    "tan": "tan",
+    "tanh": "tanh",
+}
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+}
+
+_UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+
+class ExpressionError(ValueError):
+    """表达式不合法，或计算超出了允许的范围。"""
+
+
+Env = Mapping[str, Any]
+
+
+# ===================================================================
+# 数量级检查
+# ===================================================================
+
+
+def _check_scalar(value: Any) -> Any:
+    """检查单个结果的数量级: 整数限制位数，浮点数不能溢出为无穷大。"""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        if value.bit_length() > settings.CALC_MAX_RESULT_BITS:
+            raise ExpressionError(
+                f"计算结果超过了 {settings.CALC_MAX_RESULT_BITS} 位二进制的上限。"
+            )
+    elif isinstance(value, float) and math.isinf(value):
+        raise ExpressionError("计算结果超出了浮点数的表示范围。")
+    elif isinstance(value, complex):
+        raise ExpressionError("计算结果不是实数。")
+    return value
+
+
+def _check_array(value: Any) -> Any:
+    if not np.all(np.isfinite(value)):
+        raise ExpressionError("计算结果超出了浮点数的表示范围。")
+    return value
+
+
+def _safe_pow(base: Any, exponent: Any) -> Any:
+    """乘方前先检查指数大小，整数乘方再估算结果位数，超出上限时不做计算。"""
+    if abs(exponent) > settings.CALC_MAX_EXPONENT:
+        raise ExpressionError(f"指数超过了 {settings.CALC_MAX_EXPONENT} 的上限。")
+    if isinstance(base, int) and isinstance(exponent, int) and exponent > 0:
+        # 结果至少有 (bit_length - 1) * exponent 位，超出时不必计算
+        if (base.bit_length() - 1) * exponent > settings.CALC_MAX_RESULT_BITS:
+            raise ExpressionError(
+                f"计算结果超过了 {settings.CALC_MAX_RESULT_BITS} 位二进制的上限。"
+            )
+    try:
+        return base**exponent
+    except OverflowError:
+        raise ExpressionError("计算结果超出了浮点数的表示范围。")
+
+
+def _safe_array_pow(base: Any, exponent: Any) -> Any:
+    if np.any(np.abs(exponent) > settings.CALC_MAX_EXPONENT):
+        raise ExpressionError(f"指数超过了 {settings.CALC_MAX_EXPONENT} 的上限。")
+    return np.power(base, exponent)
+
+
+# ===================================================================
+# 编译
+# ===================================================================
+
+
+class _Compiler:
+    """把白名单内的 ast 节点编译成 env -> 值 的闭包。"""
+
+    def __init__(self, vectorized: bool):
+        self.vectorized = vectorized
+        self.check = _check_array if vectorized else _check_scalar
+        self.pow = _safe_array_pow if vectorized else _safe_pow
+
+    def compile(self, node: ast.AST) -> Callable[[Env], Any]:
+        handler = getattr(self, f"_compile_{type(node).__name__}", None)
+        if handler is None:
+            raise ExpressionError(f"不支持的语法: {type(node).__name__}")
+        return handler(node)
+
+    def _compile_Expression(self, node: ast.Expression):
+        return self.compile(node.body)
+
+    def _compile_Constant(self, node: ast.Constant):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ExpressionError(f"不支持的常量: {value!r}")
+        _check_scalar(value)
+        return lambda env: value
+
+    def _compile_Name(self, node: ast.Name):
+        name = node.id
+        if name in SAFE_MATH_CONSTANTS:
+            value = SAFE_MATH_CONSTANTS[name]
+            return lambda env: value
+        if name in SAFE_MATH_FUNCTIONS:
+            raise ExpressionError(f"函数 '{name}' 只能被调用。")
+
+        def load(env: Env):
+            try:
+                return env[name]
+            except KeyError:
+                raise ExpressionError(f"未定义的变量: {name}")
+
+        return load
+
+    def _compile_UnaryOp(self, node: ast.UnaryOp):
+        op = _UNARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise ExpressionError(f"不支持的运算符: {type(node.op).__name__}")
+        operand = self.compile(node.operand)
+        return lambda env: op(operand(env))
+
+    def _compile_BinOp(self, node: ast.BinOp):
+        left, right = self.compile(node.left), self.compile(node.right)
+        if isinstance(node.op, ast.Pow):
+            pow_, check = self.pow, self.check
+            return lambda env: check(pow_(left(env), right(env)))
+        op = _BINARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise ExpressionError(f"不支持的运算符: {type(node.op).__name__}")
+        check = self.check
+        return lambda env: check(op(left(env), right(env)))
+
+    def _compile_Call(self, node: ast.Call):
+        if not isinstance(node.func, ast.Name) or node.keywords:
+            raise ExpressionError("只能以位置参数调用白名单中的函数。")
+        name = node.func.id
+        if name not in SAFE_MATH_FUNCTIONS:
+            raise ExpressionError(f"不允许调用函数: {name}")
+        args = [self.compile(arg) for arg in node.args]
+        check = self.check
+        if name == "pow":
+            pow_ = self.pow
+            if len(args) != 2:
+                raise ExpressionError("pow 需要两个参数。")
+            base, exponent = args
+            return lambda env: check(pow_(base(env) * 1.0, exponent(env)))
+        if self.vectorized:
+            if name not in _NUMPY_FUNCTION_NAMES:
+                raise ExpressionError(f"函数 '{name}' 不支持向量计算。")
+            func = getattr(np, _NUMPY_FUNCTION_NAMES[name])
+        else:
+            func = SAFE_MATH_FUNCTIONS[name]
+        return lambda env: check(func(*[arg(env) for arg in args]))
+
+
+@lru_cache(maxsize=settings.CALC_CACHE_SIZE)
+def compile_expression(
+    expression: str, vectorized: bool = False
+) -> Callable[[Env], Any]:
+    """
+    解析并编译表达式，返回接收变量字典的闭包。结果按 (表达式, 模式) 缓存。
+    表达式不合法时抛出 ExpressionError。
+    """
+    if len(expression) > settings.CALC_MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(
+            f"表达式长度超过了 {settings.CALC_MAX_EXPRESSION_LENGTH} 个字符的上限。"
+        )
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"表达式语法错误: {e.msg}")
+    return _Compiler(vectorized).compile(tree)
+
+
+def evaluate(expression: str, variables: Env | None = None) -> Any:
+    """计算单个表达式。"""
+    return compile_expression(expression)(variables or {})
+
+
+def evaluate_many(
+    expression: str, bindings: Mapping[str, Sequence[float]]
+) -> List[Any]:
+    """
+    向量模式: bindings 中每个变量对应一列取值（长度必须相同，标量会广播到每一行），
+    返回每一行的计算结果。
+    """
+    columns = {k: v for k, v in bindings.items() if isinstance(v, (list, tuple))}
+    lengths = {len(v) for v in columns.values()}
+    if len(lengths) > 1:
+        raise ExpressionError("各变量的取值个数必须相同。")
+    rows = lengths.pop() if lengths else 1
+    if rows > settings.CALC_MAX_VECTOR_ROWS:
+        raise ExpressionError(
+            f"取值个数超过了 {settings.CALC_MAX_VECTOR_ROWS} 的上限。"
+        )
+
+    if np is not None:
+        env = {k: np.asarray(v, dtype=float) for k, v in bindings.items()}
+        func = compile_expression(expression, vectorized=True)
+        # 溢出与除零产生的 inf/nan 由 _check_array 统一报错，不需要 numpy 的警告
+        with np.errstate(all="ignore"):
+            result = func(env)
+        return np.broadcast_to(result, (rows,)).tolist()
+
+    func = compile_expression(expression)
+    return [
+        func({k: v[i] if k in columns else v for k, v in bindings.items()})
+        for i in range(rows)
+    ]
+
+
+# --- END OF FILE py_ai_core/tools/expression.py ---
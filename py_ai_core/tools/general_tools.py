@@ -2,16 +2,19 @@
 
 # 1. 导入 logging 和 tool 装饰器
 import logging
-from .registry import tool
+from .registry import ToolErrorResult, tool
 from datetime import datetime
+from typing import Literal
 
 # 2. 获取模块级 logger 实例
 #    __name__ 在这里会是 'py_ai_core.tools.general_tools'
 logger = logging.getLogger(__name__)
 
 
-@tool
-async def get_current_weather(city: str, unit: str = "celsius") -> str:
+@tool(idempotent=True, cache_ttl=600, timeout=10, max_concurrency=4)
+async def get_current_weather(
+    city: str, unit: Literal["celsius", "fahrenheit"] = "celsius"
+) -> str:
     """获取指定城市的当前天气信息。
 
     这是工具的详细描述，可以有多行。
@@ -36,7 +39,7 @@ async def get_current_weather(city: str, unit: str = "celsius") -> str:
     except Exception as e:
         logger.exception("执行工具 [get_current_weather] 时发生未知错误。")
         # 向上抛出异常或返回一个错误信息
-        return f"获取 {city} 天气时发生错误: {e}"
+        return ToolErrorResult(f"获取 {city} 天气时发生错误: {e}")
 
 
 @tool
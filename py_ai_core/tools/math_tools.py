@@ -1,68 +1,53 @@
 # py_ai_core/tools/math_tools.py
 
 import logging
-import math
-from .registry import tool
+from typing import Dict, List, Optional, Union
 
-logger = logging.getLogger(__name__)
+from .expression import ExpressionError, evaluate, evaluate_many
+from .registry import ToolErrorResult, tool
 
-# 一个安全的数学函数和常量的白名单
-SAFE_MATH_OPS = {
-    "abs": abs,
-    "acos": math.acos,
-    "asin": math.asin,
-    "atan": math.atan,
-    "atan2": math.atan2,
-    "ceil": math.ceil,
-    "cos": math.cos,
-    "cosh": math.cosh,
-    "degrees": math.degrees,
-    "exp": math.exp,
-    "fabs": math.fabs,
-    "floor": math.floor,
-    "fmod": math.fmod,
-    "frexp": math.frexp,
-    "hypot": math.hypot,
-    "ldexp": math.ldexp,
-    "log": math.log,
-    "log10": math.log10,
-    "modf": math.modf,
-    "pow": math.pow,
-    "radians": math.radians,
-    "sin": math.sin,
-    "sinh": math.sinh,
-    "sqrt": math.sqrt,
-    "tan": math.tan,
-    "tanh": math.tanh,
-    "pi": math.pi,
-    "e": math.e,
-}
+logger = logging.getLogger(__name__)
 
 
-@tool
-async def calculate(expression: str) -> str:
+@tool(pure=True, cpu_bound=True, untrusted=True, timeout=10)
+async def calculate(
+    expression: str,
+    variables: Optional[Dict[str, Union[int, float, List[Union[int, float]]]]] = None,
+) -> str:
     """
     一个安全的计算器，用于执行数学表达式。
     你可以用它来做加减乘除、乘方、开方等运算。
     例如: "10 * (3 + 5) / 2", "pow(2, 10)", "sqrt(144)".
+    表达式中可以使用变量，并一次代入多组取值，例如 expression="x * 1.08 + y",
+    variables={"x": [100, 200, 300], "y": 5} 返回三个结果组成的列表。
 
     :param expression: 一个字符串形式的数学表达式。
+    :param variables: 可选，变量名到取值的映射，取值为数字或等长的数字列表。
     :return: 计算结果的字符串，或在出错时返回错误信息。
     """
     logger.info("正在执行工具 [calculate]，表达式: '%s'", expression)
 
     try:
-        # 使用一个安全的 eval 环境，只允许白名单中的数学运算
-        # 这是比直接使用 eval() 更安全的做法
-        result = eval(expression, {"__builtins__": None}, SAFE_MATH_OPS)
+        # 表达式由 tools/expression.py 解析并编译，只允许白名单中的语法与函数，
+        # 编译结果按表达式缓存，乘方与结果大小都有上限
+        bindings = variables or {}
+        if any(isinstance(v, list) for v in bindings.values()):
+            result = evaluate_many(expression, bindings)
+        else:
+            result = evaluate(expression, bindings)
 
         # 将结果转换为字符串返回
         result_str = str(result)
         logger.info("工具 [calculate] 执行成功，返回: %s", result_str)
         return result_str
 
+    except ExpressionError as e:
+        # 表达式不合法或超出限制，属于预期内的输入错误，不需要堆栈
+        error_message = f"计算表达式 '{expression}' 时发生错误: {e}"
+        logger.warning(error_message)
+        return ToolErrorResult(error_message)
     except Exception as e:
-        # 捕获任何可能的错误，如语法错误、除零错误等
+        # 捕获任何可能的错误，如除零错误、定义域错误等
         error_message = f"计算表达式 '{expression}' 时发生错误: {e}"
         logger.error(error_message, exc_info=True)
-        return error_message
+        return ToolErrorResult(error_message)
@@ -2,13 +2,129 @@
 import inspect
 import json
 import logging  # 👈 1. 导入 logging 模块
-from typing import Callable, Dict, Any, List
+import re
+import typing
+from typing import Callable, Dict, Any, List, NamedTuple, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, create_model
+
+from .search_index import BM25Index
 
 # 2. 在模块顶部，获取一个 logger 实例
 #    __name__ 在这里的值会是 'py_ai_core.tools.registry' (假设文件路径是这样)
 logger = logging.getLogger(__name__)
 
-TYPE_MAPPING = {"str": "string", "int": "integer", "float": "number", "bool": "boolean"}
+# 文档字符串中的 ":param name: 说明" 行，说明可以在后续缩进的行中续写
+_PARAM_DOC_PATTERN = re.compile(r"^:param\s+(\w+):\s*(.*)$")
+
+
+class ToolArgumentError(ValueError):
+    """模型给出的工具参数与工具签名不符。"""
+
+
+class ToolErrorResult(str):
+    """
+    工具以返回值（而不是异常）报告的错误信息。
+    模型看到的仍是这段文字，但执行器不会缓存它，下一次相同的调用会重新执行。
+    """
+
+
+def parse_docstring(doc: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """
+    把文档字符串拆成工具描述与各参数的说明。
+    描述只取第一段（第一个空行之前）的摘要；后面的详细说明面向开发者，
+    随每次请求发给模型只会多占 token。
+    """
+    description_lines: List[str] = []
+    summary_done = False
+    params: Dict[str, str] = {}
+    current: Optional[str] = None
+    for line in (doc or "").splitlines():
+        stripped = line.strip()
+        match = _PARAM_DOC_PATTERN.match(stripped)
+        if match:
+            current = match.group(1)
+            params[current] = match.group(2)
+        elif stripped.startswith((":return", ":raise")):
+            current = ""
+        elif current is None and not summary_done:
+            if stripped:
+                description_lines.append(stripped)
+            elif description_lines:
+                summary_done = True
+        elif current and stripped:
+            params[current] += " " + stripped
+    return "\n".join(description_lines), params
+
+
+def _strip_titles(schema: Any) -> Any:
+    """去掉 pydantic 为每一层自动生成的 title，它们对模型没有额外信息，只占 token。"""
+    if isinstance(schema, dict):
+        return {
+            key: _strip_titles(value)
+            for key, value in schema.items()
+            if not (key == "title" and isinstance(value, str))
+        }
+    if isinstance(schema, list):
+        return [_strip_titles(item) for item in schema]
+    return schema
+
+
+def build_arguments_model(
+    func: Callable, param_docs: Dict[str, str]
+) -> Type[BaseModel]:
+    """
+    根据函数签名与类型注解创建参数模型: 既用于生成 JSON Schema，也用于校验模型给出的参数。
+    支持 Optional、Literal、列表、字典与嵌套的 pydantic 模型；没有注解的参数接受任意值。
+    """
+    try:
+        hints = typing.get_type_hints(func)
+    except Exception:  # 注解引用了无法解析的名字
+        hints = {}
+    fields: Dict[str, Any] = {}
+    for name, param in inspect.signature(func).parameters.items():
+        if param.kind in (param.VAR_POSITIONAL, param.VAR_KEYWORD):
+            continue
+        annotation = hints.get(name, param.annotation)
+        if annotation is inspect.Parameter.empty:
+            annotation = Any
+        default = ... if param.default is inspect.Parameter.empty else param.default
+        fields[name] = (
+            annotation,
+            # 没有说明的参数不生成 description，占位文字对模型没有信息量
+            Field(default, description=param_docs.get(name) or None),
+        )
+    return create_model(
+        f"{func.__name__}_arguments",
+        __config__=ConfigDict(extra="forbid"),
+        **fields,
+    )
+
+
+class ToolOptions(NamedTuple):
+    """注册工具时声明的执行选项，由 tools/executor.py 负责执行。"""
+
+    # 单次调用的时间上限（秒），None 使用 TOOL_DEFAULT_TIMEOUT_SECONDS，0 表示不限制
+    timeout: Optional[float] = None
+    # 结果缓存的时长（秒），None 时纯函数使用 TOOL_PURE_CACHE_TTL_SECONDS，其它工具不缓存
+    cache_ttl: Optional[float] = None
+    # 纯函数：结果只取决于参数，可以缓存，相同的并发调用可以合并
+    pure: bool = False
+    # 幂等：重复执行没有额外影响，相同的并发调用可以合并
+    idempotent: bool = False
+    # 该工具同时执行的调用数上限，0 表示只受全局的 TOOL_MAX_CONCURRENCY 限制
+    max_concurrency: int = 0
+    # 开启工具筛选时总是提供给模型，不参与检索排序（见 tools/selection.py）
+    pinned: bool = False
+    # 计算密集型：在事件循环里执行会阻塞同一 worker 上的所有请求
+    cpu_bound: bool = False
+    # 执行不可信的输入（例如模型生成的表达式），需要与主进程隔离
+    untrusted: bool = False
+
+    @property
+    def sandboxed(self) -> bool:
+        """是否在沙箱进程池中执行，见 tools/sandbox.py。"""
+        return self.cpu_bound or self.untrusted
 
 
 class ToolRegistry:
@@ -16,12 +132,18 @@ class ToolRegistry:
         """工具注册中心的构造函数"""
         self.tools: Dict[str, Callable] = {}
         self.tool_schemas: List[Dict[str, Any]] = []
+        self.tool_options: Dict[str, ToolOptions] = {}
+        # 每个工具的参数模型，注册时构建一次，执行前用于校验与类型转换
+        self.argument_models: Dict[str, Type[BaseModel]] = {}
+        # 工具名称、描述与参数说明的检索索引，用于按问题筛选工具
+        self.search_index = BM25Index()
         # 在构造函数中记录初始化信息
         logger.info("工具注册中心 (ToolRegistry) 已初始化。")
 
-    def register(self, func: Callable):
+    def register(self, func: Callable, **options):
         """
         注册一个新工具，并根据其签名和文档字符串生成 schema。
+        options 为 ToolOptions 中的执行选项。
         """
         tool_name = func.__name__
 
@@ -29,24 +151,22 @@ class ToolRegistry:
         logger.info("开始注册新工具：%s", tool_name)
 
         self.tools[tool_name] = func
+        self.tool_options[tool_name] = ToolOptions(**options)
 
-        # --- 生成 Schema 的逻辑 (这部分逻辑保持不变) ---
-        sig = inspect.signature(func)
-        doc = inspect.getdoc(func)
-        description = doc.split("\n")[0] if doc else ""
+        # --- 生成 Schema 的逻辑: 类型来自类型注解，说明来自文档字符串 ---
+        description, param_docs = parse_docstring(inspect.getdoc(func))
 
         # 记录调试信息，这在排查 schema 生成问题时非常有用
         logger.debug("工具 '%s' 的描述: '%s'", tool_name, description)
 
-        parameters = {"type": "object", "properties": {}, "required": []}
-        for name, param in sig.parameters.items():
-            param_type = TYPE_MAPPING.get(param.annotation.__name__, "string")
-            parameters["properties"][name] = {
-                "type": param_type,
-                "description": f"参数: {name}",  # 中文描述
-            }
-            if param.default is inspect.Parameter.empty:
-                parameters["required"].append(name)
+        arguments_model = build_arguments_model(func, param_docs)
+        self.argument_models[tool_name] = arguments_model
+        parameters = _strip_titles(arguments_model.model_json_schema())
+        parameters.setdefault("required", [])
+        self.search_index.add(
+            tool_name,
+            " ".join([tool_name.replace("_", " "), description, *param_docs.values()]),
+        )
 
         logger.debug("为工具 '%s' 生成的参数 schema: %s", tool_name, parameters)
 
@@ -75,6 +195,28 @@ class ToolRegistry:
             logger.warning("尝试获取一个未注册的工具: %s", name)
         return tool
 
+    def validate_arguments(self, name: str, arguments: Any) -> Dict[str, Any]:
+        """
+        用注册时构建的参数模型校验并转换模型给出的参数，返回可直接传给工具的关键字参数。
+        参数不合法时抛出 ToolArgumentError，错误信息简短，便于模型据此修正。
+        """
+        model = self.argument_models.get(name)
+        if model is None:
+            return arguments
+        try:
+            validated = model.model_validate(arguments)
+        except ValidationError as e:
+            problems = "; ".join(
+                f"{'.'.join(str(p) for p in err['loc']) or '参数'}: {err['msg']}"
+                for err in e.errors(include_url=False)
+            )
+            raise ToolArgumentError(f"工具 '{name}' 的参数不合法: {problems}")
+        return {field: getattr(validated, field) for field in model.model_fields}
+
+    def get_options(self, name: str) -> ToolOptions:
+        """获取工具的执行选项，未注册的工具返回默认选项"""
+        return self.tool_options.get(name, ToolOptions())
+
     def get_all_schemas(self) -> List[Dict[str, Any]]:
         """获取所有已注册工具的 schema 列表"""
         logger.debug(
@@ -88,13 +230,19 @@ tool_registry = ToolRegistry()
 
 
 # 装饰器函数
-def tool(func: Callable):
+def tool(func: Optional[Callable] = None, **options):
     """
     一个用于注册工具的装饰器。
     用法:
     @tool
     def my_function(...):
         ...
+
+    @tool(cpu_bound=True)
+    def heavy_function(...):
+        ...
     """
     # 装饰器本身不需要日志，因为它只是调用了 register 方法
-    return tool_registry.register(func)
+    if func is None:
+        return lambda f: tool_registry.register(f, **options)
+    return tool_registry.register(func, **options)
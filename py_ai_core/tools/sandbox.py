@@ -0,0 +1,335 @@
+# --- START OF FILE py_ai_core/tools/sandbox.py ---
+
+"""
+工具的沙箱执行池。
+
+标记为 cpu_bound 或 untrusted 的工具（见 registry.ToolOptions）不在事件循环里执行，
+而是交给一组独立的工作进程:
+- 事件循环只等待结果，一个计算量失控的表达式不会卡住同一 worker 上的其它请求；
+- 每次调用都有墙钟时间上限；支持 resource 模块的平台（Linux/macOS）上
+  还限制 CPU 时间 (RLIMIT_CPU) 与内存 (RLIMIT_AS)；
+- 超限（包括内存耗尽）或崩溃的工作进程直接杀掉，下一次调用时补一个新的；
+  正常的工作进程执行一定次数后也会回收，避免状态与内存碎片累积；
+- 等待结果时在事件循环上监听管道可读，调用方被取消时不会留下阻塞的线程；
+- 关闭时杀掉所有存活的工作进程，包括仍在执行调用的进程。
+
+工具函数与参数通过 pickle 传给工作进程，因此工具必须是模块级函数。
+"""
+
+import asyncio
+import importlib
+import inspect
+import logging
+import multiprocessing
+import signal
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+from py_ai_core.core.config import settings
+
+try:
+    import resource
+except ImportError:  # Windows 上没有 resource 模块，只有墙钟时间上限生效
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# 启动工作进程时预先导入的模块，导入耗时不计入第一次调用的时间上限
+DEFAULT_PRELOAD = ("py_ai_core.tools",)
+
+# 等待新工作进程完成初始化的最长时间
+_STARTUP_TIMEOUT_SECONDS = 30.0
+
+
+class SandboxError(Exception):
+    """沙箱执行失败的基类。"""
+
+
+class SandboxLimitExceeded(SandboxError):
+    """工具调用超出了 CPU 时间、墙钟时间或内存上限。"""
+
+    def __init__(self, limit: str, detail: str):
+        super().__init__(detail)
+        self.limit = limit  # "cpu" / "wall" / "memory"
+
+
+class SandboxCrashedError(SandboxError):
+    """工作进程在执行过程中意外退出。"""
+
+
+# ===================================================================
+# 工作进程
+# ===================================================================
+
+
+def _set_cpu_limit(cpu_seconds: float):
+    """把 CPU 时间的软上限设为 "已用时间 + cpu_seconds"，超出时进程收到 SIGXCPU 退出。"""
+    used = time.process_time()
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(used + cpu_seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(conn, memory_mb: int, preload: Sequence[str]):
+    """工作进程的主循环: 逐个接收 (函数, 参数, CPU 时间上限) 并返回结果。"""
+    if resource is not None and memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    for module in preload:
+        importlib.import_module(module)
+    conn.send(("ready", None))
+
+    while True:
+        try:
+            func, kwargs, cpu_seconds = conn.recv()
+        except EOFError:
+            return
+        try:
+            if resource is not None and cpu_seconds > 0:
+                _set_cpu_limit(cpu_seconds)
+            result = func(**kwargs)
+            if inspect.iscoroutine(result):
+                result = asyncio.run(result)
+            reply = ("ok", result)
+        except MemoryError:
+            reply = ("limit", "memory")
+        except Exception as e:
+            reply = ("error", e)
+        try:
+            conn.send(reply)
+        except Exception as e:  # 结果或异常无法序列化
+            conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+class _Worker:
+    """父进程一侧持有的工作进程句柄。"""
+
+    def __init__(
+        self, ctx, memory_mb: int, preload: Sequence[str], live: Set["_Worker"]
+    ):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, memory_mb, tuple(preload)),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        # 登记到进程池的存活集合，关闭进程池时据此杀掉所有进程
+        self._live = live
+        live.add(self)
+        self.calls = 0
+        # 阻塞等待初始化完成，调用方应在线程中创建
+        if not self.conn.poll(_STARTUP_TIMEOUT_SECONDS):
+            self.kill()
+            self.process.join(timeout=5)
+            self.conn.close()
+            raise SandboxCrashedError("工具沙箱进程启动超时。")
+        try:
+            self.conn.recv()
+        except EOFError:
+            self.kill()
+            self.process.join(timeout=5)
+            self.conn.close()
+            raise SandboxCrashedError("工具沙箱进程启动失败。")
+
+    def kill(self):
+        """
+        杀掉工作进程，不等待它退出（不阻塞），退出后的回收见 _wait_exited。
+        管道由持有该进程的一方关闭: 执行中的调用需要先从管道上看到 EOF。
+        """
+        self._live.discard(self)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+async def _wait_exited(process, timeout: float = 5.0) -> None:
+    """
+    在事件循环上等待进程退出并回收，最多 timeout 秒。
+    轮询 exitcode（内部是非阻塞的 waitpid），不像 join() 那样卡住事件循环。
+    """
+    deadline = time.monotonic() + timeout
+    while process.exitcode is None and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def _wait_readable(conn, timeout: float) -> bool:
+    """
+    在事件循环上等待管道可读，超时返回 False。
+    不占用线程: 调用方被取消时直接停止监听，不会留下阻塞在 poll() 上的线程。
+    """
+    loop = asyncio.get_running_loop()
+    fd = conn.fileno()
+    readable = loop.create_future()
+    try:
+        loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+    except NotImplementedError:  # Windows 的 Proactor 事件循环不支持 add_reader
+        return await asyncio.to_thread(conn.poll, timeout)
+    try:
+        await asyncio.wait_for(readable, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+
+
+# ===================================================================
+# 进程池
+# ===================================================================
+
+
+class ToolSandbox:
+    """
+    固定大小的工具执行进程池。
+    工作进程按需启动；同时执行的调用数不超过工作进程数，多余的调用在事件循环里排队。
+    """
+
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        cpu_seconds: Optional[float] = None,
+        wall_seconds: Optional[float] = None,
+        memory_mb: Optional[int] = None,
+        max_calls_per_worker: Optional[int] = None,
+        preload: Sequence[str] = DEFAULT_PRELOAD,
+    ):
+        self.workers = workers or settings.TOOL_SANDBOX_WORKERS
+        self.cpu_seconds = (
+            settings.TOOL_SANDBOX_CPU_SECONDS if cpu_seconds is None else cpu_seconds
+        )
+        self.wall_seconds = wall_seconds or settings.TOOL_SANDBOX_WALL_SECONDS
+        self.memory_mb = (
+            settings.TOOL_SANDBOX_MEMORY_MB if memory_mb is None else memory_mb
+        )
+        self.max_calls_per_worker = (
+            max_calls_per_worker or settings.TOOL_SANDBOX_MAX_CALLS_PER_WORKER
+        )
+        self.preload = preload
+        # 使用 spawn: 工作进程不继承父进程的事件循环、连接池与线程
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        # 所有存活的工作进程（空闲的、执行中的以及正在启动的）
+        self._live: Set[_Worker] = set()
+        # 已杀掉、正在后台回收的进程
+        self._reaping: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stats = {"calls": 0, "limit_exceeded": 0, "crashed": 0, "recycled": 0}
+
+    async def run(self, func: Callable, kwargs: Dict[str, Any]) -> Any:
+        """
+        在工作进程中执行 func(**kwargs) 并返回结果（协程函数在工作进程里运行到结束）。
+        工具自身抛出的异常原样抛出；超限时抛出 SandboxLimitExceeded，进程崩溃时抛出 SandboxCrashedError。
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        async with self._slots:
+            worker = self._idle.pop() if self._idle else await self._spawn()
+            self._stats["calls"] += 1
+            try:
+                status, payload = await self._call(worker, func, kwargs)
+            except BaseException:
+                # 超时、崩溃或调用方被取消: 工作进程的状态未知，直接丢弃
+                self._retire(worker)
+                raise
+
+            worker.calls += 1
+            if status == "limit":
+                # 内存耗尽之后进程的状态不可靠（例如只完成了一部分的分配），直接替换
+                self._retire(worker)
+            elif worker.calls >= self.max_calls_per_worker:
+                self._stats["recycled"] += 1
+                self._retire(worker)
+            else:
+                self._idle.append(worker)
+
+        if status == "ok":
+            return payload
+        if status == "limit":
+            self._stats["limit_exceeded"] += 1
+            raise SandboxLimitExceeded(payload, "工具调用超出了内存上限。")
+        raise payload
+
+    async def _spawn(self) -> _Worker:
+        # 启动进程与等待初始化都会阻塞，放到线程里
+        spawning = asyncio.ensure_future(
+            asyncio.to_thread(
+                _Worker, self._ctx, self.memory_mb, self.preload, self._live
+            )
+        )
+        try:
+            return await asyncio.shield(spawning)
+        except asyncio.CancelledError:
+            # 调用方被取消时进程仍在启动，启动完成后放进空闲列表留给后续调用
+            spawning.add_done_callback(self._adopt)
+            raise
+
+    def _retire(self, worker: _Worker):
+        """杀掉工作进程，在后台任务里等待它退出，不阻塞当前调用。"""
+        worker.kill()
+        worker.conn.close()
+        reaping = asyncio.ensure_future(_wait_exited(worker.process))
+        self._reaping.add(reaping)
+        reaping.add_done_callback(self._reaping.discard)
+
+    def _adopt(self, spawning: asyncio.Future):
+        if not spawning.cancelled() and spawning.exception() is None:
+            self._idle.append(spawning.result())
+
+    async def _call(self, worker: _Worker, func: Callable, kwargs: Dict[str, Any]):
+        worker.conn.send((func, kwargs, self.cpu_seconds))
+        if not await _wait_readable(worker.conn, self.wall_seconds):
+            self._stats["limit_exceeded"] += 1
+            raise SandboxLimitExceeded(
+                "wall", f"工具调用超过了 {self.wall_seconds} 秒的时间上限。"
+            )
+        try:
+            return worker.conn.recv()
+        except EOFError:
+            pass
+
+        # 工作进程在返回结果前退出: 超出 CPU 时间时由 SIGXCPU 终止
+        await _wait_exited(worker.process)
+        exitcode = worker.process.exitcode
+        if resource is not None and exitcode == -signal.SIGXCPU:
+            self._stats["limit_exceeded"] += 1
+            raise SandboxLimitExceeded(
+                "cpu", f"工具调用超过了 {self.cpu_seconds} 秒的 CPU 时间上限。"
+            )
+        self._stats["crashed"] += 1
+        raise SandboxCrashedError(f"工具沙箱进程意外退出 (exitcode={exitcode})。")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "workers": self.workers,
+            "idle_workers": len(self._idle),
+            "live_workers": len(self._live),
+        }
+
+    async def shutdown(self):
+        """关闭所有存活的工作进程；仍在执行的调用会以 SandboxCrashedError 结束。"""
+        workers = list(self._live)
+        idle, self._idle = self._idle, []
+        self._slots = None
+        for worker in workers:
+            worker.kill()
+        # 执行中的进程的管道由对应的调用在看到 EOF 后关闭
+        for worker in idle:
+            worker.conn.close()
+        await asyncio.gather(
+            *(_wait_exited(worker.process) for worker in workers), *self._reaping
+        )
+        if workers:
+            logger.info("已关闭 %d 个工具沙箱进程。", len(workers))
+
+
+# 创建一个全局单例
+tool_sandbox = ToolSandbox()
+
+# --- END OF FILE py_ai_core/tools/sandbox.py ---
@@ -0,0 +1,91 @@
+# --- START OF FILE py_ai_core/tools/search_index.py ---
+
+"""
+工具目录的本地词法检索索引 (BM25)。
+
+注册工具时把名称、描述与参数说明加入索引，请求到来时按用户的问题检索最相关的工具，
+整个过程在进程内完成，不依赖外部服务。
+
+分词同时照顾中英文: 英文与数字按单词切分（工具名中的下划线视为分隔符），
+连续的中文字符切成单字与相邻两字的组合，"天气怎么样" 能命中描述中的 "天气"。
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[\u4e00-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切成检索用的词项。"""
+    tokens: List[str] = []
+    for run in _WORD_PATTERN.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+            continue
+        tokens.extend(run)
+        tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """一个简单的倒排 BM25 索引，文档可以逐个加入或替换。"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        """加入一篇文档，同一 doc_id 再次加入时替换原来的内容。"""
+        if doc_id in self._lengths:
+            self.remove(doc_id)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self._postings.setdefault(term, {})[doc_id] = tf
+        length = sum(counts.values())
+        self._lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: str) -> None:
+        length = self._lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in list(self._postings):
+            postings = self._postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """返回得分最高的 k 篇文档 (doc_id, 得分)，只包含至少命中一个词项的文档。"""
+        n = len(self._lengths)
+        if not n or k <= 0:
+            return []
+        avg_length = self._total_length / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[doc_id] / avg_length
+                )
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (
+                    tf + norm
+                )
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
+
+
+# --- END OF FILE py_ai_core/tools/search_index.py ---
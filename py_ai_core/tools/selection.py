@@ -0,0 +1,158 @@
+# --- START OF FILE py_ai_core/tools/selection.py ---
+
+"""
+按问题筛选本次请求提供给模型的工具。
+
+工具目录变大以后，每个请求都带上全部工具的 schema 会明显增加 prompt token 与上游延迟。
+开启筛选后，用注册时建立的词法索引（见 tools/search_index.py）按用户的问题检索
+最相关的 TOOL_SELECTION_TOP_K 个工具，再加上固定提供的工具 (pinned)。
+
+TOOL_SELECTION_MODE:
+- off: 总是提供全部工具；
+- shadow: 仍然提供全部工具，但照常计算筛选结果，用模型实际调用的工具统计召回率，
+  用于在开启之前评估 top-k 是否足够；
+- on: 只提供筛选出的工具。
+
+最近历史中调用过的工具也总是提供，这样 "那上海呢？" 这类不含关键词的追问
+仍能用到上一轮的工具。
+
+召回率 = 模型实际调用的工具中落在筛选结果内的比例。
+on 模式下模型只能看到筛选出的工具，这个数字会偏高，评估应以 shadow 模式为准。
+"""
+
+import logging
+import time
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from py_ai_core.core.config import settings
+from py_ai_core.tools.registry import ToolRegistry, tool_registry
+
+logger = logging.getLogger(__name__)
+
+
+class ToolSelection(NamedTuple):
+    # 本次请求发送给模型的工具 schema
+    schemas: List[Dict[str, Any]]
+    # 筛选出的工具名；未开启筛选时为 None
+    selected: Optional[FrozenSet[str]] = None
+
+
+def _called_tool_names(messages: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """逐个产出消息中 assistant 请求调用的工具名。"""
+    for message in messages:
+        for tool_call in message.get("tool_calls") or []:
+            yield tool_call["function"]["name"]
+
+
+class ToolSelector:
+    def __init__(self, registry: Optional[ToolRegistry] = None):
+        self.registry = registry or tool_registry
+        self._stats = {
+            "selections": 0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+            "offered_tools": 0,
+            "catalog_tools": 0,
+            "called_tools": 0,
+            "called_in_selection": 0,
+        }
+
+    def pinned(self) -> FrozenSet[str]:
+        return frozenset(
+            name
+            for name in self.registry.tools
+            if self.registry.get_options(name).pinned
+            or name in settings.TOOL_SELECTION_PINNED
+        )
+
+    def select(
+        self, query: str, history: Iterable[Dict[str, Any]] = ()
+    ) -> ToolSelection:
+        """
+        为一个问题挑选工具。off 模式下直接返回全部工具，不做检索。
+        history 是本轮带给模型的历史消息，其中调用过的工具会一并提供。
+        """
+        all_schemas = self.registry.get_all_schemas()
+        mode = settings.TOOL_SELECTION_MODE
+        if mode not in ("shadow", "on"):
+            return ToolSelection(all_schemas)
+
+        started = time.perf_counter()
+        ranked = self.registry.search_index.search(query, settings.TOOL_SELECTION_TOP_K)
+        selected = self.pinned() | {name for name, _ in ranked}
+        selected |= set(_called_tool_names(history)) & self.registry.tools.keys()
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        self._stats["selections"] += 1
+        self._stats["total_latency_ms"] += latency_ms
+        self._stats["max_latency_ms"] = max(self._stats["max_latency_ms"], latency_ms)
+        self._stats["catalog_tools"] += len(all_schemas)
+        logger.debug(
+            "工具筛选 (%s) 用时 %.2fms，从 %d 个工具中选出: %s",
+            mode,
+            latency_ms,
+            len(all_schemas),
+            sorted(selected),
+        )
+
+        if mode == "on":
+            schemas = [s for s in all_schemas if s["function"]["name"] in selected]
+        else:
+            schemas = all_schemas
+        self._stats["offered_tools"] += len(schemas)
+        return ToolSelection(schemas, frozenset(selected))
+
+    def record_calls(
+        self, selection: ToolSelection, messages: Iterable[Dict[str, Any]]
+    ) -> None:
+        """根据本次请求中模型实际调用的工具更新召回率统计。"""
+        if selection.selected is None:
+            return
+        for name in _called_tool_names(messages):
+            self._stats["called_tools"] += 1
+            if name in selection.selected:
+                self._stats["called_in_selection"] += 1
+            else:
+                logger.info("模型调用的工具 '%s' 不在筛选结果中。", name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self._stats
+        selections = stats["selections"]
+        return {
+            "mode": settings.TOOL_SELECTION_MODE,
+            "top_k": settings.TOOL_SELECTION_TOP_K,
+            "pinned": sorted(self.pinned()),
+            "selections": selections,
+            "avg_latency_ms": (
+                stats["total_latency_ms"] / selections if selections else 0.0
+            ),
+            "max_latency_ms": stats["max_latency_ms"],
+            "avg_offered_tools": (
+                stats["offered_tools"] / selections if selections else 0.0
+            ),
+            "avg_catalog_tools": (
+                stats["catalog_tools"] / selections if selections else 0.0
+            ),
+            "called_tools": stats["called_tools"],
+            "called_in_selection": stats["called_in_selection"],
+            "recall": (
+                stats["called_in_selection"] / stats["called_tools"]
+                if stats["called_tools"]
+                else 1.0
+            ),
+        }
+
+
+# 创建一个全局单例
+tool_selector = ToolSelector()
+
+# --- END OF FILE py_ai_core/tools/selection.py ---
@@ -0,0 +1,114 @@
+# --- START OF FILE tests/test_batch.py ---
+
+import asyncio
+import json
+
+import pytest
+
+from py_ai_core.core.state_backend import InMemoryStateBackend
+from py_ai_core.mcp.batch import _completed_ids, assign_custom_ids, run_batch
+from py_ai_core.models.schemas import BatchChatItem, ChatResponse
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_answer(fail_queries=()):
+    """记录调用顺序与最大并发数的假 answer 函数"""
+    calls, active = [], {"now": 0, "max": 0}
+
+    async def answer(request):
+        active["now"] += 1
+        active["max"] = max(active["max"], active["now"])
+        try:
+            await asyncio.sleep(0.01)
+            calls.append(request.query)
+            if request.query in fail_queries:
+                raise RuntimeError("上游出错")
+            return ChatResponse(
+                answer=f"答:{request.query}", session_id=request.session_id
+            )
+        finally:
+            active["now"] -= 1
+
+    return answer, calls, active
+
+
+async def test_run_batch_reports_each_item_and_keeps_session_order():
+    """
+    测试: 每一项都产出一行结果，单项失败不影响其他项；同一会话的条目按顺序执行，
+    并发数不超过上限。
+    """
+    items = [
+        BatchChatItem(query="a1", session_id="a"),
+        BatchChatItem(query="b1", session_id="b"),
+        BatchChatItem(query="a2", session_id="a"),
+        BatchChatItem(query="c1", session_id="c"),
+        BatchChatItem(query="没有会话"),
+    ]
+    answer, calls, active = make_answer(fail_queries={"b1"})
+
+    results = [r async for r in run_batch(items, answer, concurrency=2)]
+
+    by_id = {r.custom_id: r for r in results}
+    assert len(results) == 5
+    assert by_id["0"].answer == "答:a1"
+    assert by_id["1"].status == "error"
+    assert by_id["1"].error["type"] == "internal_error"
+    assert by_id["4"].error["type"] == "invalid_request"
+    assert calls.index("a1") < calls.index("a2")
+    assert active["max"] <= 2
+
+
+async def test_run_batch_resumes_with_batch_id():
+    """
+    测试: 用同一 batch_id 重新提交时，已成功的条目直接返回保存的结果，失败的条目重新执行。
+    """
+    state = InMemoryStateBackend()
+    items = [
+        BatchChatItem(query="q1", session_id="s1", custom_id="x"),
+        BatchChatItem(query="q2", session_id="s2", custom_id="y"),
+    ]
+    answer, calls, _ = make_answer(fail_queries={"q2"})
+    first = [r async for r in run_batch(items, answer, batch_id="b", state=state)]
+    assert {r.custom_id: r.status for r in first} == {"x": "ok", "y": "error"}
+
+    answer, calls, _ = make_answer()
+    second = [r async for r in run_batch(items, answer, batch_id="b", state=state)]
+
+    assert calls == ["q2"]
+    by_id = {r.custom_id: r for r in second}
+    assert by_id["x"].resumed and by_id["x"].answer == "答:q1"
+    assert by_id["y"].status == "ok" and not by_id["y"].resumed
+
+
+async def test_duplicate_custom_ids_are_rejected():
+    """
+    测试: custom_id 重复的批次被拒绝。
+    """
+    items = [
+        BatchChatItem(query="1", session_id="s", custom_id="dup"),
+        BatchChatItem(query="2", session_id="s", custom_id="dup"),
+    ]
+    with pytest.raises(ValueError):
+        assign_custom_ids(items)
+
+
+async def test_completed_ids_ignore_errors_and_partial_lines(tmp_path):
+    """
+    测试: 断点续跑只跳过输出文件中成功的条目，忽略失败的条目与写了一半的行。
+    """
+    output = tmp_path / "results.jsonl"
+    output.write_text(
+        json.dumps({"custom_id": "0", "status": "ok"})
+        + "\n"
+        + json.dumps({"custom_id": "1", "status": "error"})
+        + "\n"
+        + '{"custom_id": "2", "sta',
+        encoding="utf-8",
+    )
+
+    assert _completed_ids(str(output)) == {"0"}
+    assert _completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+# --- END OF FILE tests/test_batch.py ---
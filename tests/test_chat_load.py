@@ -0,0 +1,83 @@
+# --- START OF FILE tests/test_chat_load.py ---
+
+"""
+负载测试: 并发聊天数受大模型容量限制，而不是数据库连接池大小。
+
+用一个只有 2 个连接的“连接池”和耗时 0.2 秒的“大模型”同时跑 20 个聊天请求:
+如果等待大模型期间仍占着连接，20 个请求只能两两排队，至少需要 2 秒；
+连接只在读写阶段借用时，所有请求几乎同时等待大模型，总耗时接近一次调用。
+"""
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+from py_ai_core.mcp import router
+from py_ai_core.models.schemas import ChatRequest
+
+pytestmark = pytest.mark.asyncio
+
+POOL_SIZE = 2
+CONCURRENT_CHATS = 20
+LLM_LATENCY_SECONDS = 0.2
+
+
+class Gauge:
+    def __init__(self):
+        self.now = 0
+        self.peak = 0
+
+    def __enter__(self):
+        self.now += 1
+        self.peak = max(self.peak, self.now)
+
+    def __exit__(self, *exc):
+        self.now -= 1
+
+
+async def test_chat_concurrency_is_not_bounded_by_db_pool(monkeypatch):
+    pool = asyncio.Semaphore(POOL_SIZE)
+    connections, llm_calls = Gauge(), Gauge()
+
+    @asynccontextmanager
+    async def session_factory():
+        async with pool:
+            with connections:
+                yield AsyncMock()
+
+    async def model_decision(messages, tools=None):
+        with llm_calls:
+            await asyncio.sleep(LLM_LATENCY_SECONDS)
+        return SimpleNamespace(content="好的", tool_calls=None)
+
+    async def db_phase(*args, **kwargs):
+        # 读写阶段本身也需要一点时间
+        await asyncio.sleep(0.005)
+        return ("提示词", [])
+
+    monkeypatch.setattr(router, "AsyncSessionLocal", session_factory)
+    monkeypatch.setattr(router.session_service, "get_turn_context", db_phase)
+    monkeypatch.setattr(router.session_service, "update_history", db_phase)
+    monkeypatch.setattr(router.llm_service, "get_model_decision", model_decision)
+
+    started = time.monotonic()
+    responses = await asyncio.gather(
+        *(
+            router.answer_chat(ChatRequest(query="你好", session_id=f"load-{i}"))
+            for i in range(CONCURRENT_CHATS)
+        )
+    )
+    elapsed = time.monotonic() - started
+
+    assert all(r.answer == "好的" for r in responses)
+    assert connections.peak <= POOL_SIZE
+    # 所有请求同时在等待大模型，而不是按连接池大小分批
+    assert llm_calls.peak == CONCURRENT_CHATS
+    assert elapsed < LLM_LATENCY_SECONDS * CONCURRENT_CHATS / POOL_SIZE / 2
+
+
+# --- END OF FILE tests/test_chat_load.py ---
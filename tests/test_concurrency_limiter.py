@@ -0,0 +1,87 @@
+# --- START OF FILE tests/test_concurrency_limiter.py ---
+
+import asyncio
+
+import pytest
+
+from py_ai_core.services.concurrency_limiter import (
+    AdaptiveLimiter,
+    UpstreamOverloadedError,
+)
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+def make_limiter(limit=1, max_queue=1, queue_timeout=1.0):
+    return AdaptiveLimiter(
+        "test",
+        initial_limit=limit,
+        min_limit=1,
+        max_limit=10,
+        max_queue=max_queue,
+        queue_timeout=queue_timeout,
+    )
+
+
+async def test_full_queue_fails_fast():
+    """
+    测试: 并发名额和等待队列都满时，新的请求立即被拒绝。
+    """
+    limiter = make_limiter(limit=1, max_queue=1)
+    await limiter.acquire()
+    queued = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(UpstreamOverloadedError):
+        await limiter.acquire()
+
+    # 归还名额后，排队的请求拿到名额
+    limiter.release()
+    await asyncio.wait_for(queued, 1)
+    assert limiter.in_flight == 1
+    assert limiter.stats()["total_rejected"] == 1
+
+
+async def test_queue_timeout_raises_overloaded():
+    """
+    测试: 排队超时的请求被拒绝，并且不会占用名额。
+    """
+    limiter = make_limiter(limit=1, queue_timeout=0.01)
+    await limiter.acquire()
+
+    with pytest.raises(UpstreamOverloadedError):
+        await limiter.acquire()
+    assert limiter.in_flight == 1
+    assert limiter.stats()["queued"] == 0
+
+
+async def test_aimd_adjusts_limit():
+    """
+    测试: 成功时上限缓慢增加，过载时上限减半。
+    """
+    limiter = make_limiter(limit=8)
+    for _ in range(10):
+        async with limiter.slot():
+            pass
+    assert int(limiter.limit) == 9
+
+    async with limiter.slot() as outcome:
+        outcome["overloaded"] = True
+    assert int(limiter.limit) == 4
+
+
+async def test_non_overload_failure_keeps_limit():
+    """
+    测试: 非过载的失败（请求错误、取消等）既不增加也不降低上限。
+    """
+    limiter = make_limiter(limit=4)
+    for error in (ValueError("请求错误"), asyncio.CancelledError()):
+        with pytest.raises(type(error)):
+            async with limiter.slot():
+                raise error
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+# --- END OF FILE tests/test_concurrency_limiter.py ---
@@ -0,0 +1,51 @@
+# --- START OF FILE tests/test_database.py ---
+
+import asyncio
+from unittest.mock import MagicMock
+
+import pytest
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.util import greenlet_spawn
+
+from py_ai_core.core.database import InstrumentedQueuePool
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_pool(**kwargs):
+    """一个用假 DBAPI 连接的小连接池: 1 个常驻连接 + 1 个溢出连接"""
+    return InstrumentedQueuePool(
+        MagicMock, pool_size=1, max_overflow=1, timeout=0.05, **kwargs
+    )
+
+
+async def test_only_blocked_checkouts_are_counted_once():
+    """
+    测试: 有空闲或可溢出的连接时不计为等待；连接用满后的每次取连接只计一次等待，
+    超时单独计数，等到归还的连接后等待数归零。
+    """
+    pool = make_pool()
+    first = await greenlet_spawn(pool.connect)
+    second = await greenlet_spawn(pool.connect)  # 溢出连接
+    assert pool.total_waits == 0
+
+    with pytest.raises(PoolTimeoutError):
+        await greenlet_spawn(pool.connect)
+    assert pool.total_waits == 1
+    assert pool.total_timeouts == 1
+
+    waiter = asyncio.ensure_future(greenlet_spawn(pool.connect))
+    await asyncio.sleep(0.01)
+    assert pool.waiting == 1
+    await greenlet_spawn(first.close)
+    third = await waiter
+
+    assert pool.total_waits == 2
+    assert pool.total_timeouts == 1
+    assert pool.waiting == 0
+    assert pool.total_wait_ms > 0
+    await greenlet_spawn(second.close)
+    await greenlet_spawn(third.close)
+
+
+# --- END OF FILE tests/test_database.py ---
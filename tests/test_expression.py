@@ -0,0 +1,110 @@
+# --- START OF FILE tests/test_expression.py ---
+
+import json
+
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.tools import expression
+from py_ai_core.tools.expression import (
+    ExpressionError,
+    compile_expression,
+    evaluate,
+    evaluate_many,
+)
+from py_ai_core.tools.math_tools import calculate
+from py_ai_core.tools.registry import ToolErrorResult
+
+
+@pytest.mark.parametrize(
+    "expr, expected",
+    [
+        ("10 * (3 + 5) / 2", 40.0),
+        ("pow(2, 10)", 1024.0),
+        ("sqrt(144)", 12.0),
+        ("-7 // 2 + 7 % 3", -3),
+        ("2 ** 100", 2**100),
+        ("floor(pi * 100)", 314),
+    ],
+)
+def test_evaluate_arithmetic(expr, expected):
+    """
+    测试: 白名单内的运算与函数得到与 Python 相同的结果。
+    """
+    assert evaluate(expr) == expected
+
+
+@pytest.mark.parametrize(
+    "expr",
+    [
+        "__import__('os')",
+        "(1).__class__",
+        "[1, 2][0]",
+        "lambda: 1",
+        "open('x')",
+        "'a' * 10",
+        "1 if 1 else 2",
+        "sqrt",
+    ],
+)
+def test_rejects_non_whitelisted_syntax(expr):
+    """
+    测试: 属性访问、下标、非白名单函数、字符串等语法在编译阶段就被拒绝。
+    """
+    with pytest.raises(ExpressionError):
+        compile_expression(expr)
+
+
+@pytest.mark.parametrize(
+    "expr", ["9**9**9", "pow(10, 10**8)", "2 ** 5000", "10.0 ** 400"]
+)
+def test_rejects_oversized_results(expr):
+    """
+    测试: 指数或结果超出上限的表达式直接报错，不会真正去计算。
+    """
+    with pytest.raises(ExpressionError):
+        evaluate(expr)
+
+
+def test_compiled_expressions_are_cached():
+    """
+    测试: 同一表达式只编译一次，之后代入不同变量直接复用闭包。
+    """
+    compile_expression.cache_clear()
+    assert evaluate("x * 2 + 1", {"x": 3}) == 7
+    assert evaluate("x * 2 + 1", {"x": 5}) == 11
+    assert compile_expression.cache_info().hits == 1
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_evaluate_many_binds_columns(monkeypatch, use_numpy):
+    """
+    测试: 向量模式按行代入变量，标量变量广播到每一行；numpy 与纯 Python 实现结果一致。
+    """
+    if use_numpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(expression, "np", None)
+
+    assert evaluate_many("x * 2 + y", {"x": [1, 2, 3], "y": 1}) == [3, 5, 7]
+    with pytest.raises(ExpressionError):
+        evaluate_many("x + y", {"x": [1, 2], "y": [1, 2, 3]})
+    with pytest.raises(ExpressionError):
+        evaluate_many("x ** 20000", {"x": [1, 2]})
+
+
+@pytest.mark.asyncio
+async def test_calculate_reports_errors_as_text(monkeypatch):
+    """
+    测试: calculate 对非法或超限的表达式返回错误信息（标记为 ToolErrorResult，不会被缓存），
+    变量取值为列表时返回列表。
+    """
+    monkeypatch.setattr(settings, "CALC_MAX_RESULT_BITS", 64)
+    error = await calculate("2 ** 100")
+    assert "错误" in error
+    assert isinstance(error, ToolErrorResult)
+    assert "错误" in await calculate("x.real", {"x": 1})
+    assert json.loads(await calculate("x + 1", {"x": [1, 2]})) == [2, 3]
+
+
+# --- END OF FILE tests/test_expression.py ---
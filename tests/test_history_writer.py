@@ -0,0 +1,186 @@
+# --- START OF FILE tests/test_history_writer.py ---
+
+import asyncio
+
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.state_backend import InMemoryStateBackend
+from py_ai_core.services.history_writer import HistoryWriter, PendingTurn
+from py_ai_core.services.session_service import SessionService
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+def _turn(session_id: str, content: str = "你好") -> PendingTurn:
+    return PendingTurn(session_id, [{"role": "user", "content": content}])
+
+
+async def test_batches_are_flushed_when_full(monkeypatch):
+    """
+    测试: 队列中攒够 HISTORY_WRITER_BATCH_SIZE 轮后立即合并成一批提交。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WRITER_BATCH_SIZE", 3)
+    monkeypatch.setattr(settings, "HISTORY_WRITER_FLUSH_INTERVAL_MS", 60_000)
+    batches = []
+
+    async def flush(turns):
+        batches.append(list(turns))
+
+    writer = HistoryWriter(flush)
+    writer.start()
+    for i in range(3):
+        await writer.submit(_turn(f"s{i}"))
+    await asyncio.wait_for(writer.drain(), 1)
+
+    assert [len(b) for b in batches] == [3]
+    assert not writer.has_pending("s0")
+    await writer.stop()
+
+
+async def test_partial_batch_is_flushed_after_interval(monkeypatch):
+    """
+    测试: 批次未满时，最迟在刷新间隔后提交；同一会话的多轮按顺序写入。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WRITER_BATCH_SIZE", 100)
+    monkeypatch.setattr(settings, "HISTORY_WRITER_FLUSH_INTERVAL_MS", 10)
+    batches = []
+
+    async def flush(turns):
+        batches.append(list(turns))
+
+    writer = HistoryWriter(flush)
+    writer.start()
+    await writer.submit(_turn("s1", "第一轮"))
+    await writer.submit(_turn("s1", "第二轮"))
+    assert writer.has_pending("s1")
+
+    await asyncio.wait_for(writer.drain(), 1)
+
+    assert len(batches) == 1
+    assert [t.messages[0]["content"] for t in batches[0]] == ["第一轮", "第二轮"]
+    assert not writer.has_pending("s1")
+    await writer.stop()
+
+
+async def test_wait_for_session_ignores_other_sessions(monkeypatch):
+    """
+    测试: 读路径只等待本会话的对话落库；其它会话持续写入、队列一直不空时也不会被卡住。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WRITER_BATCH_SIZE", 1)
+    monkeypatch.setattr(settings, "HISTORY_WRITER_FLUSH_INTERVAL_MS", 1)
+    written = []
+
+    async def flush(turns):
+        await asyncio.sleep(0.005)
+        written.extend(t.session_id for t in turns)
+
+    writer = HistoryWriter(flush)
+    writer.start()
+
+    async def busy_sessions():
+        i = 0
+        while True:
+            await writer.submit(_turn(f"other{i}"))
+            i += 1
+            await asyncio.sleep(0.001)
+
+    load = asyncio.create_task(busy_sessions())
+    await asyncio.sleep(0.02)
+    await writer.submit(_turn("s1"))
+    try:
+        assert await asyncio.wait_for(writer.wait_for_session("s1"), 1)
+        assert "s1" in written
+        assert not writer.has_pending("s1")
+        assert writer._queue.qsize() > 0
+    finally:
+        load.cancel()
+    await writer.stop()
+
+
+async def test_failed_flush_is_retried(monkeypatch):
+    """
+    测试: 写入失败时会重试，成功后批次不丢失。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WRITER_FLUSH_INTERVAL_MS", 1)
+    monkeypatch.setattr(settings, "HISTORY_WRITER_MAX_RETRIES", 2)
+    calls = []
+
+    async def flush(turns):
+        calls.append(list(turns))
+        if len(calls) == 1:
+            raise RuntimeError("数据库暂时不可用")
+
+    writer = HistoryWriter(flush)
+    writer.start()
+    await writer.submit(_turn("s1"))
+    await asyncio.wait_for(writer.drain(), 2)
+
+    assert len(calls) == 2
+    assert calls[1] == calls[0]
+    await writer.stop()
+
+
+async def test_exhausted_retries_report_dropped_batch(monkeypatch):
+    """
+    测试: 重试耗尽后批次被丢弃，并通过 on_drop 通知调用方；写入器继续处理后续批次。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WRITER_FLUSH_INTERVAL_MS", 1)
+    monkeypatch.setattr(settings, "HISTORY_WRITER_MAX_RETRIES", 1)
+    calls, dropped = [], []
+
+    async def flush(turns):
+        calls.append(list(turns))
+        raise RuntimeError("数据库不可用")
+
+    async def on_drop(turns):
+        dropped.extend(t.session_id for t in turns)
+
+    writer = HistoryWriter(flush, on_drop=on_drop)
+    writer.start()
+    await writer.submit(_turn("s1"))
+    await asyncio.wait_for(writer.drain(), 2)
+
+    assert len(calls) == 2
+    assert dropped == ["s1"]
+    assert not writer.has_pending("s1")
+    await writer.stop()
+
+
+async def test_dropped_batch_invalidates_session_cache(monkeypatch):
+    """
+    测试: SessionService 在批次被丢弃时让相关会话的热缓存失效。
+    """
+    service = SessionService(state=InMemoryStateBackend())
+    await service._update_cached("s1", system_prompt="提示词", messages=[], last_seq=0)
+    await service._update_cached("s2", system_prompt="提示词", messages=[], last_seq=0)
+
+    await service.history_writer._notify_drop([_turn("s1"), _turn("s1")])
+
+    assert await service._get_cached("s1") is None
+    assert await service._get_cached("s2") is not None
+
+
+async def test_stop_drains_pending_turns(monkeypatch):
+    """
+    测试: 关闭写入器时，队列中剩余的对话会先写完。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WRITER_FLUSH_INTERVAL_MS", 60_000)
+    written = []
+
+    async def flush(turns):
+        written.extend(t.session_id for t in turns)
+
+    writer = HistoryWriter(flush)
+    writer.start()
+    await writer.submit(_turn("s1"))
+    await writer.submit(_turn("s2"))
+
+    await writer.stop()
+
+    assert written == ["s1", "s2"]
+    assert not writer.running
+
+
+# --- END OF FILE tests/test_history_writer.py ---
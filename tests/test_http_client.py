@@ -0,0 +1,57 @@
+# --- START OF FILE tests/test_http_client.py ---
+
+import httpx
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.http_client import create_llm_http_client, http_pool_stats, warm_up
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_client_uses_configured_timeouts(monkeypatch):
+    """
+    测试: 共享客户端按配置设置各阶段超时，新建时连接池为空。
+    """
+    monkeypatch.setattr(settings, "LLM_CONNECT_TIMEOUT_SECONDS", 1.5)
+    monkeypatch.setattr(settings, "LLM_POOL_TIMEOUT_SECONDS", 2.5)
+    client = create_llm_http_client()
+    try:
+        assert client.timeout.connect == 1.5
+        assert client.timeout.pool == 2.5
+        stats = http_pool_stats(client)
+        assert stats["connections"] == 0
+        assert stats["requests_in_flight"] == 0
+    finally:
+        await client.aclose()
+
+
+async def test_warm_up_touches_each_url_once():
+    """
+    测试: 预热对重复的地址只请求一次，单个地址失败不影响其余地址。
+    """
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(str(request.url))
+        if request.url.host == "down.example":
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(404)
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    try:
+        await warm_up(
+            client,
+            [
+                "https://a.example/v1",
+                "https://a.example/v1",
+                "https://down.example/v1",
+            ],
+        )
+    finally:
+        await client.aclose()
+
+    assert sorted(seen) == ["https://a.example/v1", "https://down.example/v1"]
+
+
+# --- END OF FILE tests/test_http_client.py ---
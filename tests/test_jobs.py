@@ -0,0 +1,207 @@
+# --- START OF FILE tests/test_jobs.py ---
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pydantic import ValidationError
+from sqlalchemy.dialects import postgresql
+
+from py_ai_core.core.config import settings
+from py_ai_core.mcp import jobs
+from py_ai_core.mcp.jobs import JobQueue
+from py_ai_core.models.schemas import ChatJobRequest, ChatResponse
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
+
+pytestmark = pytest.mark.asyncio
+
+
+def make_job(**overrides):
+    fields = {
+        "id": "job-1",
+        "session_id": "s1",
+        "request": {"query": "你好", "session_id": "s1"},
+        "attempts": 1,
+        "callback_url": "http://callback.example/hook",
+    }
+    fields.update(overrides)
+    return SimpleNamespace(**fields)
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """数据库操作与回调都被 mock 掉的 JobQueue"""
+    fake_db = AsyncMock()
+    session_factory = MagicMock()
+    session_factory.return_value.__aenter__.return_value = fake_db
+    monkeypatch.setattr(jobs, "AsyncSessionLocal", session_factory)
+    queue = JobQueue()
+    queue._finish = AsyncMock()
+    queue._heartbeat = AsyncMock(return_value=True)
+    queue._send_callback = AsyncMock()
+    return queue
+
+
+async def test_claim_uses_skip_locked(monkeypatch):
+    """
+    测试: 领取任务的语句按优先级排序，并以 FOR UPDATE SKIP LOCKED 跳过被锁住的行。
+    """
+    fake_db = AsyncMock()
+    fake_db.execute.return_value = MagicMock()
+    session_factory = MagicMock()
+    session_factory.return_value.__aenter__.return_value = fake_db
+    monkeypatch.setattr(jobs, "AsyncSessionLocal", session_factory)
+
+    await JobQueue()._claim()
+
+    sql = str(fake_db.execute.await_args.args[0].compile(dialect=postgresql.dialect()))
+    assert "FOR UPDATE SKIP LOCKED" in sql
+    assert "ORDER BY chat_jobs.priority DESC" in sql
+    fake_db.commit.assert_awaited_once()
+
+
+async def test_process_records_result_and_sends_callback(queue):
+    """
+    测试: 任务成功后写回结果，并把结果推送到 callback_url。
+    """
+
+    async def answer(request):
+        return ChatResponse(answer=f"答:{request.query}", session_id=request.session_id)
+
+    queue._answer = answer
+    await queue._process(make_job())
+
+    queue._finish.assert_awaited_once_with(
+        "job-1",
+        "succeeded",
+        result={"answer": "答:你好", "session_id": "s1"},
+        error=None,
+    )
+    assert queue._send_callback.await_args.args[1] == "succeeded"
+
+
+async def test_running_job_is_interrupted_when_cancelled(queue, monkeypatch):
+    """
+    测试: 心跳发现任务已被取消时中断执行，不覆盖 cancelled 状态。
+    """
+    monkeypatch.setattr(settings, "JOB_HEARTBEAT_SECONDS", 0.01)
+    queue._heartbeat.return_value = False
+    started = asyncio.Event()
+
+    async def answer(request):
+        started.set()
+        await asyncio.sleep(10)
+
+    queue._answer = answer
+    await asyncio.wait_for(queue._process(make_job()), 1)
+
+    assert started.is_set()
+    queue._finish.assert_not_awaited()
+    assert queue._send_callback.await_args.args[1] == "cancelled"
+
+
+async def test_overloaded_job_is_requeued_with_delay(queue):
+    """
+    测试: 上游过载时任务按建议的等待时间推迟后重新排队，不推送回调。
+    """
+
+    async def answer(request):
+        raise UpstreamOverloadedError("满了", retry_after=7)
+
+    queue._answer = answer
+    await queue._process(make_job(attempts=1))
+
+    queue._finish.assert_awaited_once_with("job-1", "queued", delay=7)
+    queue._send_callback.assert_not_awaited()
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "ftp://93.184.216.34/hook",
+        "http://127.0.0.1:8000/hook",
+        "http://10.0.0.5/hook",
+        "http://169.254.169.254/latest/meta-data",
+        "http://[::1]/hook",
+        "http://localhost/hook",
+    ],
+)
+async def test_callback_url_to_internal_address_is_rejected(url):
+    """
+    测试: 非 http(s) 的地址以及解析到回环、私有、链路本地地址的主机都被拒绝。
+    """
+    with pytest.raises(jobs.CallbackURLError):
+        await jobs.check_callback_url(url)
+
+
+async def test_callback_allow_list(monkeypatch):
+    """
+    测试: 公网地址默认允许；配置了允许列表后只放行列表中的主机（包括内网主机）。
+    """
+    await jobs.check_callback_url("https://93.184.216.34/hook")
+
+    monkeypatch.setattr(settings, "JOB_CALLBACK_ALLOWED_HOSTS", ["10.0.0.5"])
+    await jobs.check_callback_url("http://10.0.0.5/hook")
+    with pytest.raises(jobs.CallbackURLError):
+        await jobs.check_callback_url("https://93.184.216.34/hook")
+
+
+async def test_submit_rejects_internal_callback_url():
+    """
+    测试: 提交时 callback_url 只接受 http(s)，指向内网的任务不会入队。
+    """
+    with pytest.raises(ValidationError):
+        ChatJobRequest(query="你好", session_id="s1", callback_url="file:///etc/passwd")
+
+    db = AsyncMock()
+    request = ChatJobRequest(
+        query="你好", session_id="s1", callback_url="http://127.0.0.1:6379/"
+    )
+    with pytest.raises(jobs.CallbackURLError):
+        await JobQueue().submit(request, db)
+    db.commit.assert_not_awaited()
+
+
+async def test_send_callback_rechecks_address():
+    """
+    测试: 推送前再次检查地址，提交后改为解析到内网的回调不会发出。
+    """
+    queue = JobQueue()
+    queue._callback_client = AsyncMock()
+
+    await queue._send_callback(
+        make_job(callback_url="http://127.0.0.1/hook"), "succeeded", None, None
+    )
+
+    queue._callback_client.post.assert_not_awaited()
+
+
+async def test_send_callback_connects_to_checked_address(monkeypatch):
+    """
+    测试: 推送连接检查通过的 IP，Host 头与 SNI 保持原主机名；重试不会重新解析域名。
+    """
+    monkeypatch.setattr(settings, "JOB_CALLBACK_MAX_RETRIES", 1)
+    monkeypatch.setattr(jobs.asyncio, "sleep", AsyncMock())
+    check = AsyncMock(return_value="93.184.216.34")
+    monkeypatch.setattr(jobs, "check_callback_url", check)
+    queue = JobQueue()
+    queue._callback_client = AsyncMock()
+    queue._callback_client.post.return_value = SimpleNamespace(status_code=503)
+
+    await queue._send_callback(
+        make_job(callback_url="https://callback.example:8443/hook"),
+        "succeeded",
+        None,
+        None,
+    )
+
+    check.assert_awaited_once()
+    assert queue._callback_client.post.await_count == 2
+    call = queue._callback_client.post.await_args
+    assert str(call.args[0]) == "https://93.184.216.34:8443/hook"
+    assert call.kwargs["headers"] == {"Host": "callback.example:8443"}
+    assert call.kwargs["extensions"] == {"sni_hostname": "callback.example"}
+
+
+# --- END OF FILE tests/test_jobs.py ---
@@ -0,0 +1,232 @@
+# --- START OF FILE tests/test_llm_service.py ---
+
+import asyncio
+
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+from openai.types.chat import ChatCompletionMessage
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_usage_var, new_llm_usage
+from py_ai_core.core.state_backend import InMemoryStateBackend
+from py_ai_core.services.llm_service import LLMService
+from py_ai_core.services.provider_pool import Provider, ProviderPool
+from py_ai_core.services.response_cache import ResponseCache
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+def make_chunk(content=None, tool_calls=None):
+    """构造一个与 ChatCompletionChunk 结构一致的假数据块。"""
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def make_tool_call_delta(index, id=None, name=None, arguments=None):
+    function = SimpleNamespace(name=name, arguments=arguments)
+    return SimpleNamespace(index=index, id=id, function=function)
+
+
+async def fake_stream(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.fixture
+def service():
+    """提供一个客户端被 mock 掉的 LLMService 实例"""
+    llm = LLMService()
+    llm.pool = ProviderPool([Provider("mock", AsyncMock(), "m")])
+    return llm
+
+
+async def test_stream_model_decision_yields_deltas_and_message(service: LLMService):
+    """
+    测试: 文本增量被逐个产出，结束时产出拼装好的完整消息。
+    """
+    service.pool.primary.client.chat.completions.create.return_value = fake_stream(
+        [make_chunk("你"), make_chunk("好"), make_chunk()]
+    )
+
+    events = [e async for e in service.stream_model_decision([], None)]
+
+    assert [e["content"] for e in events if e["type"] == "delta"] == ["你", "好"]
+    assert events[-1]["type"] == "message"
+    assert events[-1]["message"].content == "你好"
+    assert events[-1]["message"].tool_calls is None
+    # 不带工具时不应把 tools 参数发给上游
+    assert (
+        "tools"
+        not in service.pool.primary.client.chat.completions.create.call_args.kwargs
+    )
+
+
+async def test_stream_model_decision_assembles_tool_call_fragments(
+    service: LLMService,
+):
+    """
+    测试: 分片到达的工具调用参数能被正确拼接。
+    """
+    service.pool.primary.client.chat.completions.create.return_value = fake_stream(
+        [
+            make_chunk(tool_calls=[make_tool_call_delta(0, "call_1", "calculate")]),
+            make_chunk(tool_calls=[make_tool_call_delta(0, arguments='{"expres')]),
+            make_chunk(tool_calls=[make_tool_call_delta(0, arguments='sion": "1+1"}')]),
+        ]
+    )
+
+    events = [
+        e async for e in service.stream_model_decision([], [{"type": "function"}])
+    ]
+
+    message = events[-1]["message"]
+    assert len(events) == 1
+    assert message.tool_calls[0].id == "call_1"
+    assert message.tool_calls[0].function.name == "calculate"
+    assert message.tool_calls[0].function.arguments == '{"expression": "1+1"}'
+
+
+async def test_get_model_decision_served_from_cache(service: LLMService, monkeypatch):
+    """
+    测试: 开启响应缓存后，相同的决策请求只调用一次上游。
+    """
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    service.cache = ResponseCache(state=InMemoryStateBackend())
+    service.pool.primary.client.chat.completions.create.return_value = SimpleNamespace(
+        usage=None,
+        choices=[
+            SimpleNamespace(
+                message=ChatCompletionMessage(role="assistant", content="你好")
+            )
+        ],
+    )
+    messages = [{"role": "user", "content": "你好"}]
+
+    first = await service.get_model_decision(messages, [])
+    second = await service.get_model_decision(messages, [])
+
+    assert first.content == second.content == "你好"
+    service.pool.primary.client.chat.completions.create.assert_awaited_once()
+
+
+async def test_get_model_decision_without_tools_omits_tool_params(
+    service: LLMService,
+):
+    """
+    测试: 工具筛选结果为空时不把空的 tools 列表与 tool_choice 发给上游（上游会返回 400）。
+    """
+    create = service.pool.primary.client.chat.completions.create
+    create.return_value = SimpleNamespace(
+        usage=None,
+        choices=[
+            SimpleNamespace(
+                message=ChatCompletionMessage(role="assistant", content="你好")
+            )
+        ],
+    )
+
+    message = await service.get_model_decision([{"role": "user", "content": "嗨"}], [])
+
+    assert message.content == "你好"
+    assert "tools" not in create.call_args.kwargs
+    assert "tool_choice" not in create.call_args.kwargs
+
+
+async def test_usage_is_accumulated_per_request(service: LLMService):
+    """
+    测试: 每次上游调用的用量（含命中提示词缓存的部分）累加到当前请求的用量记录。
+    """
+    service.pool.primary.client.chat.completions.create.return_value = SimpleNamespace(
+        usage=SimpleNamespace(
+            prompt_tokens=100,
+            completion_tokens=20,
+            total_tokens=120,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=64),
+        ),
+        choices=[
+            SimpleNamespace(
+                message=ChatCompletionMessage(role="assistant", content="你好")
+            )
+        ],
+    )
+    usage = new_llm_usage()
+    llm_usage_var.set(usage)
+
+    await service.get_model_decision([{"role": "user", "content": "一"}], [])
+    await service.get_model_decision([{"role": "user", "content": "二"}], [])
+
+    assert usage["llm_calls"] == 2
+    assert usage["prompt_tokens"] == 200
+    assert usage["cached_tokens"] == 128
+    assert usage["total_tokens"] == 240
+
+
+async def test_coalesced_callers_each_record_usage(service: LLMService, monkeypatch):
+    """
+    测试: 合并的相同请求只调用一次上游；每个调用方都在自己的用量记录里看到 token 数，
+    但只有 leader 计入调用次数与计费用的 token 数。
+    """
+    monkeypatch.setattr(settings, "LLM_SINGLE_FLIGHT_ENABLED", True)
+
+    async def slow_create(**kwargs):
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(
+            usage=SimpleNamespace(
+                prompt_tokens=100,
+                completion_tokens=20,
+                total_tokens=120,
+                prompt_tokens_details=None,
+            ),
+            choices=[
+                SimpleNamespace(
+                    message=ChatCompletionMessage(role="assistant", content="你好")
+                )
+            ],
+        )
+
+    create = service.pool.primary.client.chat.completions.create
+    create.side_effect = slow_create
+    messages = [{"role": "user", "content": "你好"}]
+
+    async def one_request():
+        usage = new_llm_usage()
+        llm_usage_var.set(usage)
+        await service.get_model_decision(messages, [])
+        return usage
+
+    leader, follower = await asyncio.gather(one_request(), one_request())
+
+    create.assert_awaited_once()
+    assert leader["llm_calls"] == 1
+    assert leader["prompt_tokens"] == 100
+    assert follower["llm_calls"] == 0
+    assert follower["prompt_tokens"] == 0
+    assert follower["coalesced_calls"] == 1
+    assert leader["total_tokens"] == follower["total_tokens"] == 120
+
+
+async def test_embedding_goes_through_pool_and_records_usage(service: LLMService):
+    """
+    测试: 向量化请求经提供方池发起，用量计入当前请求，但不计入提供方的延迟统计。
+    """
+    embeddings = service.pool.primary.client.embeddings.create
+    embeddings.return_value = SimpleNamespace(
+        usage=SimpleNamespace(prompt_tokens=8, total_tokens=8),
+        data=[SimpleNamespace(embedding=[0.1, 0.2])],
+    )
+    usage = new_llm_usage()
+    llm_usage_var.set(usage)
+
+    assert await service.get_embedding("怎么退款？") == [0.1, 0.2]
+
+    assert embeddings.call_args.kwargs["input"] == "怎么退款？"
+    assert usage["llm_calls"] == 1
+    assert usage["prompt_tokens"] == 8
+    assert service.pool.primary.total_calls == 1
+    assert service.pool.primary.ewma_latency is None
+
+
+# --- END OF FILE tests/test_llm_service.py ---
@@ -4,6 +4,8 @@ from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
 
 from py_ai_core.main import app
+from py_ai_core.core.config import settings
+from py_ai_core.services.concurrency_limiter import UpstreamOverloadedError
 
 client = TestClient(app)
 
@@ -33,24 +35,19 @@ def test_chat_endpoint_requires_session_id():
 # 为了让这个文件里的测试通过，我们也需要 mock 掉 chat 接口的依赖
 # 否则，即使提供了 session_id，它也会尝试真的调用 LLM API
 @patch(
-    "py_ai_core.mcp.router.session_service.get_or_create_session_prompt",
+    "py_ai_core.mcp.router.session_service.get_turn_context",
     new_callable=AsyncMock,
 )
-@patch(
-    "py_ai_core.mcp.router.session_service.get_history",
-    new_callable=AsyncMock,
-    return_value=[],
-)
 @patch("py_ai_core.mcp.router.llm_service.get_model_decision", new_callable=AsyncMock)
 @patch("py_ai_core.mcp.router.session_service.update_history", new_callable=AsyncMock)
 def test_chat_endpoint_with_session_id_smoketest(
-    mock_update, mock_decision, mock_history, mock_prompt
+    mock_update, mock_decision, mock_turn_context
 ):
     """
     冒烟测试: 在提供了 session_id 和所有依赖都被 mock 的情况下，接口能返回 200。
     """
     # 配置 mock 返回值
-    mock_prompt.return_value = "默认提示词"
+    mock_turn_context.return_value = ("默认提示词", [])
     fake_model_message = AsyncMock()
     fake_model_message.content = "模拟回复"
     fake_model_message.tool_calls = None
@@ -64,4 +61,81 @@ def test_chat_endpoint_with_session_id_smoketest(
     assert response.json()["answer"] == "模拟回复"
 
 
+@patch(
+    "py_ai_core.mcp.router.session_service.get_turn_context",
+    new_callable=AsyncMock,
+)
+@patch("py_ai_core.mcp.router.llm_service.get_model_decision", new_callable=AsyncMock)
+def test_chat_endpoint_returns_503_when_upstream_overloaded(
+    mock_decision, mock_turn_context
+):
+    """
+    集成测试: 上游容量已满时快速返回 503，并带上 Retry-After。
+    """
+    mock_turn_context.return_value = ("默认提示词", [])
+    mock_decision.side_effect = UpstreamOverloadedError("队列已满", retry_after=7)
+
+    request_body = {"query": "你好", "session_id": "overloaded-session"}
+    response = client.post("/v1/mcp/chat", json=request_body)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "7"
+
+
+def test_db_pool_stats_endpoint():
+    """
+    集成测试: 连接池状态端点返回按配置初始化的池子参数与计数器。
+    """
+    response = client.get("/health/db-pool")
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["size"] == settings.DB_POOL_SIZE
+    assert stats["max_overflow"] == settings.DB_MAX_OVERFLOW
+    assert stats["checked_out"] == 0
+    assert stats["waiting"] == 0
+
+
+def test_llm_cache_stats_endpoint():
+    """
+    集成测试: 响应缓存统计端点返回命中计数与命中率。
+    """
+    response = client.get("/health/llm-cache")
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["enabled"] == settings.RESPONSE_CACHE_ENABLED
+    assert 0.0 <= stats["hit_ratio"] <= 1.0
+
+
+def test_llm_http_pool_stats_endpoint():
+    """
+    集成测试: 上游 HTTP 连接池状态端点返回按配置初始化的池子参数。
+    """
+    response = client.get("/health/llm-http-pool")
+
+    assert response.status_code == 200
+    stats = response.json()
+    assert stats["http2_enabled"] == settings.LLM_HTTP2
+    assert stats["max_connections"] == settings.LLM_MAX_CONNECTIONS
+    assert stats["connections"] == stats["idle"] + stats["active"]
+
+
+def test_chat_batch_endpoint_rejects_duplicate_custom_ids():
+    """
+    集成测试: 批量端点拒绝 custom_id 重复的批次。
+    """
+    response = client.post(
+        "/v1/mcp/chat/batch",
+        json={
+            "items": [
+                {"query": "1", "session_id": "s", "custom_id": "dup"},
+                {"query": "2", "session_id": "s", "custom_id": "dup"},
+            ]
+        },
+    )
+
+    assert response.status_code == 400
+
+
 # --- END OF FILE tests/test_main_api.py ---
@@ -1,8 +1,11 @@
 # --- START OF FILE tests/test_mcp_router.py ---
 
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import MagicMock, AsyncMock, patch
+from openai.types.chat import ChatCompletionMessage
 
 from py_ai_core.main import app
 
@@ -20,14 +23,9 @@ def auto_mock_services(mocker):
     """
     # Mock 所有 session_service 的方法
     mocker.patch(
-        "py_ai_core.mcp.router.session_service.get_or_create_session_prompt",
+        "py_ai_core.mcp.router.session_service.get_turn_context",
         new_callable=AsyncMock,
-        return_value="默认系统提示词",
-    )
-    mocker.patch(
-        "py_ai_core.mcp.router.session_service.get_history",
-        new_callable=AsyncMock,
-        return_value=[],
+        return_value=("默认系统提示词", []),
     )
     mocker.patch(
         "py_ai_core.mcp.router.session_service.update_history", new_callable=AsyncMock
@@ -128,13 +126,16 @@ def test_chat_endpoint_with_tool_call():
         "content": "北京的天气是晴朗, 25度 celsius.",
     }
 
-    fake_final_summary = "根据工具查询，北京今天天气晴朗，气温是25摄氏度。"
+    fake_final_answer = MagicMock()
+    fake_final_answer.content = "根据工具查询，北京今天天气晴朗，气温是25摄氏度。"
+    fake_final_answer.tool_calls = None
 
     # 2. 配置由 fixture 创建的 mocks
+    #    第一轮模型请求工具，第二轮拿到工具结果后直接给出回答
     with patch(
         "py_ai_core.mcp.router.llm_service.get_model_decision",
         new_callable=AsyncMock,
-        return_value=fake_model_decision_message,
+        side_effect=[fake_model_decision_message, fake_final_answer],
     ) as mock_get_decision, patch(
         "py_ai_core.mcp.router.execute_tool",
         new_callable=AsyncMock,
@@ -142,7 +143,6 @@ def test_chat_endpoint_with_tool_call():
     ) as mock_execute_tool, patch(
         "py_ai_core.mcp.router.llm_service.get_summary_from_tool_results",
         new_callable=AsyncMock,
-        return_value=fake_final_summary,
     ) as mock_get_summary, patch(
         "py_ai_core.mcp.router.session_service.update_history", new_callable=AsyncMock
     ) as mock_update_history:
@@ -156,17 +156,201 @@ def test_chat_endpoint_with_tool_call():
         # === 断言 (Assert) ===
         assert response.status_code == 200
         response_json = response.json()
-        assert response_json["answer"] == fake_final_summary
+        assert response_json["answer"] == fake_final_answer.content
         assert response_json["session_id"] == "test-session-tool"
 
         # 验证所有关键函数都被正确调用
-        mock_get_decision.assert_awaited_once()
+        assert mock_get_decision.await_count == 2
         mock_execute_tool.assert_awaited_once()
-        mock_get_summary.assert_awaited_once()
+        # 模型已直接给出回答，不应再发起额外的总结调用
+        mock_get_summary.assert_not_awaited()
         mock_update_history.assert_awaited_once()
 
         # 验证 execute_tool 的调用参数
         mock_execute_tool.assert_awaited_with(fake_tool_call, "test-session-tool")
 
+        # 第二轮决策的上下文里应包含第一轮的工具结果
+        second_round_messages = mock_get_decision.await_args_list[1].args[0]
+        assert second_round_messages[-1] == fake_tool_result
+
+        saved_messages = mock_update_history.await_args.args[1]
+        assert [m["role"] for m in saved_messages] == [
+            "user",
+            "assistant",
+            "tool",
+            "assistant",
+        ]
+
+
+def test_chat_endpoint_forces_summary_after_max_tool_rounds(mocker):
+    """
+    测试: 模型持续请求工具时，达到最大轮数后强制进行一次总结。
+    """
+    fake_tool_call = MagicMock()
+    fake_tool_call.id = "call_loop"
+    fake_tool_call.function.name = "get_current_datetime"
+    fake_tool_call.function.arguments = "{}"
+
+    fake_model_decision_message = MagicMock()
+    fake_model_decision_message.content = None
+    fake_model_decision_message.tool_calls = [fake_tool_call]
+    fake_model_decision_message.model_dump.return_value = {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [],
+    }
+
+    mocker.patch("py_ai_core.mcp.router.settings.MAX_TOOL_ROUNDS", 2)
+    mock_get_decision = mocker.patch(
+        "py_ai_core.mcp.router.llm_service.get_model_decision",
+        new_callable=AsyncMock,
+        return_value=fake_model_decision_message,
+    )
+    mock_execute_tool = mocker.patch(
+        "py_ai_core.mcp.router.execute_tool",
+        new_callable=AsyncMock,
+        return_value={
+            "role": "tool",
+            "tool_call_id": "call_loop",
+            "name": "get_current_datetime",
+            "content": "2024-01-01 00:00:00",
+        },
+    )
+    mock_get_summary = mocker.patch(
+        "py_ai_core.mcp.router.llm_service.get_summary_from_tool_results",
+        new_callable=AsyncMock,
+        return_value="现在是2024年1月1日。",
+    )
+
+    response = client.post(
+        "/v1/mcp/chat", json={"query": "现在几点？", "session_id": "test-session-loop"}
+    )
+
+    assert response.status_code == 200
+    assert response.json()["answer"] == "现在是2024年1月1日。"
+    assert mock_get_decision.await_count == 2
+    assert mock_execute_tool.await_count == 2
+    mock_get_summary.assert_awaited_once()
+
+
+def _parse_sse(body: str):
+    """把 SSE 响应体解析为 (event, data) 列表。"""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        lines = frame.split("\n")
+        event = lines[0].removeprefix("event: ")
+        data = json.loads(lines[1].removeprefix("data: "))
+        events.append((event, data))
+    return events
+
+
+def test_chat_stream_endpoint_with_tool_call():
+    """
+    测试: 流式端点能按顺序推送增量、工具调用事件，并在结束后保存历史。
+    """
+    # === 准备 (Arrange) ===
+    decision_message = ChatCompletionMessage.model_validate(
+        {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [
+                {
+                    "id": "call_123",
+                    "type": "function",
+                    "function": {
+                        "name": "get_current_weather",
+                        "arguments": '{"city": "北京"}',
+                    },
+                }
+            ],
+        }
+    )
+    final_message = ChatCompletionMessage(role="assistant", content="北京晴。")
+
+    async def fake_stream(messages, tool_schemas=None):
+        # 第一轮请求工具；拿到工具结果后，第二轮直接流式输出回答
+        if messages[-1]["role"] != "tool":
+            yield {"type": "message", "message": decision_message}
+        else:
+            yield {"type": "delta", "content": "北京"}
+            yield {"type": "delta", "content": "晴。"}
+            yield {"type": "message", "message": final_message}
+
+    fake_tool_result = {
+        "role": "tool",
+        "tool_call_id": "call_123",
+        "name": "get_current_weather",
+        "content": "北京的天气是晴朗, 25度 celsius.",
+    }
+
+    with patch(
+        "py_ai_core.mcp.router.llm_service.stream_model_decision",
+        new=fake_stream,
+    ), patch(
+        "py_ai_core.mcp.router.execute_tool",
+        new_callable=AsyncMock,
+        return_value=fake_tool_result,
+    ), patch(
+        "py_ai_core.mcp.router.session_service.update_history", new_callable=AsyncMock
+    ) as mock_update_history:
+
+        # === 执行 (Act) ===
+        response = client.post(
+            "/v1/mcp/chat/stream",
+            json={"query": "北京天气怎么样？", "session_id": "test-session-stream"},
+        )
+
+        # === 断言 (Assert) ===
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = _parse_sse(response.text)
+        assert [name for name, _ in events] == [
+            "start",
+            "tool_call_start",
+            "tool_call_end",
+            "delta",
+            "delta",
+            "done",
+        ]
+        assert events[1][1]["name"] == "get_current_weather"
+        assert events[-1][1]["answer"] == "北京晴。"
+
+        mock_update_history.assert_awaited_once()
+        saved_messages = mock_update_history.await_args.args[1]
+        assert [m["role"] for m in saved_messages] == [
+            "user",
+            "assistant",
+            "tool",
+            "assistant",
+        ]
+
+
+def test_chat_stream_endpoint_honors_use_cache():
+    """
+    测试: 流式端点与非流式端点一样，use_cache=False 时模型调用跳过缓存。
+    """
+    from py_ai_core.core.context import llm_cache_bypass_var
+
+    seen = []
+
+    async def fake_stream(messages, tool_schemas=None):
+        seen.append(llm_cache_bypass_var.get())
+        yield {
+            "type": "message",
+            "message": ChatCompletionMessage(role="assistant", content="你好。"),
+        }
+
+    with patch(
+        "py_ai_core.mcp.router.llm_service.stream_model_decision",
+        new=fake_stream,
+    ):
+        response = client.post(
+            "/v1/mcp/chat/stream",
+            json={"query": "你好", "session_id": "stream-nocache", "use_cache": False},
+        )
+
+    assert [name for name, _ in _parse_sse(response.text)][-1] == "done"
+    assert seen == [True]
+
 
 # --- END OF FILE tests/test_mcp_router.py ---
@@ -0,0 +1,188 @@
+# --- START OF FILE tests/test_provider_pool.py ---
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.services.provider_pool import Provider, ProviderPool
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+def make_provider(name, ewma=None):
+    provider = Provider(name, client=None, model=f"{name}-model")
+    provider.ewma_latency = ewma
+    return provider
+
+
+def make_call(behaviours):
+    """按提供方名字返回结果、抛出异常或等待一段时间后返回的调用函数"""
+    calls = []
+
+    async def call(provider):
+        calls.append(provider.name)
+        behaviour = behaviours[provider.name]
+        if isinstance(behaviour, Exception):
+            raise behaviour
+        if isinstance(behaviour, tuple):
+            delay, result = behaviour
+            await asyncio.sleep(delay)
+            return result
+        return behaviour
+
+    return call, calls
+
+
+async def test_fails_over_to_next_provider():
+    """
+    测试: 首选提供方失败时改用下一个，并记录失败。
+    """
+    a, b = make_provider("a"), make_provider("b")
+    pool = ProviderPool([a, b], policy="fallback")
+    call, calls = make_call({"a": RuntimeError("连接失败"), "b": "ok"})
+
+    assert await pool.call(call) == "ok"
+    assert calls == ["a", "b"]
+    assert a.consecutive_failures == 1
+    assert b.total_calls == 1
+
+
+async def test_bad_request_is_not_retried():
+    """
+    测试: 请求本身有问题（400）时不换提供方重试，也不计入熔断。
+    """
+    a, b = make_provider("a"), make_provider("b")
+    pool = ProviderPool([a, b], policy="fallback")
+    error = openai.BadRequestError(
+        "上下文超长",
+        response=httpx.Response(400, request=httpx.Request("POST", "http://x")),
+        body=None,
+    )
+    call, calls = make_call({"a": error, "b": "ok"})
+
+    with pytest.raises(openai.BadRequestError):
+        await pool.call(call)
+    assert calls == ["a"]
+    assert a.consecutive_failures == 0
+
+
+async def test_total_timeout_fails_over(monkeypatch):
+    """
+    测试: 单次调用超过总超时后按过载处理，改用下一个提供方。
+    """
+    monkeypatch.setattr(settings, "LLM_TOTAL_TIMEOUT_SECONDS", 0.05)
+    a, b = make_provider("a"), make_provider("b")
+    pool = ProviderPool([a, b], policy="fallback")
+    call, calls = make_call({"a": (1, "slow"), "b": "ok"})
+
+    assert await pool.call(call) == "ok"
+    assert calls == ["a", "b"]
+    assert a.consecutive_failures == 1
+
+
+async def test_circuit_breaker_skips_failing_provider(monkeypatch):
+    """
+    测试: 连续失败达到阈值后熔断，之后的请求直接发往其他提供方。
+    """
+    monkeypatch.setattr(settings, "LLM_BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(settings, "LLM_BREAKER_RESET_SECONDS", 60)
+    a, b = make_provider("a"), make_provider("b")
+    pool = ProviderPool([a, b], policy="fallback")
+    call, calls = make_call({"a": RuntimeError("超时"), "b": "ok"})
+
+    for _ in range(3):
+        await pool.call(call)
+
+    assert calls == ["a", "b", "a", "b", "b"]
+    assert a.state == "open"
+
+
+async def test_lowest_latency_policy_prefers_fastest():
+    """
+    测试: lowest_latency 策略优先选择 EWMA 延迟最低的提供方。
+    """
+    slow, fast = make_provider("slow", ewma=2.0), make_provider("fast", ewma=0.3)
+    pool = ProviderPool([slow, fast], policy="lowest_latency")
+    call, calls = make_call({"slow": "slow", "fast": "fast"})
+
+    assert await pool.call(call) == "fast"
+    assert calls == ["fast"]
+
+
+async def test_hedged_request_takes_faster_backup(monkeypatch):
+    """
+    测试: 首个请求超过对冲延迟未返回时，向备用提供方发出对冲请求，采用先返回的结果。
+    """
+    monkeypatch.setattr(settings, "LLM_HEDGE_MIN_DELAY_SECONDS", 0.01)
+    a, b = make_provider("a"), make_provider("b")
+    pool = ProviderPool([a, b], policy="fallback")
+    call, calls = make_call({"a": (5, "slow"), "b": (0, "fast")})
+
+    result = await asyncio.wait_for(pool.call(call, hedge=True), 1)
+
+    assert result == "fast"
+    assert calls == ["a", "b"]
+    assert pool.total_hedges == 1
+    # 落败的请求被取消，不计入失败
+    assert a.consecutive_failures == 0
+
+
+async def test_call_can_skip_latency_stats():
+    """
+    测试: 流式、向量化等调用不计入提供方的延迟统计，但仍记为成功。
+    """
+    a = make_provider("a")
+    pool = ProviderPool([a])
+    call, _ = make_call({"a": (0.01, "stream")})
+
+    assert await pool.call(call, record_latency=False) == "stream"
+    assert a.ewma_latency is None
+    assert a.total_calls == 1
+    assert a.limiter.limit > settings.LLM_CONCURRENCY_INITIAL
+
+    await pool.call(call)
+    assert a.ewma_latency is not None
+
+
+async def test_rate_limited_call_is_retried_after_retry_after(monkeypatch):
+    """
+    测试: 所有提供方都返回 429 时整体重试，等待时间不少于上游给出的 retry-after，
+    并且提供方的并发上限被减半。
+    """
+    monkeypatch.setattr(settings, "LLM_MAX_RETRIES", 1)
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    a = make_provider("a")
+    limit_before = a.limiter.limit
+    pool = ProviderPool([a], policy="fallback")
+    rate_limited = openai.RateLimitError(
+        "请求过多",
+        response=httpx.Response(
+            429,
+            headers={"retry-after": "2"},
+            request=httpx.Request("POST", "http://x"),
+        ),
+        body=None,
+    )
+    outcomes = [rate_limited, "ok"]
+
+    async def call(provider):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert await pool.call(call) == "ok"
+    assert len(sleeps) == 1 and sleeps[0] >= 2
+    assert a.limiter.limit < limit_before
+
+
+# --- END OF FILE tests/test_provider_pool.py ---
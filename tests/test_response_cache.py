@@ -0,0 +1,118 @@
+# --- START OF FILE tests/test_response_cache.py ---
+
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.core.context import llm_cache_bypass_var
+from py_ai_core.core.state_backend import InMemoryStateBackend
+from py_ai_core.services.response_cache import ResponseCache, VectorIndex
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+SYSTEM = {"role": "system", "content": "你是客服"}
+
+
+@pytest.fixture(autouse=True)
+def enable_cache(monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+
+
+async def test_exact_hit_after_store():
+    """
+    测试: 相同请求第二次命中精确层；消息或工具不同则未命中。
+    """
+    cache = ResponseCache(state=InMemoryStateBackend())
+    messages = [SYSTEM, {"role": "user", "content": "怎么退款？"}]
+
+    first = await cache.lookup("decision", "m", messages, [])
+    assert first.value is None
+    await cache.store(first, {"role": "assistant", "content": "在订单页申请"})
+
+    hit = await cache.lookup("decision", "m", [dict(m) for m in messages], [])
+    other = await cache.lookup("decision", "m", messages, [{"type": "function"}])
+
+    assert hit.value == {"role": "assistant", "content": "在订单页申请"}
+    assert other.value is None
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1
+    assert stats["misses"] == 2
+
+
+async def test_bypass_skips_cache():
+    """
+    测试: 请求选择跳过缓存时既不读也不写。
+    """
+    cache = ResponseCache(state=InMemoryStateBackend())
+    token = llm_cache_bypass_var.set(True)
+    try:
+        assert await cache.lookup("summary", "m", [SYSTEM]) is None
+    finally:
+        llm_cache_bypass_var.reset(token)
+    assert cache.stats()["bypassed"] == 1
+
+
+async def test_semantic_hit_for_similar_question(monkeypatch):
+    """
+    测试: 语义层对向量足够相近的单轮提问复用已缓存的响应。
+    """
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SEMANTIC_ENABLED", True)
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_SEMANTIC_THRESHOLD", 0.9)
+    vectors = {
+        "怎么退款？": [1.0, 0.0, 0.1],
+        "如何退款": [0.98, 0.0, 0.12],
+        "今天天气": [0.0, 1.0, 0.0],
+    }
+
+    async def embed(text):
+        return vectors[text]
+
+    cache = ResponseCache(embed=embed, state=InMemoryStateBackend())
+    miss = await cache.lookup(
+        "decision", "m", [SYSTEM, {"role": "user", "content": "怎么退款？"}]
+    )
+    await cache.store(miss, {"role": "assistant", "content": "在订单页申请"})
+
+    similar = await cache.lookup(
+        "decision", "m", [SYSTEM, {"role": "user", "content": "如何退款"}]
+    )
+    unrelated = await cache.lookup(
+        "decision", "m", [SYSTEM, {"role": "user", "content": "今天天气"}]
+    )
+
+    assert similar.value == {"role": "assistant", "content": "在订单页申请"}
+    assert unrelated.value is None
+    assert cache.stats()["semantic_hits"] == 1
+
+    # 精确命中时不再计算向量
+    embedded = []
+
+    async def counting_embed(text):
+        embedded.append(text)
+        return vectors[text]
+
+    cache._embed = counting_embed
+    exact = await cache.lookup(
+        "decision", "m", [SYSTEM, {"role": "user", "content": "怎么退款？"}]
+    )
+    assert exact.value == {"role": "assistant", "content": "在订单页申请"}
+    assert embedded == []
+
+
+async def test_vector_index_evicts_least_recently_used():
+    """
+    测试: 向量索引超出容量时淘汰最久未使用的条目。
+    """
+    index = VectorIndex(maxsize=2)
+    index.add("p", "a", [1.0, 0.0])
+    index.add("p", "b", [0.0, 1.0])
+    assert index.search("p", [1.0, 0.0], 0.9) == "a"
+
+    index.add("p", "c", [0.7, 0.7])
+
+    assert len(index) == 2
+    assert index.search("p", [0.0, 1.0], 0.99) is None
+    assert index.search("p", [1.0, 0.0], 0.99) == "a"
+
+
+# --- END OF FILE tests/test_response_cache.py ---
@@ -2,12 +2,14 @@
 
 import pytest
 import json
+from types import SimpleNamespace
 from unittest.mock import MagicMock, AsyncMock
 
 # 导入我们要测试的类和它依赖的模型
-from py_ai_core.services.session_service import SessionService
-from py_ai_core.models.db_models import ChatMessage, ChatSession
+from py_ai_core.services.session_service import SessionService, _select_window
+from py_ai_core.models.db_models import ChatMessage
 from py_ai_core.core.config import settings
+from py_ai_core.core.state_backend import InMemoryStateBackend
 
 # 标记所有测试为异步
 pytestmark = pytest.mark.asyncio
@@ -15,8 +17,8 @@ pytestmark = pytest.mark.asyncio
 
 @pytest.fixture
 def service():
-    """提供一个干净的 SessionService 实例"""
-    return SessionService()
+    """提供一个干净的 SessionService 实例（带独立的进程内缓存）"""
+    return SessionService(state=InMemoryStateBackend())
 
 
 def create_mock_db_session():
@@ -28,105 +30,62 @@ def create_mock_db_session():
     return mock_db
 
 
-async def test_get_history_with_smart_truncation(service: SessionService):
+async def test_turn_context_fills_token_budget(service: SessionService, monkeypatch):
     """
-    测试: 智能滑动窗口能否在切断工具链时正确地回溯和补充历史。
+    测试: 历史窗口按 token 预算截取，并保留完整的工具调用链。
     """
     # === 准备 (Arrange) ===
     fake_db_result_desc = [
-        MagicMock(
-            spec=ChatMessage,
-            id=5,
-            content=json.dumps({"role": "assistant", "content": "总结"}),
-        ),
-        MagicMock(
-            spec=ChatMessage,
-            id=4,
-            content=json.dumps({"role": "tool", "name": "t", "content": "res"}),
-        ),
-        MagicMock(
-            spec=ChatMessage,
-            id=3,
-            content=json.dumps({"role": "assistant", "tool_calls": []}),
-        ),
-        MagicMock(
-            spec=ChatMessage,
-            id=2,
-            content=json.dumps({"role": "user", "content": "问题"}),
-        ),
-        MagicMock(
-            spec=ChatMessage,
-            id=1,
-            content=json.dumps({"role": "assistant", "content": "你好"}),
-        ),
+        (5, {"role": "assistant", "content": "总结"}),
+        (4, {"role": "tool", "name": "t", "content": "res"}),
+        (3, {"role": "assistant", "tool_calls": []}),
+        (2, {"role": "user", "content": "问题"}),
+        (1, {"role": "assistant", "content": "你好"}),
     ]
 
     mock_result = MagicMock()
-    mock_result.scalars.return_value.all.return_value = fake_db_result_desc
+    mock_result.all.return_value = [
+        SimpleNamespace(
+            system_prompt=None,
+            last_seq=5,
+            summary=None,
+            summary_seq=0,
+            id=id,
+            role=message["role"],
+            content=message,
+            token_count=10,
+        )
+        for id, message in fake_db_result_desc
+    ]
     mock_db_session = create_mock_db_session()  # <-- 使用新的辅助函数
     mock_db_session.execute.return_value = mock_result
 
-    # 假设窗口大小为3
-    original_max_history = settings.MAX_HISTORY_MESSAGES
-    settings.MAX_HISTORY_MESSAGES = 3
+    # 预算只够最近 4 条消息
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET", 45)
 
     # === 执行 (Act) ===
-    history = await service.get_history("test-session", mock_db_session)
+    _, history = await service.get_turn_context("test-session", mock_db_session)
 
     # === 断言 (Assert) ===
     assert len(history) == 4
     assert history[0]["role"] == "user"
     assert history[0]["content"] == "问题"
 
-    # 恢复原始设置
-    settings.MAX_HISTORY_MESSAGES = original_max_history
-
-
-async def test_get_or_create_session_prompt_creates_new_session(
-    service: SessionService,
-):
-    """
-    测试: 当 session 不存在时，能否创建新 session 并返回默认 prompt。
-    """
-    # 准备:
-    mock_session_result = MagicMock()
-    mock_session_result.scalars.return_value.first.return_value = None
-    mock_db = create_mock_db_session()  # <-- 使用新的辅助函数
-    mock_db.execute.return_value = mock_session_result
-
-    # 执行
-    prompt = await service.get_or_create_session_prompt("new-session", mock_db)
 
-    # 断言
-    assert prompt == settings.DEFAULT_SYSTEM_PROMPT
-    mock_db.add.assert_called_once()
-    mock_db.commit.assert_awaited_once()
-
-
-async def test_get_or_create_session_prompt_updates_existing(service: SessionService):
+async def test_select_window_drops_partial_tool_chain():
     """
-    测试: 当提供了新的 prompt 时，能否更新现有 session。
+    测试: 预算在工具调用链中间截断时，窗口收缩到链之后，不留下孤立的工具结果。
     """
-    # 准备:
-    existing_session = ChatSession(
-        session_id="existing-session", system_prompt="旧的提示词"
-    )
-    mock_session_result = MagicMock()
-    mock_session_result.scalars.return_value.first.return_value = existing_session
-    mock_db = create_mock_db_session()  # <-- 使用新的辅助函数
-    mock_db.execute.return_value = mock_session_result
-
-    new_prompt = "这是新的海盗提示词！"
+    buffer = [
+        {"role": "user", "content": "问题"},
+        {"role": "assistant", "tool_calls": []},
+        {"role": "tool", "name": "t", "content": "res"},
+        {"role": "assistant", "content": "总结"},
+    ]
 
-    # 执行
-    prompt = await service.get_or_create_session_prompt(
-        "existing-session", mock_db, requested_prompt=new_prompt
-    )
+    window = _select_window(buffer, [10, 10, 10, 10], budget=25)
 
-    # 断言
-    assert prompt == new_prompt
-    assert existing_session.system_prompt == new_prompt
-    mock_db.commit.assert_awaited_once()
+    assert window == [{"role": "assistant", "content": "总结"}]
 
 
 async def test_update_history(service: SessionService):
@@ -134,6 +93,10 @@ async def test_update_history(service: SessionService):
     测试: update_history 方法能否正确地添加新消息并提交到数据库。
     """
     mock_db_session = create_mock_db_session()  # <-- 使用新的辅助函数
+    # 会话 upsert 返回分配后的 last_seq，会话里此前已有 3 条消息
+    mock_db_session.execute.return_value = MagicMock(
+        all=MagicMock(return_value=[("test-session-update", 5)])
+    )
 
     session_id = "test-session-update"
     new_messages = [
@@ -145,6 +108,8 @@ async def test_update_history(service: SessionService):
         session_id=session_id, new_messages=new_messages, db=mock_db_session
     )
 
+    # 会话 upsert 与消息插入在同一个事务里，只提交一次
+    mock_db_session.execute.assert_awaited_once()
     mock_db_session.add_all.assert_called_once()
     mock_db_session.commit.assert_awaited_once()
 
@@ -156,7 +121,252 @@ async def test_update_history(service: SessionService):
     assert isinstance(first_message, ChatMessage)
     assert first_message.session_id == session_id
     assert first_message.role == "user"
-    assert json.loads(first_message.content)["content"] == "新问题"
+    assert first_message.content["content"] == "新问题"
+    assert [m.seq for m in added_objects] == [4, 5]
+    # token 数在写入时计算并随消息保存
+    assert all(m.token_count > 0 for m in added_objects)
+
+
+async def test_update_history_rolls_up_usage_in_same_transaction(
+    service: SessionService,
+):
+    """
+    测试: 传入本轮用量时，用量汇总的 upsert 与消息写入在同一个事务里提交。
+    """
+    mock_db_session = create_mock_db_session()
+    mock_db_session.execute.return_value = MagicMock(
+        all=MagicMock(return_value=[("usage-session", 1)])
+    )
+    usage = {"llm_calls": 2, "prompt_tokens": 300, "completion_tokens": 40}
+
+    await service.update_history(
+        "usage-session",
+        [{"role": "user", "content": "你好"}],
+        mock_db_session,
+        usage=usage,
+    )
+
+    assert mock_db_session.execute.await_count == 2
+    mock_db_session.commit.assert_awaited_once()
+    rollup = mock_db_session.execute.await_args_list[1].args[0]
+    assert rollup.table.name == "llm_usage_rollups"
+
+
+async def test_hot_session_cache_serves_repeat_turns_without_db(
+    service: SessionService,
+):
+    """
+    测试: 首次读取后，提示词和历史都从热缓存提供；写入后按数据库分配的序号追加到缓存。
+    """
+    # 准备: 第一次查询返回一个已有会话和一条历史消息
+    first_turn = MagicMock()
+    first_turn.all.return_value = [
+        SimpleNamespace(
+            system_prompt="提示词",
+            last_seq=1,
+            summary=None,
+            summary_seq=0,
+            id=1,
+            role="user",
+            content={"role": "user", "content": "你好"},
+            token_count=5,
+        )
+    ]
+    mock_db = create_mock_db_session()
+    mock_db.execute.side_effect = [
+        first_turn,
+        # 会话 upsert 返回 (session_id, last_seq)
+        MagicMock(all=MagicMock(return_value=[("hot-session", 2)])),
+    ]
+
+    # 第一轮: 冷启动，访问数据库
+    prompt, history = await service.get_turn_context("hot-session", mock_db)
+    assert prompt == "提示词"
+    assert len(history) == 1
+    await service.update_history(
+        "hot-session", [{"role": "assistant", "content": "你好呀"}], mock_db
+    )
+    reads_and_writes = mock_db.execute.await_count
+
+    # 第二轮: 稳态，不再读取数据库
+    prompt, history = await service.get_turn_context("hot-session", mock_db)
+
+    assert prompt == "提示词"
+    assert [m["content"] for m in history] == ["你好", "你好呀"]
+    assert mock_db.execute.await_count == reads_and_writes
+    assert (await service._get_cached("hot-session"))["last_seq"] == 2
+
+
+async def test_cache_entry_is_invalidated_when_seq_does_not_line_up(
+    service: SessionService,
+):
+    """
+    测试: 数据库分配的序号与缓存的 last_seq 不衔接（期间有其他写入）时，
+    不在缓存上追加，而是让条目失效。
+    """
+    await service._update_cached(
+        "racy-session",
+        system_prompt="提示词",
+        messages=[{"role": "user", "content": "你好"}],
+        token_counts=[5],
+        last_seq=1,
+    )
+    mock_db = create_mock_db_session()
+    # 另一个进程已经写入了序号 2-3，本次写入分到的是序号 4
+    mock_db.execute.return_value = MagicMock(
+        all=MagicMock(return_value=[("racy-session", 4)])
+    )
+
+    await service.update_history(
+        "racy-session", [{"role": "assistant", "content": "你好呀"}], mock_db
+    )
+
+    assert await service._get_cached("racy-session") is None
+
+
+async def test_get_turn_context_reads_prompt_and_history_in_one_query(
+    service: SessionService,
+):
+    """
+    测试: 快速路径用一次查询同时取回提示词和历史，之后的轮次命中缓存。
+    """
+    # 准备: 倒序返回的联表结果，每行都带着会话的提示词
+    rows = [
+        SimpleNamespace(
+            system_prompt="提示词",
+            last_seq=2,
+            summary=None,
+            summary_seq=0,
+            id=2,
+            role="assistant",
+            content={"role": "assistant", "content": "你好呀"},
+            token_count=6,
+        ),
+        SimpleNamespace(
+            system_prompt="提示词",
+            last_seq=2,
+            summary=None,
+            summary_seq=0,
+            id=1,
+            role="user",
+            # 迁移前写入的旧数据仍是 JSON 字符串，也应能被正确解析
+            content=json.dumps({"role": "user", "content": "你好"}),
+            token_count=None,
+        ),
+    ]
+    mock_result = MagicMock()
+    mock_result.all.return_value = rows
+    mock_db = create_mock_db_session()
+    mock_db.execute.return_value = mock_result
+
+    # 执行
+    prompt, history = await service.get_turn_context("turn-session", mock_db)
+    prompt_again, history_again = await service.get_turn_context(
+        "turn-session", mock_db, requested_prompt="新的提示词"
+    )
+
+    # 断言: 只查询了一次，且没有任何写操作
+    assert prompt == "提示词"
+    assert [m["content"] for m in history] == ["你好", "你好呀"]
+    assert prompt_again == "新的提示词"
+    assert history_again == history
+    mock_db.execute.assert_awaited_once()
+    mock_db.commit.assert_not_awaited()
+
+
+async def test_get_turn_context_for_new_session_uses_default_prompt(
+    service: SessionService,
+):
+    """
+    测试: 会话不存在时返回默认提示词和空历史，且不在读取阶段创建会话。
+    """
+    mock_result = MagicMock()
+    mock_result.all.return_value = []
+    mock_db = create_mock_db_session()
+    mock_db.execute.return_value = mock_result
+
+    prompt, history = await service.get_turn_context("brand-new-session", mock_db)
+
+    assert prompt == settings.DEFAULT_SYSTEM_PROMPT
+    assert history == []
+    mock_db.add.assert_not_called()
+    mock_db.commit.assert_not_awaited()
+
+
+async def test_turn_context_uses_summary_and_schedules_refresh(
+    service: SessionService, monkeypatch
+):
+    """
+    测试: 已摘要的消息不再进入窗口，摘要拼接在系统提示词之后；
+    窗口外未摘要的消息足够多时提交后台摘要任务。
+    """
+    monkeypatch.setattr(settings, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(settings, "SUMMARY_TRIGGER_TOKENS", 20)
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET", 850)
+    schedule = MagicMock()
+    monkeypatch.setattr(service.summarizer, "schedule", schedule)
+
+    messages = [{"role": "user", "content": f"消息{i}"} for i in range(1, 7)]
+    entry = {
+        "system_prompt": "提示词",
+        "messages": messages,
+        # 序号 1-2 已摘要，3-4 装不下预算，5-6 进入窗口
+        "token_counts": [10, 10, 100, 100, 400, 400],
+        "last_seq": 6,
+        "summary": "用户在问天气",
+        "summary_seq": 2,
+    }
+
+    prompt, history = service._build_turn_context("summary-session", entry)
+
+    assert prompt.startswith("提示词")
+    assert "用户在问天气" in prompt
+    assert [m["content"] for m in history] == ["消息5", "消息6"]
+    schedule.assert_called_once_with("summary-session", 4)
+
+
+async def test_aligned_window_keeps_prefix_stable(monkeypatch):
+    """
+    测试: aligned 模式下窗口起点落在块边界上，新消息到来时起点保持不变，
+    直到预算装不下才整块前移。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WINDOW_MODE", "aligned")
+    monkeypatch.setattr(settings, "HISTORY_BLOCK_SIZE", 4)
+
+    def window_start(total):
+        buffer = [{"role": "user", "content": f"消息{i}"} for i in range(1, total + 1)]
+        window = _select_window(buffer, [10] * total, budget=100, first_seq=1)
+        return window[0]["content"]
+
+    # 预算装得下 10 条；起点对齐到序号 1、5、9... 这些块的开头
+    assert window_start(12) == "消息5"
+    assert window_start(13) == "消息5"
+    assert window_start(14) == "消息5"
+    assert window_start(15) == "消息9"
+
+
+async def test_aligned_mode_keeps_summary_out_of_system_prompt(
+    service: SessionService, monkeypatch
+):
+    """
+    测试: aligned 模式下摘要作为单独的 system 消息放在历史之前，系统提示词保持不变。
+    """
+    monkeypatch.setattr(settings, "HISTORY_WINDOW_MODE", "aligned")
+    entry = {
+        "system_prompt": "提示词",
+        "messages": [{"role": "user", "content": "消息3"}],
+        "token_counts": [10],
+        "last_seq": 3,
+        "summary": "用户在问天气",
+        "summary_seq": 2,
+    }
+
+    prompt, history = service._build_turn_context("aligned-session", entry)
+
+    assert prompt == "提示词"
+    assert history[0]["role"] == "system"
+    assert "用户在问天气" in history[0]["content"]
+    assert history[1]["content"] == "消息3"
 
 
 # --- END OF FILE tests/test_session_service.py (Corrected Version) ---
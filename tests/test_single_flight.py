@@ -0,0 +1,92 @@
+# --- START OF FILE tests/test_single_flight.py ---
+
+import asyncio
+
+import pytest
+
+from py_ai_core.services.single_flight import SingleFlight
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+async def test_concurrent_calls_share_one_execution():
+    """
+    测试: 相同键的并发调用只执行一次，所有调用方拿到同一个结果。
+    """
+    group = SingleFlight()
+    release = asyncio.Event()
+    executions = 0
+
+    async def fetch():
+        nonlocal executions
+        executions += 1
+        await release.wait()
+        return "答案"
+
+    waiters = [asyncio.create_task(group.do("k", fetch)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == ["答案"] * 5
+    assert executions == 1
+    assert group.stats()["coalesced"] == 4
+    assert group.stats()["in_flight"] == 0
+
+
+async def test_errors_are_shared_and_not_cached():
+    """
+    测试: 共享调用的异常传递给所有等待方；结束后新的调用会重新执行。
+    """
+    group = SingleFlight()
+    attempts = 0
+
+    async def flaky():
+        nonlocal attempts
+        attempts += 1
+        await asyncio.sleep(0)
+        if attempts == 1:
+            raise RuntimeError("上游错误")
+        return "ok"
+
+    results = await asyncio.gather(
+        group.do("k", flaky), group.do("k", flaky), return_exceptions=True
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert await group.do("k", flaky) == "ok"
+
+
+async def test_cancelled_waiter_does_not_cancel_shared_call():
+    """
+    测试: 一个等待方被取消不影响其他等待方；全部取消后共享调用才被取消。
+    """
+    group = SingleFlight()
+    release = asyncio.Event()
+    started = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        await release.wait()
+        return "答案"
+
+    first = asyncio.create_task(group.do("k", fetch))
+    second = asyncio.create_task(group.do("k", fetch))
+    await started.wait()
+
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == "答案"
+    assert first.cancelled()
+
+    # 唯一的等待方取消时，共享调用也被取消
+    release.clear()
+    started.clear()
+    lonely = asyncio.create_task(group.do("k2", fetch))
+    await started.wait()
+    lonely.cancel()
+    await asyncio.sleep(0.01)
+    assert group.stats()["in_flight"] == 0
+
+
+# --- END OF FILE tests/test_single_flight.py ---
@@ -0,0 +1,67 @@
+# --- START OF FILE tests/test_state_backend.py ---
+
+import asyncio
+
+import pytest
+
+from py_ai_core.core.state_backend import InMemoryStateBackend, RedisStateBackend
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    """同一组用例分别在进程内后端和 fakeredis 上运行"""
+    if request.param == "memory":
+        return InMemoryStateBackend()
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisStateBackend(client=fakeredis.FakeAsyncRedis(), prefix="test:")
+
+
+async def test_set_get_delete_roundtrip(backend):
+    """
+    测试: 写入的 JSON 值可以原样读回，删除后读取返回 None。
+    """
+    value = {
+        "system_prompt": "提示词",
+        "messages": [{"role": "user", "content": "你好"}],
+    }
+
+    await backend.set("session:s1", value)
+
+    assert await backend.get("session:s1") == value
+    assert await backend.get("session:missing") is None
+
+    await backend.delete("session:s1")
+    assert await backend.get("session:s1") is None
+
+
+async def test_ttl_expires_key(backend):
+    """
+    测试: 设置了 ttl 的键在过期后不可读取。
+    """
+    await backend.set("health", {"status": "ok"}, ttl=0.05)
+    assert await backend.get("health") == {"status": "ok"}
+
+    await asyncio.sleep(0.1)
+
+    assert await backend.get("health") is None
+
+
+async def test_memory_backend_evicts_least_recently_used():
+    """
+    测试: 进程内后端达到容量上限时淘汰最久未使用的键。
+    """
+    backend = InMemoryStateBackend(maxsize=2)
+    await backend.set("a", 1)
+    await backend.set("b", 2)
+    await backend.get("a")
+    await backend.set("c", 3)
+
+    assert await backend.get("a") == 1
+    assert await backend.get("b") is None
+    assert await backend.get("c") == 3
+
+
+# --- END OF FILE tests/test_state_backend.py ---
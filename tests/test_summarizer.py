@@ -0,0 +1,55 @@
+# --- START OF FILE tests/test_summarizer.py ---
+
+import asyncio
+
+import pytest
+
+from py_ai_core.services.summarizer import BackgroundSummarizer
+
+# 标记所有测试为异步
+pytestmark = pytest.mark.asyncio
+
+
+async def test_one_summary_task_per_session():
+    """
+    测试: 同一会话的摘要任务在运行期间不会重复提交，完成后可以再次提交。
+    """
+    release = asyncio.Event()
+    calls = []
+
+    async def refresh(session_id, upto_seq):
+        calls.append((session_id, upto_seq))
+        await release.wait()
+
+    summarizer = BackgroundSummarizer(refresh)
+
+    assert summarizer.schedule("s1", 10)
+    assert not summarizer.schedule("s1", 12)
+    assert summarizer.schedule("s2", 3)
+
+    release.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    assert summarizer.schedule("s1", 12)
+    await summarizer.stop()
+    assert calls[:2] == [("s1", 10), ("s2", 3)]
+
+
+async def test_failed_refresh_does_not_propagate():
+    """
+    测试: 摘要失败只记录日志，不影响后续提交。
+    """
+
+    async def refresh(session_id, upto_seq):
+        raise RuntimeError("模型不可用")
+
+    summarizer = BackgroundSummarizer(refresh)
+    summarizer.schedule("s1", 5)
+    await asyncio.sleep(0.01)
+
+    assert summarizer.schedule("s1", 6)
+    await summarizer.stop()
+
+
+# --- END OF FILE tests/test_summarizer.py ---
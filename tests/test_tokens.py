@@ -0,0 +1,51 @@
+# --- START OF FILE tests/test_tokens.py ---
+
+from py_ai_core.core import tokens
+from py_ai_core.core.config import settings
+
+
+def test_heuristic_counts_cjk_per_char(monkeypatch):
+    """
+    测试: 没有 tiktoken 时，中文按字计数，其余字符按每 4 个字符 1 个 token 估算。
+    """
+    monkeypatch.setattr(tokens, "tiktoken", None)
+
+    assert tokens.count_text_tokens("你好世界") == 4
+    assert tokens.count_text_tokens("abcdefgh") == 2
+    assert tokens.count_text_tokens("") == 0
+
+
+def test_message_tokens_include_tool_calls(monkeypatch):
+    """
+    测试: 工具调用的函数名和参数也计入消息的 token 数。
+    """
+    monkeypatch.setattr(tokens, "tiktoken", None)
+    plain = {"role": "assistant", "content": None}
+    with_call = {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [
+            {
+                "id": "call_1",
+                "type": "function",
+                "function": {"name": "calculate", "arguments": '{"expression": "1+1"}'},
+            }
+        ],
+    }
+
+    assert tokens.count_message_tokens(plain) == tokens.MESSAGE_OVERHEAD_TOKENS
+    assert tokens.count_message_tokens(with_call) > tokens.count_message_tokens(plain)
+
+
+def test_history_budget_per_model(monkeypatch):
+    """
+    测试: 按模型配置的预算优先，未配置的模型使用默认预算。
+    """
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGET", 4000)
+    monkeypatch.setattr(settings, "HISTORY_TOKEN_BUDGETS", {"big-model": 100000})
+
+    assert tokens.history_token_budget("big-model") == 100000
+    assert tokens.history_token_budget("other-model") == 4000
+
+
+# --- END OF FILE tests/test_tokens.py ---
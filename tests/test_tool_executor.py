@@ -0,0 +1,146 @@
+# --- START OF FILE tests/test_tool_executor.py ---
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from py_ai_core.core.state_backend import InMemoryStateBackend
+from py_ai_core.mcp import router
+from py_ai_core.tools.executor import ToolExecutor, ToolTimeoutError
+from py_ai_core.tools.registry import ToolErrorResult, ToolOptions, tool_registry
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def register(monkeypatch):
+    """临时注册一个带选项的工具，测试结束后自动移除。"""
+
+    def _register(name, func, **options):
+        monkeypatch.setitem(tool_registry.tools, name, func)
+        monkeypatch.setitem(tool_registry.tool_options, name, ToolOptions(**options))
+
+    return _register
+
+
+async def test_pure_tool_is_memoized_on_canonical_arguments(register):
+    """
+    测试: 纯函数工具的结果按规范化后的参数缓存，参数顺序不同也命中同一条缓存。
+    """
+    calls = []
+
+    async def add(a: int, b: int) -> int:
+        calls.append((a, b))
+        return a + b
+
+    register("add", add, pure=True)
+    tool_executor = ToolExecutor(state=InMemoryStateBackend())
+
+    assert await tool_executor.run("add", add, {"a": 1, "b": 2}) == "3"
+    assert await tool_executor.run("add", add, {"b": 2, "a": 1}) == "3"
+    assert await tool_executor.run("add", add, {"a": 2, "b": 2}) == "4"
+    assert calls == [(1, 2), (2, 2)]
+    assert tool_executor.get_stats()["cache_hits"] == 1
+
+
+async def test_error_results_are_not_cached(register):
+    """
+    测试: 工具以 ToolErrorResult 报告的错误照常返回给模型，但不进入结果缓存。
+    """
+    calls = 0
+
+    async def flaky(x: int) -> str:
+        nonlocal calls
+        calls += 1
+        return ToolErrorResult("暂时失败") if calls == 1 else str(x)
+
+    register("flaky", flaky, pure=True)
+    tool_executor = ToolExecutor(state=InMemoryStateBackend())
+
+    assert await tool_executor.run("flaky", flaky, {"x": 1}) == "暂时失败"
+    assert await tool_executor.run("flaky", flaky, {"x": 1}) == "1"
+    assert await tool_executor.run("flaky", flaky, {"x": 1}) == "1"
+    assert calls == 2
+    assert tool_executor.get_stats()["cache_hits"] == 1
+
+
+async def test_idempotent_calls_are_coalesced_but_not_cached(register):
+    """
+    测试: 幂等工具的相同并发调用只执行一次；没有声明 cache_ttl 时不缓存结果。
+    """
+    calls = 0
+
+    async def lookup(key: str) -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return key.upper()
+
+    register("lookup", lookup, idempotent=True)
+    tool_executor = ToolExecutor(state=InMemoryStateBackend())
+
+    results = await asyncio.gather(
+        *[tool_executor.run("lookup", lookup, {"key": "x"}) for _ in range(5)]
+    )
+    assert results == ["X"] * 5
+    assert calls == 1
+    assert tool_executor.get_stats()["coalesced"] == 4
+
+    await tool_executor.run("lookup", lookup, {"key": "x"})
+    assert calls == 2
+
+
+async def test_max_concurrency_caps_each_tool(register):
+    """
+    测试: 声明了 max_concurrency 的工具同时执行的调用数不超过上限。
+    """
+    running = peak = 0
+
+    async def slow(i: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        return i
+
+    register("slow", slow, max_concurrency=2)
+    tool_executor = ToolExecutor(state=InMemoryStateBackend())
+
+    await asyncio.gather(*[tool_executor.run("slow", slow, {"i": i}) for i in range(6)])
+    assert peak == 2
+
+
+async def test_slow_tool_is_cancelled_and_reported_as_timeout(monkeypatch, register):
+    """
+    测试: 超过 timeout 的调用被取消，模型收到结构化的 timeout 错误。
+    """
+    cancelled = asyncio.Event()
+
+    async def hang() -> str:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return "never"
+
+    register("hang", hang, timeout=0.05)
+    tool_executor = ToolExecutor(state=InMemoryStateBackend())
+    with pytest.raises(ToolTimeoutError):
+        await tool_executor.run("hang", hang, {})
+    assert cancelled.is_set()
+
+    monkeypatch.setattr(router, "tool_executor", tool_executor)
+    tool_call = SimpleNamespace(
+        id="call_1", function=SimpleNamespace(name="hang", arguments="{}")
+    )
+    result = await router.execute_tool(tool_call, "timeout-session")
+    error = json.loads(result["content"])["error"]
+    assert error["type"] == "timeout"
+    assert tool_executor.get_stats()["timeouts"] == 2
+
+
+# --- END OF FILE tests/test_tool_executor.py ---
@@ -0,0 +1,114 @@
+# --- START OF FILE tests/test_tool_registry.py ---
+
+import json
+from types import SimpleNamespace
+from typing import List, Literal, Optional
+from unittest.mock import AsyncMock
+
+import pytest
+from pydantic import BaseModel
+
+from py_ai_core.mcp import router
+from py_ai_core.tools.registry import ToolArgumentError, ToolRegistry, tool_registry
+
+
+class Address(BaseModel):
+    city: str
+    zip_code: Optional[str] = None
+
+
+async def ship(
+    items: List[str],
+    address: Address,
+    speed: Literal["standard", "express"] = "standard",
+    note: Optional[str] = None,
+    copies=1,
+) -> str:
+    """
+    创建一个发货单。
+    发货单创建后不能修改。
+
+    这一段是给开发者看的详细说明，不会发给模型。
+
+    :param items: 要发货的商品编号列表。
+    :param address: 收货地址，
+        城市必填。
+    :param speed: 配送速度。
+    :return: 发货单编号。
+    """
+    return f"{len(items)}:{address.city}:{speed}"
+
+
+@pytest.fixture
+def registry():
+    registry = ToolRegistry()
+    registry.register(ship)
+    return registry
+
+
+def test_schema_follows_type_hints_and_docstring(registry):
+    """
+    测试: 参数 schema 由类型注解生成（列表、嵌套模型、Literal 枚举、Optional），
+    参数说明与工具描述来自文档字符串（描述只取第一段摘要），没有说明的参数不带 description。
+    """
+    function = registry.get_all_schemas()[0]["function"]
+    assert function["description"] == "创建一个发货单。\n发货单创建后不能修改。"
+
+    parameters = function["parameters"]
+    properties = parameters["properties"]
+    assert parameters["required"] == ["items", "address"]
+    assert properties["items"]["type"] == "array"
+    assert properties["items"]["items"] == {"type": "string"}
+    assert properties["address"]["description"] == "收货地址， 城市必填。"
+    assert properties["speed"]["enum"] == ["standard", "express"]
+    assert "description" not in properties["note"]
+    assert parameters["$defs"]["Address"]["required"] == ["city"]
+    assert "title" not in parameters["$defs"]["Address"]
+    assert "title" not in properties["items"]
+
+
+def test_validate_arguments_coerces_and_rejects(registry):
+    """
+    测试: 参数按注解转换（嵌套对象转换为模型实例、补上默认值），
+    不合法的枚举值、缺失的必填参数和多余的参数都被拒绝。
+    """
+    args = registry.validate_arguments(
+        "ship", {"items": ["a", "b"], "address": {"city": "上海"}}
+    )
+    assert isinstance(args["address"], Address)
+    assert args["speed"] == "standard"
+    assert args["copies"] == 1
+
+    with pytest.raises(ToolArgumentError, match="speed"):
+        registry.validate_arguments(
+            "ship", {"items": [], "address": {"city": "上海"}, "speed": "rocket"}
+        )
+    with pytest.raises(ToolArgumentError, match="address"):
+        registry.validate_arguments("ship", {"items": [], "extra": 1})
+
+
+@pytest.mark.asyncio
+async def test_execute_tool_rejects_malformed_arguments(monkeypatch):
+    """
+    测试: 参数不合法时 execute_tool 直接返回结构化错误，不调用工具。
+    """
+    executor_run = AsyncMock()
+    monkeypatch.setattr(router.tool_executor, "run", executor_run)
+
+    for arguments in ['{"expression": 42, "oops": true}', "{not json"]:
+        tool_call = SimpleNamespace(
+            id="call_1",
+            function=SimpleNamespace(name="calculate", arguments=arguments),
+        )
+        result = await router.execute_tool(tool_call, "registry-session")
+        error = json.loads(result["content"])["error"]
+        assert error["type"] == "invalid_arguments"
+
+    executor_run.assert_not_awaited()
+    assert tool_registry.validate_arguments("calculate", {"expression": "1"}) == {
+        "expression": "1",
+        "variables": None,
+    }
+
+
+# --- END OF FILE tests/test_tool_registry.py ---
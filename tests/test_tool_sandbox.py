@@ -0,0 +1,206 @@
+# --- START OF FILE tests/test_tool_sandbox.py ---
+
+import asyncio
+import json
+import multiprocessing
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import pytest_asyncio
+
+from py_ai_core.core.config import settings
+from py_ai_core.mcp import router
+from py_ai_core.tools import executor
+from py_ai_core.tools.math_tools import calculate
+from py_ai_core.tools.registry import ToolOptions, tool_registry
+from py_ai_core.tools.sandbox import (
+    DEFAULT_PRELOAD,
+    SandboxCrashedError,
+    SandboxLimitExceeded,
+    ToolSandbox,
+    resource,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+def spin(seconds: float) -> str:
+    """一个失控的计算密集型工具（模块级函数，才能传给工作进程）。"""
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+    return "done"
+
+
+def hog(mb: int) -> int:
+    """一次性申请超过内存上限的内存。"""
+    return len(bytearray(mb * 1024 * 1024))
+
+
+def probe() -> dict:
+    """返回工作进程内生效的内存上限，以及预加载的模块是否都已导入。"""
+    return {
+        "memory_limit": resource.getrlimit(resource.RLIMIT_AS)[0],
+        "preloaded": all(module in sys.modules for module in DEFAULT_PRELOAD),
+    }
+
+
+@pytest_asyncio.fixture
+async def sandbox():
+    pool = ToolSandbox(workers=1, cpu_seconds=0, wall_seconds=1.0)
+    yield pool
+    await pool.shutdown()
+
+
+async def test_sandbox_runs_tool_in_worker(sandbox):
+    """
+    测试: 工具在工作进程中执行并返回结果，工作进程在调用之间复用。
+    """
+    assert await sandbox.run(calculate, {"expression": "10 * (3 + 5) / 2"}) == "40.0"
+    assert await sandbox.run(calculate, {"expression": "sqrt(144)"}) == "12.0"
+    stats = sandbox.get_stats()
+    assert stats["calls"] == 2
+    assert stats["idle_workers"] == 1
+
+
+async def test_runaway_tool_is_killed_and_loop_stays_responsive(sandbox):
+    """
+    测试: 超过墙钟时间上限的调用被中止，期间事件循环照常运行，
+    被杀掉的工作进程由新进程替换，后续调用正常。
+    """
+    await sandbox.run(calculate, {"expression": "1 + 1"})  # 先启动工作进程
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.05)
+            ticks += 1
+
+    ticking = asyncio.create_task(ticker())
+    try:
+        with pytest.raises(SandboxLimitExceeded) as exc_info:
+            await sandbox.run(spin, {"seconds": 30})
+    finally:
+        ticking.cancel()
+    assert exc_info.value.limit == "wall"
+    assert ticks >= 10
+
+    assert await sandbox.run(calculate, {"expression": "2 ** 10"}) == "1024"
+    assert sandbox.get_stats()["limit_exceeded"] == 1
+
+
+async def test_execute_tool_returns_structured_timeout(monkeypatch, sandbox):
+    """
+    测试: 沙箱中的工具超时时，模型收到结构化的 timeout 错误。
+    """
+    assert tool_registry.get_options("calculate").sandboxed
+    monkeypatch.setattr(executor, "tool_sandbox", sandbox)
+    monkeypatch.setitem(tool_registry.tools, "spin", spin)
+    monkeypatch.setitem(tool_registry.tool_options, "spin", ToolOptions(cpu_bound=True))
+    tool_call = SimpleNamespace(
+        id="call_1",
+        function=SimpleNamespace(name="spin", arguments=json.dumps({"seconds": 30})),
+    )
+
+    result = await router.execute_tool(tool_call, "sandbox-session")
+
+    assert result["tool_call_id"] == "call_1"
+    error = json.loads(result["content"])["error"]
+    assert error["type"] == "timeout"
+    assert error["limit"] == "wall"
+
+
+async def test_killed_worker_is_reaped_without_blocking_join(monkeypatch, sandbox):
+    """
+    测试: 杀掉与回收工作进程时事件循环线程上不调用阻塞的 join()，进程仍会被回收。
+    """
+    await sandbox.run(calculate, {"expression": "1 + 1"})  # 先启动工作进程
+    process = sandbox._idle[0].process
+    joins = []
+    loop_thread = threading.get_ident()
+    join = multiprocessing.process.BaseProcess.join
+
+    def tracking_join(self, timeout=None):
+        if threading.get_ident() == loop_thread:
+            joins.append(timeout)
+        return join(self, timeout)
+
+    monkeypatch.setattr(multiprocessing.process.BaseProcess, "join", tracking_join)
+    with pytest.raises(SandboxLimitExceeded):
+        await sandbox.run(spin, {"seconds": 30})
+    await asyncio.gather(*sandbox._reaping)
+
+    assert joins == []
+    assert process.exitcode is not None
+
+
+@pytest.mark.skipif(resource is None, reason="平台不支持 resource 模块")
+async def test_preload_fits_in_configured_memory_limit():
+    """
+    测试: 在配置的 RLIMIT_AS 上限下，工作进程能导入全部预加载模块并正常执行调用。
+    """
+    pool = ToolSandbox(workers=1, memory_mb=settings.TOOL_SANDBOX_MEMORY_MB)
+    try:
+        result = await pool.run(probe, {})
+    finally:
+        await pool.shutdown()
+    assert result["memory_limit"] == settings.TOOL_SANDBOX_MEMORY_MB * 1024 * 1024
+    assert result["preloaded"]
+
+
+@pytest.mark.skipif(resource is None, reason="平台不支持 resource 模块")
+async def test_memory_limit_replaces_worker():
+    """
+    测试: 超出内存上限的调用报告 memory 超限，出事的工作进程被替换而不是放回空闲列表。
+    """
+    pool = ToolSandbox(workers=1, memory_mb=settings.TOOL_SANDBOX_MEMORY_MB)
+    try:
+        with pytest.raises(SandboxLimitExceeded) as exc_info:
+            await pool.run(hog, {"mb": settings.TOOL_SANDBOX_MEMORY_MB * 2})
+        assert exc_info.value.limit == "memory"
+        assert pool.get_stats()["live_workers"] == 0
+
+        assert await pool.run(calculate, {"expression": "1 + 1"}) == "2"
+    finally:
+        await pool.shutdown()
+
+
+async def test_cancelled_call_leaves_no_thread_and_shutdown_kills_busy_workers(
+    monkeypatch, sandbox
+):
+    """
+    测试: 调用方被取消时不会留下阻塞等待结果的线程；关闭时连执行中的工作进程一起杀掉。
+    """
+    await sandbox.run(calculate, {"expression": "1 + 1"})  # 先启动工作进程
+    offloaded = []
+    to_thread = asyncio.to_thread
+
+    async def tracking_to_thread(func, *args, **kwargs):
+        offloaded.append(func)
+        return await to_thread(func, *args, **kwargs)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(asyncio, "to_thread", tracking_to_thread)
+        call = asyncio.create_task(sandbox.run(spin, {"seconds": 30}))
+        await asyncio.sleep(0.1)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+    # 等待结果时没有把阻塞的 poll() 交给线程
+    assert offloaded == []
+    assert sandbox.get_stats()["live_workers"] == 0
+
+    busy = asyncio.create_task(sandbox.run(spin, {"seconds": 30}))
+    await asyncio.sleep(0.5)
+    assert sandbox.get_stats()["live_workers"] == 1
+    await sandbox.shutdown()
+    assert sandbox.get_stats()["live_workers"] == 0
+    with pytest.raises(SandboxCrashedError):
+        await busy
+
+
+# --- END OF FILE tests/test_tool_sandbox.py ---
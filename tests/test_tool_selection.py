@@ -0,0 +1,146 @@
+# --- START OF FILE tests/test_tool_selection.py ---
+
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.tools.general_tools import get_current_datetime, get_current_weather
+from py_ai_core.tools.math_tools import calculate
+from py_ai_core.tools.registry import ToolRegistry
+from py_ai_core.tools.search_index import BM25Index, tokenize
+from py_ai_core.tools.selection import ToolSelector
+
+# 模拟一个较大的工具目录
+_FILLER_TOPICS = [
+    "订单",
+    "库存",
+    "发票",
+    "邮件",
+    "日历",
+    "翻译",
+    "股票",
+    "航班",
+    "酒店",
+    "快递",
+]
+
+
+def _make_tool(name: str, doc: str):
+    async def fake_tool(keyword: str) -> str:
+        return keyword
+
+    fake_tool.__name__ = name
+    fake_tool.__doc__ = f"{doc}\n\n:param keyword: 查询关键词。"
+    return fake_tool
+
+
+@pytest.fixture
+def selector(monkeypatch):
+    registry = ToolRegistry()
+    for func in (get_current_weather, get_current_datetime, calculate):
+        registry.register(func)
+    for i, topic in enumerate(_FILLER_TOPICS * 5):
+        registry.register(
+            _make_tool(f"{topic}_tool_{i}", f"查询或管理{topic}相关的记录。")
+        )
+    registry.register(_make_tool("search_docs", "在内部文档中搜索资料。"), pinned=True)
+    monkeypatch.setattr(settings, "TOOL_SELECTION_TOP_K", 5)
+    return ToolSelector(registry)
+
+
+def test_tokenize_mixes_words_and_cjk_bigrams():
+    """
+    测试: 英文按单词切分（下划线也是分隔符），中文切成单字与相邻两字的组合。
+    """
+    assert tokenize("get_current WEATHER 天气好") == [
+        "get",
+        "current",
+        "weather",
+        "天",
+        "气",
+        "好",
+        "天气",
+        "气好",
+    ]
+
+
+def test_bm25_ranks_and_replaces_documents():
+    """
+    测试: BM25 按相关度排序，只返回命中的文档；同一文档再次加入时替换原内容。
+    """
+    index = BM25Index()
+    index.add("weather", "查询城市的天气 天气预报")
+    index.add("stock", "查询股票价格")
+    assert [doc for doc, _ in index.search("明天天气", 5)] == ["weather"]
+
+    index.add("weather", "汇率换算")
+    assert index.search("天气", 5) == []
+    assert len(index) == 2
+
+
+def test_on_mode_offers_top_k_plus_pinned(monkeypatch, selector):
+    """
+    测试: on 模式下只提供检索出的 top-k 工具与固定工具，相关工具排在结果中。
+    """
+    monkeypatch.setattr(settings, "TOOL_SELECTION_MODE", "on")
+
+    selection = selector.select("北京明天的天气怎么样？")
+    names = [s["function"]["name"] for s in selection.schemas]
+    assert "get_current_weather" in names
+    assert "search_docs" in names
+    assert len(names) <= settings.TOOL_SELECTION_TOP_K + 1
+
+    assert "calculate" in selector.select("帮我计算这个数学表达式").selected
+    stats = selector.get_stats()
+    assert stats["selections"] == 2
+    assert stats["avg_offered_tools"] < stats["avg_catalog_tools"]
+
+
+def test_follow_up_keeps_tools_called_in_history(monkeypatch, selector):
+    """
+    测试: 不含关键词的追问也能拿到历史中调用过的工具。
+    """
+    monkeypatch.setattr(settings, "TOOL_SELECTION_MODE", "on")
+    history = [
+        {"role": "user", "content": "北京天气怎么样？"},
+        {
+            "role": "assistant",
+            "tool_calls": [{"id": "1", "function": {"name": "get_current_weather"}}],
+        },
+        {"role": "tool", "tool_call_id": "1", "content": "晴"},
+        {"role": "assistant", "content": "北京晴。"},
+    ]
+
+    assert "get_current_weather" not in selector.select("那上海呢？").selected
+    selection = selector.select("那上海呢？", history)
+    assert "get_current_weather" in selection.selected
+    assert "get_current_weather" in [s["function"]["name"] for s in selection.schemas]
+
+
+def test_shadow_mode_measures_recall(monkeypatch, selector):
+    """
+    测试: shadow 模式照常提供全部工具，并用模型实际调用的工具统计召回率；off 模式不做检索。
+    """
+    monkeypatch.setattr(settings, "TOOL_SELECTION_MODE", "shadow")
+    selection = selector.select("现在的天气")
+    assert len(selection.schemas) == len(selector.registry.get_all_schemas())
+
+    messages = [
+        {"role": "user", "content": "现在的天气"},
+        {
+            "role": "assistant",
+            "tool_calls": [
+                {"id": "1", "function": {"name": "get_current_weather"}},
+                {"id": "2", "function": {"name": "订单_tool_0"}},
+            ],
+        },
+    ]
+    selector.record_calls(selection, messages)
+    stats = selector.get_stats()
+    assert stats["called_tools"] == 2
+    assert stats["recall"] == 0.5
+
+    monkeypatch.setattr(settings, "TOOL_SELECTION_MODE", "off")
+    assert selector.select("现在的天气").selected is None
+
+
+# --- END OF FILE tests/test_tool_selection.py ---
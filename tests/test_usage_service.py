@@ -0,0 +1,89 @@
+# --- START OF FILE tests/test_usage_service.py ---
+
+import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from py_ai_core.core.config import settings
+from py_ai_core.services.usage_service import (
+    accumulate_usage,
+    record_usage,
+    usage_report,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_accumulate_usage_merges_requests():
+    """
+    测试: 多轮对话的用量按字段累加，requests 记录聊天请求数。
+    """
+    total = {}
+    accumulate_usage(total, {"llm_calls": 2, "prompt_tokens": 100})
+    accumulate_usage(total, {"llm_calls": 1, "cached_tokens": 30})
+    accumulate_usage(total, {"llm_calls": 1}, requests=0)
+
+    assert total == {
+        "requests": 2,
+        "llm_calls": 4,
+        "prompt_tokens": 100,
+        "completion_tokens": 0,
+        "cached_tokens": 30,
+    }
+
+
+async def test_record_usage_skips_empty_and_disabled(monkeypatch):
+    """
+    测试: 没有任何用量或关闭统计时不写入汇总表。
+    """
+    db = AsyncMock()
+    await record_usage(db, {"s": accumulate_usage({}, None, requests=0)})
+    db.execute.assert_not_awaited()
+
+    monkeypatch.setattr(settings, "USAGE_ACCOUNTING_ENABLED", False)
+    await record_usage(db, {"s": accumulate_usage({}, {"llm_calls": 1})})
+    db.execute.assert_not_awaited()
+
+
+async def test_usage_report_totals_buckets():
+    """
+    测试: 总计由各时间桶相加得到，并拒绝不支持的时间粒度。
+    """
+    start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    bucket_rows = [
+        MagicMock(
+            bucket_start=start,
+            requests=1,
+            llm_calls=2,
+            prompt_tokens=10,
+            completion_tokens=5,
+            cached_tokens=0,
+        ),
+        MagicMock(
+            bucket_start=start + datetime.timedelta(hours=1),
+            requests=3,
+            llm_calls=3,
+            prompt_tokens=30,
+            completion_tokens=15,
+            cached_tokens=8,
+        ),
+    ]
+    db = AsyncMock()
+    db.execute.side_effect = [
+        MagicMock(all=MagicMock(return_value=bucket_rows)),
+        MagicMock(all=MagicMock(return_value=[])),
+    ]
+
+    report = await usage_report(db, start)
+
+    assert report["totals"]["requests"] == 4
+    assert report["totals"]["prompt_tokens"] == 40
+    assert report["totals"]["cached_tokens"] == 8
+    assert len(report["buckets"]) == 2
+
+    with pytest.raises(ValueError):
+        await usage_report(db, start, granularity="week")
+
+
+# --- END OF FILE tests/test_usage_service.py ---